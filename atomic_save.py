@@ -0,0 +1,115 @@
+"""Crash-safe saves: write a temp file next to the target, verify, fsync, os.replace."""
+import os
+import shutil
+import struct
+import threading
+import zipfile
+from typing import Dict, Iterable, Optional, Tuple
+
+REQUIRED_PARTS = ("[Content_Types].xml",)
+ZIP64_MARKER = 0xFFFFFFFF
+
+
+def temp_path_for(target: str) -> str:
+    """Hidden temp name in the target's directory (same filesystem, so the
+    final os.replace is atomic); unique per process and thread."""
+    dirn = os.path.dirname(os.path.abspath(target))
+    base = os.path.basename(target)
+    return os.path.join(dirn, f".{base}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def fsync_path(path: str) -> None:
+    """Flush a file's data to stable storage."""
+    with open(path, "rb+") as fp:
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+def _fsync_dir(dirn: str) -> None:
+    """Persist the rename itself (POSIX only; Windows has no directory fsync)."""
+    if os.name != "posix":
+        return
+    try:
+        fd = os.open(dirn, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def verify_zip(path: str, unchanged: Optional[Dict[str, Tuple[int, int, int]]] = None,
+               required: Iterable[str] = REQUIRED_PARTS) -> str:
+    """Cheap structural check of a freshly written xlsx.
+    Reads the central directory, checks that `required` parts exist, that
+    every local header is where the directory says and agrees with it on
+    (CRC, compressed size, size), and that parts copied unchanged carry the
+    same values as in the source. Nothing is inflated. Returns "" when fine,
+    else why not."""
+    try:
+        size = os.path.getsize(path)
+        with zipfile.ZipFile(path) as zf, open(path, "rb") as fp:
+            infos = {info.filename: info for info in zf.infolist()}
+            for name in required:
+                if name not in infos:
+                    return f"missing part {name}"
+            for info in infos.values():
+                fp.seek(info.header_offset)
+                header = fp.read(30)
+                if len(header) < 30 or header[:4] != b"PK\x03\x04":
+                    return f"bad local header for {info.filename}"
+                flags, = struct.unpack("<H", header[6:8])
+                local = struct.unpack("<III", header[14:26])
+                # sizes deferred to a data descriptor (bit 3) or to zip64 extras
+                if not flags & 0x08 and ZIP64_MARKER not in local[1:] and (
+                        local != (info.CRC, info.compress_size, info.file_size)):
+                    return f"local header disagrees with the directory for {info.filename}"
+                name_len, extra_len = struct.unpack("<HH", header[26:30])
+                data_end = info.header_offset + 30 + name_len + extra_len + info.compress_size
+                if data_end > size:
+                    return f"truncated part {info.filename}"
+            for name, expected in (unchanged or {}).items():
+                info = infos.get(name)
+                if info is None:
+                    return f"missing copied part {name}"
+                if (info.CRC, info.compress_size, info.file_size) != expected:
+                    return f"CRC/size mismatch for copied part {name}"
+    except (OSError, zipfile.BadZipFile, ValueError) as err:
+        return f"unreadable zip ({err})"
+    return ""
+
+
+def commit_temp(tmp_path: str, target: str,
+                unchanged: Optional[Dict[str, Tuple[int, int, int]]] = None,
+                required: Iterable[str] = REQUIRED_PARTS) -> None:
+    """Verify, fsync and atomically move `tmp_path` over `target`.
+    Raises OSError (and removes the temp file) if verification fails, so the
+    original is never replaced by a broken file."""
+    problem = verify_zip(tmp_path, unchanged, required)
+    if problem:
+        discard_temp(tmp_path)
+        raise OSError(f"verification failed for {target}: {problem}")
+    install_temp(tmp_path, target)
+
+
+def install_temp(tmp_path: str, target: str) -> None:
+    """fsync and atomically move an already verified `tmp_path` over `target`."""
+    if os.path.exists(target):
+        try:
+            shutil.copymode(target, tmp_path)
+        except OSError:
+            pass
+    fsync_path(tmp_path)
+    os.replace(tmp_path, target)
+    _fsync_dir(os.path.dirname(os.path.abspath(target)))
+
+
+def discard_temp(tmp_path: str) -> None:
+    """Best-effort removal of a temp file."""
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
@@ -0,0 +1,139 @@
+"""Retention policy and background pruning for timestamped workbook backups."""
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+BACKUP_NAME_RE = re.compile(r"^(?P<base>.+)\.backup\.(?P<stamp>\d{8}_\d{6})$")
+
+
+class RetentionPolicy(NamedTuple):
+    """Which backups survive pruning (a backup is kept if any rule keeps it).
+    keep_last: newest N per workbook; keep_daily / keep_weekly: newest backup
+    of each of the last N days / ISO weeks that have one; max_total_bytes:
+    cap for all backups in a directory, oldest go first (the newest backup
+    of each workbook is never removed)."""
+    keep_last: int = 10
+    keep_daily: int = 7
+    keep_weekly: int = 4
+    max_total_bytes: Optional[int] = None
+
+
+DEFAULT_POLICY = RetentionPolicy()
+
+
+class BackupEntry(NamedTuple):
+    """One timestamped backup file found on disk."""
+    path: str
+    base: str
+    stamp: datetime
+    size: int
+
+
+def index_backups(directory: str) -> Dict[str, List[BackupEntry]]:
+    """Index `name.backup.YYYYmmdd_HHMMSS` files with one os.scandir pass.
+    Returns {original name: [entries, newest first]}."""
+    index: Dict[str, List[BackupEntry]] = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = BACKUP_NAME_RE.match(entry.name)
+                if not match:
+                    continue
+                try:
+                    stamp = datetime.strptime(match.group("stamp"), "%Y%m%d_%H%M%S")
+                    size = entry.stat().st_size  # cached by scandir on Windows
+                except (ValueError, OSError):
+                    continue
+                index.setdefault(match.group("base"), []).append(
+                    BackupEntry(entry.path, match.group("base"), stamp, size))
+    except OSError as err:
+        print(f"[WARNING] Cannot scan backups in {directory}: {err}")
+        return {}
+    for backups in index.values():
+        backups.sort(key=lambda item: item.stamp, reverse=True)
+    return index
+
+
+def _kept_by_rules(backups: List[BackupEntry], policy: RetentionPolicy) -> set:
+    """Paths kept by keep_last/keep_daily/keep_weekly (backups newest first)."""
+    keep = {item.path for item in backups[:policy.keep_last]}
+    days = {}
+    weeks = {}
+    for item in backups:
+        days.setdefault(item.stamp.date(), item.path)
+        weeks.setdefault(item.stamp.isocalendar()[:2], item.path)
+    keep.update(list(days.values())[:policy.keep_daily])
+    keep.update(list(weeks.values())[:policy.keep_weekly])
+    return keep
+
+
+def select_for_pruning(index: Dict[str, List[BackupEntry]],
+                       policy: RetentionPolicy) -> List[BackupEntry]:
+    """Return the backups `policy` would delete."""
+    doomed = []
+    kept = []
+    for backups in index.values():
+        keep = _kept_by_rules(backups, policy)
+        for pos, item in enumerate(backups):
+            if item.path in keep:
+                kept.append((pos == 0, item))
+            else:
+                doomed.append(item)
+    if policy.max_total_bytes is not None:
+        total = sum(item.size for _newest, item in kept)
+        # oldest first, never the newest backup of a workbook
+        for newest, item in sorted(kept, key=lambda pair: pair[1].stamp):
+            if total <= policy.max_total_bytes:
+                break
+            if newest:
+                continue
+            doomed.append(item)
+            total -= item.size
+    return doomed
+
+
+def prune_directory(directory: str, policy: RetentionPolicy = DEFAULT_POLICY,
+                    dry_run: bool = False) -> List[str]:
+    """Apply `policy` to the backups in `directory`; returns deleted paths."""
+    deleted = []
+    for item in select_for_pruning(index_backups(directory), policy):
+        if dry_run:
+            deleted.append(item.path)
+            continue
+        try:
+            os.remove(item.path)
+            deleted.append(item.path)
+        except OSError as err:
+            print(f"[WARNING] Could not prune backup {item.path}: {err}")
+    if deleted:
+        print(f"[INFO] Pruned {len(deleted)} backup(s) in {directory}")
+    return deleted
+
+
+# One low-priority thread; pruning never competes with the batch for workers.
+_PRUNE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prune")
+_pending: Dict[str, Future] = {}
+_pending_lock = threading.Lock()
+
+
+def schedule_prune(directory: str, policy: RetentionPolicy = DEFAULT_POLICY) -> Future:
+    """Prune `directory` in the background without blocking the caller.
+    Requests for a directory that is already queued are coalesced, so a
+    batch of thousands of files in one folder triggers a single scan."""
+    directory = os.path.abspath(directory or ".")
+    with _pending_lock:
+        future = _pending.get(directory)
+        if future is not None and not future.running() and not future.done():
+            return future
+
+        def _run():
+            with _pending_lock:
+                _pending.pop(directory, None)
+            return prune_directory(directory, policy)
+
+        future = _PRUNE_POOL.submit(_run)
+        _pending[directory] = future
+        return future
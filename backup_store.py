@@ -0,0 +1,341 @@
+"""Content-addressed, part-level deduplicating backup store for workbooks."""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Set
+
+from atomic_save import commit_temp, discard_temp, temp_path_for
+from backup_retention import DEFAULT_POLICY, BackupEntry, select_for_pruning
+from xlsx_zip import CHUNK_SIZE, ZipPartWriter, raw_member_offset
+
+STORE_DIRNAME = ".xlsx_backups"
+IN_MEMORY_LIMIT = 16 * 1024 * 1024
+MANIFEST_NAME_RE = re.compile(r"^(?P<base>.+)\.(?P<stamp>\d{8}_\d{6}_\d{6})\.json$")
+GC_GRACE_S = 2.0  # blobs touched this close to a GC scan are kept (mtime granularity)
+
+
+class _StoreLock:
+    """Shared/exclusive lock of one store: backups share it, garbage
+    collection holds it alone. A waiting collector blocks new backups, so a
+    long batch cannot starve it."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    @contextmanager
+    def shared(self):
+        """Held by a backup from its first blob to its manifest."""
+        with self._cond:
+            while self._exclusive or self._waiting:
+                self._cond.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        """Held while manifests and blobs are deleted."""
+        with self._cond:
+            self._waiting += 1
+            while self._exclusive or self._shared:
+                self._cond.wait()
+            self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+_locks: Dict[str, _StoreLock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(root: str) -> _StoreLock:
+    """The process-wide lock of the store at `root`."""
+    key = os.path.normcase(os.path.abspath(root))
+    with _locks_guard:
+        return _locks.setdefault(key, _StoreLock())
+
+
+class BackupStore:
+    """Stores each zip member once, keyed by the SHA-256 of its compressed
+    bytes, plus one small JSON manifest per backup.
+    Layout under `root`:
+        objects/ab/abcdef...   raw (still compressed) member data
+        manifests/<file>.<stamp>.json
+    Members are kept compressed, so backing up and restoring never inflate
+    or deflate anything; a reorder that only changes workbook.xml adds one
+    small blob and a manifest.
+    Backups and garbage collection of one store never overlap in this
+    process (_StoreLock); across processes GC spares fresh and *.tmp blobs,
+    and a backup touches every blob it reuses."""
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = _lock_for(root)
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+
+    @classmethod
+    def for_file(cls, path: str) -> "BackupStore":
+        """Default store: a hidden folder next to the workbook."""
+        return cls(os.path.join(os.path.dirname(os.path.abspath(path)), STORE_DIRNAME))
+
+    def _blob_path(self, digest: str) -> str:
+        """Where the blob with `digest` lives."""
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _store_blob(self, src_fp, offset: int, size: int) -> str:
+        """Hash member bytes and write them only if the blob is new."""
+        src_fp.seek(offset)
+        hasher = hashlib.sha256()
+        buffered = [] if size <= IN_MEMORY_LIMIT else None
+        remaining = size
+        while remaining:
+            chunk = src_fp.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile("truncated member")
+            hasher.update(chunk)
+            if buffered is not None:
+                buffered.append(chunk)
+            remaining -= len(chunk)
+        digest = hasher.hexdigest()
+        blob_path = self._blob_path(digest)
+        try:
+            os.utime(blob_path)  # reused: mark it fresh for a concurrent GC
+            return digest
+        except OSError:
+            pass
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # unique per writer: pool threads may store the same new blob at once
+        handle, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(blob_path))
+        try:
+            with os.fdopen(handle, "wb") as out:
+                if buffered is not None:
+                    out.writelines(buffered)
+                else:
+                    # large member: second read instead of holding it in memory
+                    src_fp.seek(offset)
+                    remaining = size
+                    while remaining:
+                        chunk = src_fp.read(min(CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise zipfile.BadZipFile("truncated member")
+                        out.write(chunk)
+                        remaining -= len(chunk)
+            os.replace(tmp_path, blob_path)
+        except BaseException:
+            discard_temp(tmp_path)
+            raise
+        return digest
+
+    def backup(self, path: str) -> str:
+        """Back up `path`; returns the manifest path ('' on failure)."""
+        try:
+            with self._lock.shared():
+                return self._backup(path)
+        except (OSError, zipfile.BadZipFile, ValueError) as err:
+            print(f"[ERROR while storing backup] {path}: {err}")
+            return ""
+
+    def _backup(self, path: str) -> str:
+        """backup() with the store lock held: blobs first, manifest last."""
+        members = []
+        with zipfile.ZipFile(path) as zf, open(path, "rb") as src_fp:
+            for info in zf.infolist():
+                offset = raw_member_offset(src_fp, info)
+                members.append({
+                    "name": info.filename,
+                    "method": info.compress_type,
+                    "crc": info.CRC,
+                    "compress_size": info.compress_size,
+                    "file_size": info.file_size,
+                    "date_time": list(info.date_time),
+                    "external_attr": info.external_attr,
+                    "blob": self._store_blob(src_fp, offset, info.compress_size),
+                })
+        stat = os.stat(path)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        manifest = {
+            "source": os.path.abspath(path),
+            "created": stamp,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "members": members,
+        }
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        manifest_path = os.path.join(
+            self.manifests_dir, f"{os.path.basename(path)}.{stamp}.json")
+        with open(manifest_path, "w", encoding="utf-8") as out:
+            json.dump(manifest, out, separators=(",", ":"))
+        return manifest_path
+
+    def list_backups(self, path: str = "") -> List[str]:
+        """Manifest paths (oldest first), optionally only those of `path`."""
+        try:
+            names = sorted(entry.name for entry in os.scandir(self.manifests_dir)
+                           if entry.name.endswith(".json"))
+        except OSError:
+            return []
+        if path:
+            prefix = os.path.basename(path) + "."
+            names = [name for name in names if name.startswith(prefix)]
+        return [os.path.join(self.manifests_dir, name) for name in names]
+
+    def restore(self, manifest_path: str, dst_path: str = "") -> bool:
+        """Reassemble a backed-up workbook from its blobs.
+        Writes to `dst_path`, or over the original source path by default
+        (through a verified temp file, see atomic_save.commit_temp)."""
+        tmp_path = ""
+        try:
+            with open(manifest_path, encoding="utf-8") as src:
+                manifest = json.load(src)
+            target = dst_path or manifest["source"]
+            tmp_path = temp_path_for(target)
+            with open(tmp_path, "wb") as out:
+                writer = ZipPartWriter(out)
+                for member in manifest["members"]:
+                    info = zipfile.ZipInfo(member["name"], tuple(member["date_time"]))
+                    info.external_attr = member["external_attr"]
+                    with open(self._blob_path(member["blob"]), "rb") as blob:
+                        writer.write_raw(info, member["method"], member["crc"],
+                                         member["compress_size"], member["file_size"], blob)
+                writer.close()
+            unchanged = {member["name"]: (member["crc"], member["compress_size"],
+                                          member["file_size"])
+                         for member in manifest["members"]}
+            commit_temp(tmp_path, target, unchanged)
+            return True
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as err:
+            print(f"[ERROR while restoring backup] {manifest_path}: {err}")
+            if tmp_path:
+                discard_temp(tmp_path)
+            return False
+
+    def _index(self) -> Dict[str, List[BackupEntry]]:
+        """{workbook name: [manifest entries, newest first]}."""
+        index = {}
+        for manifest_path in self.list_backups():
+            match = MANIFEST_NAME_RE.match(os.path.basename(manifest_path))
+            if not match:
+                continue
+            stamp = datetime.strptime(match.group("stamp"), "%Y%m%d_%H%M%S_%f")
+            index.setdefault(match.group("base"), []).append(BackupEntry(
+                manifest_path, match.group("base"), stamp, os.path.getsize(manifest_path)))
+        for backups in index.values():
+            backups.sort(key=lambda item: item.stamp, reverse=True)
+        return index
+
+    def _blob_sizes(self, manifest_path: str) -> Dict[str, int]:
+        """{blob digest: stored size} referenced by one manifest."""
+        with open(manifest_path, encoding="utf-8") as src:
+            return {member["blob"]: member["compress_size"] for member in json.load(src)["members"]}
+
+    def _over_budget(self, index: Dict[str, List[BackupEntry]], doomed: Set[str],
+                     max_total_bytes: int) -> List[str]:
+        """Oldest surviving manifests to drop until the store (deduplicated
+        blobs plus manifests) fits max_total_bytes; like select_for_pruning,
+        the newest backup of each workbook is never dropped."""
+        survivors = [(pos == 0, item) for backups in index.values()
+                     for pos, item in enumerate(backups) if item.path not in doomed]
+        blobs = {item.path: self._blob_sizes(item.path) for _newest, item in survivors}
+        refs: Dict[str, int] = {}
+        sizes: Dict[str, int] = {}
+        for blob_sizes in blobs.values():
+            for digest, size in blob_sizes.items():
+                refs[digest] = refs.get(digest, 0) + 1
+                sizes[digest] = size
+        total = sum(sizes.values()) + sum(item.size for _newest, item in survivors)
+        dropped = []
+        for newest, item in sorted(survivors, key=lambda pair: pair[1].stamp):
+            if total <= max_total_bytes:
+                break
+            if newest:
+                continue
+            dropped.append(item.path)
+            total -= item.size
+            for digest in blobs[item.path]:
+                refs[digest] -= 1
+                if not refs[digest]:
+                    total -= sizes[digest]
+        return dropped
+
+    def prune(self, policy=None) -> List[str]:
+        """Drop manifests per a backup_retention.RetentionPolicy, then delete
+        blobs no remaining manifest references. Returns deleted manifests.
+        max_total_bytes caps the deduplicated store size: oldest manifests
+        go first, and the blobs only they referenced are counted as freed."""
+        policy = policy or DEFAULT_POLICY
+        index = self._index()
+        doomed = [item.path for item in select_for_pruning(
+            index, policy._replace(max_total_bytes=None))]
+        if policy.max_total_bytes is not None:
+            doomed += self._over_budget(index, set(doomed), policy.max_total_bytes)
+        if not doomed:
+            return doomed
+        with self._lock.exclusive():
+            for manifest_path in doomed:
+                try:
+                    os.remove(manifest_path)
+                except OSError as err:
+                    print(f"[WARNING] Could not prune backup {manifest_path}: {err}")
+            self._collect_garbage()
+        return doomed
+
+    def collect_garbage(self) -> int:
+        """Delete blobs not referenced by any manifest; returns bytes freed."""
+        with self._lock.exclusive():
+            return self._collect_garbage()
+
+    def _collect_garbage(self) -> int:
+        """collect_garbage() with the store lock held. Blobs modified since
+        just before the scan and in-progress *.tmp files are left alone:
+        another process may be backing up into this store right now."""
+        scan_start = time.time() - GC_GRACE_S
+        referenced = set()
+        for manifest_path in self.list_backups():
+            with open(manifest_path, encoding="utf-8") as src:
+                referenced.update(member["blob"] for member in json.load(src)["members"])
+        freed = 0
+        for dirpath, _dirs, files in os.walk(self.objects_dir):
+            for name in files:
+                if name in referenced or name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime >= scan_start:
+                        continue
+                    os.remove(path)
+                    freed += stat.st_size
+                except OSError:
+                    pass
+        return freed
+
+    def disk_usage(self) -> int:
+        """Total bytes used by blobs and manifests."""
+        total = 0
+        for top in (self.objects_dir, self.manifests_dir):
+            for dirpath, _dirs, files in os.walk(top):
+                for name in files:
+                    try:
+                        total += os.path.getsize(os.path.join(dirpath, name))
+                    except OSError:
+                        pass
+        return total
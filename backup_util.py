@@ -1,21 +1,147 @@
 """Simple backup utility for workbooks."""
 import os
 import shutil
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from backup_retention import DEFAULT_POLICY, schedule_prune
+from backup_store import BackupStore
+from io_governor import governed
 
-def make_backup(path: str) -> str:
+FICLONE = 0x40049409  # Linux ioctl: share extents (btrfs, XFS, bcachefs...)
+COPY_CHUNK = 8 * 1024 * 1024
+# "copy": full timestamped copy next to the file (restore = open the copy)
+# "store": part-level deduplicated BackupStore (restore via BackupStore.restore)
+BACKUP_MODES = ("copy", "store")
+
+# Backups run here so the copy overlaps workbook parsing.
+_BACKUP_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="backup")
+_PRUNE_STORE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prune-store")
+_pending_store_prunes = {}
+_pending_store_lock = threading.Lock()
+
+
+def schedule_store_prune(store: BackupStore, policy=DEFAULT_POLICY) -> Future:
+    """store.prune(policy) in the background; like backup_retention.schedule_prune,
+    requests for a store whose prune is still queued are coalesced."""
+    root = os.path.abspath(store.root)
+    with _pending_store_lock:
+        future = _pending_store_prunes.get(root)
+        if future is not None and not future.running() and not future.done():
+            return future
+
+        def _run():
+            with _pending_store_lock:
+                _pending_store_prunes.pop(root, None)
+            return store.prune(policy)
+
+        future = _PRUNE_STORE_POOL.submit(_run)
+        _pending_store_prunes[root] = future
+        return future
+
+def _try_reflink(src_fd: int, dst_fd: int) -> bool:
+    """Copy-on-write clone; True on success."""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+def _try_copy_file_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    """In-kernel copy (server-side on NFS/SMB3 when supported); True on success."""
+    copy_range = getattr(os, "copy_file_range", None)
+    if copy_range is None:
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            done = copy_range(src_fd, dst_fd, size - copied)
+            if done == 0:
+                break
+            copied += done
+    except OSError:
+        if copied:
+            raise
+        return False
+    return copied == size
+
+def fast_copy(src: str, dst: str) -> str:
+    """Copy `src` to `dst` as cheaply as the filesystem allows.
+    Tries a reflink (FICLONE), then os.copy_file_range, then a streamed copy
+    with large buffers (shutil uses CopyFile2/sendfile/fcopyfile where
+    available). Metadata is preserved like shutil.copy2. Returns the method used.
+    Runs under the io_governor slots of both storage targets; when either has
+    a byte rate limit the copy is streamed chunk by chunk so it can be paced."""
+    size = os.path.getsize(src)
+    with governed(src, dst) as io, open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if io.rate_limited:
+            method = "paced"
+            while True:
+                chunk = fsrc.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                io.read(len(chunk))
+                fdst.write(chunk)
+                io.write(len(chunk))
+        else:
+            if _try_reflink(fsrc.fileno(), fdst.fileno()):
+                method = "reflink"
+            elif _try_copy_file_range(fsrc.fileno(), fdst.fileno(), size):
+                method = "copy_file_range"
+            else:
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+                shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+                method = "stream"
+            io.read(size)
+            io.write(size)
+    shutil.copystat(src, dst)
+    return method
+
+def backup_path_for(path: str) -> str:
+    """Return the timestamped backup name for 'path'."""
+    base = os.path.basename(path)
+    dirn = os.path.dirname(path) or "."
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(dirn, f"{base}.backup.{stamp}")
+
+def make_backup(path: str, mode: str = "copy", policy=DEFAULT_POLICY) -> str:
     """Make a timestamped backup copy of 'path'.
-    Returns the backup path or empty string on failure."""
+    Returns the backup path (the manifest path in "store" mode) or empty
+    string on failure. Old backups are then pruned in the background per
+    `policy` (a backup_retention.RetentionPolicy; None disables pruning)."""
+    backup_path = ""
     try:
         if not os.path.exists(path):
             return ""
-        base = os.path.basename(path)
-        dirn = os.path.dirname(path) or "."
-        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_name = f"{base}.backup.{stamp}"
-        backup_path = os.path.join(dirn, backup_name)
-        # Use shutil.copy2 to preserve metadata
-        shutil.copy2(path, backup_path)
+        if mode == "store":
+            store = BackupStore.for_file(path)
+            with governed(path) as io:
+                manifest_path = store.backup(path)
+                io.read(os.path.getsize(path))
+            if manifest_path and policy is not None:
+                schedule_store_prune(store, policy)
+            return manifest_path
+        backup_path = backup_path_for(path)
+        fast_copy(path, backup_path)
+        if policy is not None:
+            schedule_prune(os.path.dirname(backup_path), policy)
         return backup_path
     except (OSError, shutil.Error):
+        if backup_path and os.path.exists(backup_path):
+            try:
+                os.remove(backup_path)
+            except OSError:
+                pass
         return ""
+
+def start_backup(path: str, mode: str = "copy") -> Future:
+    """Start make_backup(path, mode) on the background pool.
+    The future resolves to the backup path ('' on failure); wait on it
+    before overwriting the original."""
+    return _BACKUP_POOL.submit(make_backup, path, mode)
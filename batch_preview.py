@@ -0,0 +1,196 @@
+"""Per-file batch preview (sheet counts, size, lock state) computed in the background."""
+import os
+import queue
+import re
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from file_locks import list_siblings, lock_status
+from io_governor import governed
+from sheet_rules import contains_month_sheets
+from meta_cache import Summary, default_cache, stat_many
+from workbook_meta import SheetMeta, read_package_meta, read_sheet_meta
+
+_NUMERIC_SUFFIX_RE = re.compile(r"\d+\s*$")
+CHUNK = 512  # files per pool task (one cache query each)
+
+# Metadata-only work (stat, lock probe, inflate workbook.xml): I/O bound threads.
+_PREVIEW_POOL = ThreadPoolExecutor(max_workers=min(16, (os.cpu_count() or 1) * 2),
+                                   thread_name_prefix="preview")
+
+
+class FileInfo(NamedTuple):
+    """Preview of one workbook; `error` is "" when the file could be read."""
+    path: str
+    size: int
+    mtime_ns: int
+    sheet_count: int
+    hidden_count: int
+    sort_mode: str
+    lock: str
+    error: str = ""
+
+    def describe(self) -> str:
+        """Short text for a list row."""
+        if self.error:
+            return f"{os.path.basename(self.path)} — {self.error}"
+        hidden = f" ({self.hidden_count} hidden)" if self.hidden_count else ""
+        return (f"{os.path.basename(self.path)} — {self.sheet_count} sheets{hidden} · "
+                f"{self.size / 1024.0:.0f} KB · {self.sort_mode}")
+
+
+def detect_sort_mode(names: Sequence[str]) -> str:
+    """Sort mode the UI would suggest for these sheet names."""
+    if contains_month_sheets(names):
+        return "Jan→Dec"
+    if names and sum(1 for name in names if _NUMERIC_SUFFIX_RE.search(name)) * 2 > len(names):
+        return "numeric_suffix"
+    return "alpha"
+
+
+def _error_info(path: str, stat: Optional[os.stat_result], error: str) -> FileInfo:
+    """FileInfo for a file that could not be previewed."""
+    size, mtime_ns = (stat.st_size, stat.st_mtime_ns) if stat else (0, 0)
+    return FileInfo(path, size, mtime_ns, 0, 0, "", "free", error)
+
+
+_cache: Dict[str, FileInfo] = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(path: str, stat: os.stat_result) -> Optional[FileInfo]:
+    """In-memory preview of `path` if the file has not changed since."""
+    with _cache_lock:
+        info = _cache.get(path)
+    if info is not None and (info.size, info.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+        return info
+    return None
+
+
+def _read_info(path: str, stat: os.stat_result) -> Tuple[FileInfo, Optional[tuple]]:
+    """Parse workbook.xml and the zip directory of `path` (cache miss).
+    Returns the FileInfo and the meta_cache entry to store (None on error)."""
+    try:
+        with governed(path):
+            sheets, parts = read_package_meta(path)
+    except (zipfile.BadZipFile, KeyError) as err:
+        return _error_info(path, stat, f"not a readable workbook ({err})"), None
+    except Exception as err:  # malformed XML and the like
+        return _error_info(path, stat, f"unreadable workbook.xml ({err})"), None
+    summary = Summary(len(sheets), sum(1 for sheet in sheets if sheet.state != "visible"),
+                      detect_sort_mode([sheet.name for sheet in sheets]))
+    payload = {"sheets": [list(sheet) for sheet in sheets], "parts": parts}
+    return _summary_info(path, stat, summary), (path, stat, summary, payload)
+
+
+def _summary_info(path: str, stat: os.stat_result, summary: Summary) -> FileInfo:
+    """FileInfo from a meta_cache Summary (lock filled in by the caller)."""
+    return FileInfo(path, stat.st_size, stat.st_mtime_ns, summary.sheet_count,
+                    summary.hidden_count, summary.sort_mode, "free")
+
+
+def inspect_files(paths: Sequence[str]) -> List[FileInfo]:
+    """Preview `paths` (in order) using only workbook.xml and the zip directory.
+    Lookups go memory -> disk cache (meta_cache: small summaries, shared
+    across runs and processes) -> file, with one cache query per call, so
+    reopening a large batch costs about a stat per file. The lock state is
+    probed again on every call (it changes without touching mtime)."""
+    stats = stat_many(paths)
+    infos: Dict[str, FileInfo] = {}
+    for path, stat in stats.items():
+        info = _cached(path, stat)
+        if info is not None:
+            infos[path] = info
+    disk = default_cache()
+    missing = {path: stat for path, stat in stats.items() if path not in infos}
+    for path, summary in disk.get_summaries(missing).items():
+        infos[path] = _summary_info(path, missing.pop(path), summary)
+    fresh = []
+    for path, stat in missing.items():
+        info, entry = _read_info(path, stat)
+        infos[path] = info
+        if entry is not None:
+            fresh.append(entry)
+    disk.put_many(fresh)
+    with _cache_lock:
+        _cache.update((path, info) for path, info in infos.items() if not info.error)
+
+    siblings = list_siblings(paths)
+    result = []
+    for path in paths:
+        info = infos.get(path)
+        if info is None:
+            result.append(_error_info(path, None, "cannot stat file"))
+        else:
+            lock = lock_status(path, siblings[os.path.dirname(path) or "."])
+            result.append(info._replace(lock=lock))
+    return result
+
+
+def inspect_file(path: str) -> FileInfo:
+    """inspect_files for a single path."""
+    return inspect_files([path])[0]
+
+
+def cached_sheet_meta(path: str) -> List[SheetMeta]:
+    """Sheet metadata from the disk cache (filled by the batch preview), read
+    from the file if missing or stale. Raises like workbook_meta.read_sheet_meta."""
+    payload = default_cache().get_payload(path, os.stat(path))
+    if payload is not None:
+        try:
+            return [SheetMeta(*sheet) for sheet in payload["sheets"]]
+        except (KeyError, TypeError):
+            pass
+    with governed(path):
+        return read_sheet_meta(path)
+
+
+class BatchPreview:
+    """Inspects files on the shared preview pool; finished FileInfos are
+    queued for the UI, which calls drain() from root.after()."""
+    def __init__(self):
+        self._results = queue.SimpleQueue()
+        self._futures: List[Future] = []
+        self.pending = 0
+
+    def add(self, paths: Sequence[str]) -> None:
+        """Queue more files for inspection (in chunks of CHUNK)."""
+        paths = list(paths)
+        for start in range(0, len(paths), CHUNK):
+            chunk = paths[start:start + CHUNK]
+            future = _PREVIEW_POOL.submit(inspect_files, chunk)
+            future.add_done_callback(lambda done, chunk=chunk: self._collect(chunk, done))
+            self._futures.append(future)
+        self.pending += len(paths)
+
+    def _collect(self, chunk: List[str], future: Future) -> None:
+        """Done-callback (runs in a pool thread)."""
+        if future.cancelled():
+            return
+        err = future.exception()
+        if err is not None:
+            for path in chunk:
+                self._results.put(_error_info(path, None, f"preview failed ({err})"))
+        else:
+            for info in future.result():
+                self._results.put(info)
+
+    def cancel(self) -> None:
+        """Drop work that has not started yet."""
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        self.pending = 0
+
+    def drain(self) -> List[FileInfo]:
+        """FileInfos finished since the last call."""
+        infos = []
+        while True:
+            try:
+                infos.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        self.pending -= len(infos)
+        return infos
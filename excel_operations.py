@@ -1,15 +1,45 @@
 """Enhanced Excel operations module for reading, sorting, and saving workbooks."""
 import os
 import subprocess
-from openpyxl import load_workbook
-from sheet_rules import apply_template
-from backup_util import make_backup
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+from sheet_rules import plan_template_names
+from validator import resolve_collisions, validate_names
+from backup_util import make_backup, start_backup
+from ref_rewriter import rewrite_sheet_references
+from atomic_save import commit_temp, discard_temp, temp_path_for
+from local_staging import write_back
+from io_governor import PacedFile, governed
+from xlsx_zip import DEFAULT_LEVEL, deflate_archive
+from operation_log import Operation, OperationLog, rename_map
+
+def warm_up() -> None:
+    """Import openpyxl's reader and writer ahead of the first load/save.
+    The UI calls this on its worker thread right after the window appears,
+    so startup does not pay for it and the first sort does not wait on it."""
+    import openpyxl
+    import openpyxl.reader.excel
+    import openpyxl.writer.excel
 
 class ExcelHandler:
     """Handles Excel workbook operations safely and with debug logging."""
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, backup: bool = True, backup_mode: str = "copy",
+                 staged=None, compression_level: int = DEFAULT_LEVEL):
         self.file_path = file_path
+        # zlib level for saves (xlsx_zip.COMPRESSION_LEVELS)
+        self.compression_level = compression_level
+        # local_staging.StagedFile: openpyxl reads and writes the local copy,
+        # saves go back to file_path in one sequential write (see write_back)
+        self.staged = staged
         self.workbook = None
+        self.last_rename_map = {}
+        # When enabled, the backup copy starts on a background thread as soon
+        # as the file is known to be readable, overlapping openpyxl parsing.
+        self.backup = backup
+        self.backup_mode = backup_mode  # see backup_util.BACKUP_MODES
+        self._backup_future = None
+        self.operations = OperationLog()
 
     def load_workbook(self) -> bool:
         """Loads the Excel workbook.
@@ -39,10 +69,18 @@ class ExcelHandler:
             # Could not open file for other OS-related reasons; still try load_workbook below
             print(f"[WARNING] Could not perform exclusive open check: {err}. Will attempt to load anyway.")
 
+        if self.backup and self._backup_future is None:
+            self._backup_future = start_backup(self.file_path, self.backup_mode)
+
         # If the quick-check passed (or only raised non-blocking OSError), try loading
         try:
             # read_only=False ensures the workbook is editable by openpyxl
-            self.workbook = load_workbook(filename=self.file_path, read_only=False, data_only=False)
+            import openpyxl  # deferred: heavy import, usually already warmed (see warm_up)
+            source = self.staged.local if self.staged is not None else self.file_path
+            # openpyxl reads through the paced file, straight from disk
+            with governed(source) as io, open(source, "rb") as src:
+                self.workbook = openpyxl.load_workbook(filename=PacedFile(src, io), read_only=False,
+                                                       data_only=False)
             print(f"[INFO] Workbook loaded successfully: {self.file_path}")
             return True
         except PermissionError:
@@ -79,7 +117,9 @@ class ExcelHandler:
             visible_sheets.sort(key=lambda ws: ws.title.lower())
 
             # Recombine sheets: visible first, hidden last (to preserve state)
+            before = tuple(self.workbook.sheetnames)
             self.workbook._sheets = visible_sheets + hidden_sheets
+            self._record_order(before)
 
             print(
                 "[INFO] Sheets sorted alphabetically: "
@@ -100,34 +140,196 @@ class ExcelHandler:
             visible = [ws for ws in self.workbook._sheets if ws.sheet_state == "visible"]
             hidden = [ws for ws in self.workbook._sheets if ws.sheet_state != "visible"]
             visible.sort(key=key_func)
+            before = tuple(self.workbook.sheetnames)
             self.workbook._sheets = visible + hidden
+            self._record_order(before)
             return True
         except Exception as err:
             print(f"[ERROR while custom sorting] {err}")
             return False
 
-    def rename_sheets_with_template(self, template: str) -> bool:
-        """Rename sheets using a template string safely."""
+    def rename_sheets_with_template(self, template: str, pattern: str = "") -> bool:
+        """Rename sheets using a template string safely.
+        All new names are computed up front with the compiled template, checked
+        in one pass with validator rules and collision-resolved before any
+        sheet is touched, so a bad template can no longer leave the workbook
+        half renamed. `last_rename_map` accumulates original->current names."""
         if not self.workbook:
             print("[ERROR] Workbook not loaded before renaming.")
             return False
         try:
-            for i, ws in enumerate(self.workbook._sheets, start=1):
-                new_name = apply_template(ws.title, template, i)
-                # openpyxl will raise if invalid name; handle gracefully
+            sheets = list(self.workbook._sheets)
+            old_names = [ws.title for ws in sheets]
+            planned = plan_template_names(old_names, template, pattern)
+            problems = validate_names(planned)
+            if problems:
+                sample = {planned[pos]: found for pos, found in list(problems.items())[:5]}
+                print(f"[WARNING] Template produced {len(problems)} invalid/duplicate "
+                      f"name(s), resolving automatically: {sample}")
+                planned = resolve_collisions(planned)
+            # Two phases: park every sheet on a unique temporary name first so
+            # swaps (A->B, B->A) never trip openpyxl's duplicate-name guard.
+            for i, ws in enumerate(sheets):
+                ws.title = f"~rn{i}~{id(self) % 10000}"
+            for ws, new_name in zip(sheets, planned):
                 ws.title = new_name
+            op = Operation("rename", tuple(old_names), tuple(planned))
+            self._track_rename(op)
+            self.operations.record(op)
             return True
         except Exception as err:
             print(f"[ERROR while renaming sheets] {err}")
             return False
 
+    def set_sheet_state(self, name: str, state: str) -> bool:
+        """Change one sheet's visibility ("visible", "hidden", "veryHidden")."""
+        if not self.workbook or name not in self.workbook.sheetnames:
+            print(f"[ERROR] Sheet not found for visibility change: {name}")
+            return False
+        ws = self.workbook[name]
+        if ws.sheet_state == state:
+            return True
+        try:
+            before = ws.sheet_state
+            ws.sheet_state = state
+        except ValueError as err:
+            print(f"[ERROR while changing sheet visibility] {err}")
+            return False
+        self.operations.record(Operation("visibility", {name: before}, {name: state}))
+        return True
+
+    def sort_rows(self, sheet: str, keys, header_rows: int = 1) -> bool:
+        """Sort the rows of `sheet` below `header_rows` by `keys` ("B",
+        "-C" for descending, or 1-based column numbers), directly in the
+        file: the worksheet is streamed and spilled to disk (row_sort), so
+        sheets larger than memory work. Pending sheet changes must be saved
+        first; the sort is not in the undo log (the backup covers it).
+        A loaded workbook is reloaded afterwards."""
+        if len(self.operations.done) != self.operations.disk_ops:
+            print("[ERROR] Save pending sheet changes before sorting rows.")
+            return False
+        from row_sort import sort_rows_in_file  # deferred: only needed when rows are sorted
+        staged = self.staged
+        path = staged.local if staged is not None else self.file_path
+        try:
+            if self.backup:
+                backup = self.backup_before_save()
+                if backup:
+                    print(f"[INFO] Backup created: {backup}")
+                else:
+                    print(f"[WARNING] Backup could not be created for: {self.file_path}")
+            # the I/O slot is taken by the final copy pass only (see part_engine)
+            count = sort_rows_in_file(path, sheet, keys, header_rows, level=self.compression_level)
+            if staged is not None and count:
+                self.staged = write_back(staged)
+        except PermissionError:
+            print(f"[ERROR] Cannot sort rows — file is open in another program: {self.file_path}")
+            return False
+        except (KeyError, ValueError, OSError) as err:
+            print(f"[ERROR while sorting rows] {err}")
+            return False
+        if not count:
+            print(f"[INFO] Rows of '{sheet}' already in order.")
+            return True
+        print(f"[INFO] Sorted {count} rows of '{sheet}': {self.file_path}")
+        return self.load_workbook() if self.workbook else True
+
+    def _record_order(self, before: tuple) -> None:
+        """Log a reorder as a permutation (skipped when nothing moved)."""
+        after = tuple(self.workbook.sheetnames)
+        if after != before:
+            self.operations.record(Operation("order", before, after))
+
+    def _track_rename(self, op: Operation) -> None:
+        """Compose `op` into last_rename_map (original -> current names)."""
+        step = rename_map(op)
+        composed = {orig: step.get(cur, cur) for orig, cur in self.last_rename_map.items()}
+        current = set(self.last_rename_map.values())
+        for old, new in step.items():
+            if old not in current:
+                composed[old] = new
+        self.last_rename_map = {old: new for old, new in composed.items() if old != new}
+
+    def undo(self) -> bool:
+        """Undo the last sort/rename/visibility change.
+        In memory the inverse is applied directly; if the change was already
+        saved, the file is fixed with a zip-level workbook.xml rewrite, so
+        nothing is reloaded and no backup is copied back."""
+        op = self.operations.undo(self.workbook, self.file_path)
+        if op is None:
+            print("[INFO] Nothing to undo.")
+            return False
+        if op.kind == "rename":
+            self._track_rename(Operation("rename", op.after, op.before))
+        print(f"[INFO] Undone: {op.kind}")
+        return True
+
+    def redo(self) -> bool:
+        """Redo the last undone change (see undo)."""
+        op = self.operations.redo(self.workbook, self.file_path)
+        if op is None:
+            print("[INFO] Nothing to redo.")
+            return False
+        if op.kind == "rename":
+            self._track_rename(op)
+        print(f"[INFO] Redone: {op.kind}")
+        return True
+
+    def _rewrite_renamed_references(self, path: str) -> None:
+        """openpyxl keeps formula text as-is, so after a template rename the
+        saved file still points at the old names; fix them at zip level.
+        Raises OSError if that fails, so the save is abandoned instead of
+        committing formulas that point at sheets which no longer exist."""
+        if self.last_rename_map and not rewrite_sheet_references(path, self.last_rename_map):
+            raise OSError(f"could not update sheet references after renaming in {self.file_path}")
+
+    def _write_workbook(self, tmp_path: str) -> None:
+        """Serialise the workbook to `tmp_path`. openpyxl writes an uncompressed
+        local scratch archive (no deflate on its single thread); xlsx_zip then
+        deflates every part on the parallel pool at compression_level, straight
+        into tmp_path, so only that pass holds the I/O slot."""
+        if self.workbook.write_only:
+            with governed(tmp_path) as io, open(tmp_path, "wb") as dst:
+                self.workbook.save(PacedFile(dst, io))
+            return
+        from openpyxl.writer.excel import ExcelWriter  # deferred like load_workbook
+        with tempfile.TemporaryFile(prefix="excel_sorter_") as scratch:
+            archive = zipfile.ZipFile(scratch, "w", zipfile.ZIP_STORED, allowZip64=True)
+            self.workbook.properties.modified = datetime.now(timezone.utc).replace(tzinfo=None)
+            ExcelWriter(self.workbook, archive).save()
+            scratch.seek(0)
+            with governed(tmp_path) as io, open(tmp_path, "wb") as dst:
+                deflate_archive(scratch, PacedFile(dst, io), self.compression_level)
+
+    def _save_atomically(self, target: str) -> None:
+        """Write the workbook to a temp file next to `target`, fix renamed
+        references, verify the zip structure, fsync and os.replace it into
+        place. A crash mid-write leaves the original untouched.
+        A staged workbook is saved and verified on the local copy, then
+        written back to the share in one pass."""
+        staged = self.staged if self.staged is not None and target == self.file_path else None
+        local_target = staged.local if staged is not None else target
+        tmp_path = temp_path_for(local_target)
+        try:
+            self._write_workbook(tmp_path)
+            self._rewrite_renamed_references(tmp_path)
+            commit_temp(tmp_path, local_target)
+        except BaseException:
+            discard_temp(tmp_path)
+            raise
+        if staged is not None:
+            self.staged = write_back(staged)
+
     def backup_before_save(self) -> str:
-        """Create a backup and return path or empty string."""
+        """Create a backup and return path or empty string.
+        Waits for the background backup started by load_workbook if there is
+        one, so the original is always protected before it is overwritten."""
         try:
-            return make_backup(self.file_path)
+            if self._backup_future is not None:
+                return self._backup_future.result()
+            return make_backup(self.file_path, self.backup_mode)
         except Exception:
             return ""
-    # --- end insertion
 
     def save_workbook(self) -> bool:
         """Saves the workbook to the same file path with permission handling."""
@@ -141,16 +343,19 @@ class ExcelHandler:
                 print(f"[ERROR] No write permission for: {self.file_path}")
                 return False
 
-            # Attempt to save
-            self.workbook.save(self.file_path)
+            if self.backup:
+                backup = self.backup_before_save()
+                if backup:
+                    print(f"[INFO] Backup created: {backup}")
+                else:
+                    print(f"[WARNING] Backup could not be created for: {self.file_path}")
+
+            # Attempt to save (temp file + verify + fsync + os.replace)
+            self._save_atomically(self.file_path)
+            self.operations.mark_saved()
             print(f"[INFO] Workbook saved successfully: {self.file_path}")
             return True
 
-            backup = self.backup_before_save()
-            if backup:
-                print(f"[INFO] Backup created: {backup}")
-            self.workbook.save(self.file_path)
-
         except PermissionError:
             print(
                 "[ERROR] Cannot save — file is open in another program (e.g., Excel). "
@@ -165,7 +370,7 @@ class ExcelHandler:
     def save_as(self, new_path: str) -> bool:
         """Saves workbook as a new file."""
         try:
-            self.workbook.save(new_path)
+            self._save_atomically(new_path)
             print(f"[INFO] Workbook saved as: {new_path}")
             return True
         except Exception as err:
@@ -0,0 +1,121 @@
+"""Streaming discovery of workbooks under dropped folders."""
+import fnmatch
+import os
+import queue
+import threading
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+DEFAULT_INCLUDE = ("*.xlsx", "*.xlsm", "*.xls")
+# Office / LibreOffice owner files that sit next to open workbooks
+LOCK_FILE_GLOBS = ("~$*", ".~lock.*#")
+BATCH_SIZE = 256
+
+
+def parse_globs(text: str) -> Tuple[str, ...]:
+    """Split a ';' or ',' separated glob list ("*.xlsx; *.xlsm")."""
+    return tuple(part.strip() for part in text.replace(",", ";").split(";") if part.strip())
+
+
+def _matches(name: str, rel_path: str, globs: Sequence[str]) -> bool:
+    """Case-insensitive match of a basename or a '/'-separated relative path."""
+    name = name.casefold()
+    rel_path = rel_path.casefold()
+    return any(fnmatch.fnmatchcase(name, glob) or fnmatch.fnmatchcase(rel_path, glob)
+               for glob in globs)
+
+
+def is_wanted_file(path: str, include: Sequence[str] = DEFAULT_INCLUDE,
+                   exclude: Sequence[str] = ()) -> bool:
+    """Apply the include/exclude globs and skip lock files for one file path."""
+    name = os.path.basename(path)
+    include = [glob.casefold() for glob in include]
+    exclude = [glob.casefold() for glob in exclude]
+    return (_matches(name, name, include) and not _matches(name, name, exclude)
+            and not _matches(name, name, LOCK_FILE_GLOBS))
+
+
+def iter_workbooks(root: str, include: Sequence[str] = DEFAULT_INCLUDE,
+                   exclude: Sequence[str] = ()) -> Iterator[str]:
+    """Yield matching files under `root` as they are found.
+    Iterative os.scandir walk (no recursion limit, one directory open at a
+    time, entry types from the directory listing instead of a stat per
+    file). Symlinked directories are not followed. `exclude` globs apply to
+    directories too, so an excluded folder is never entered. Globs match a
+    basename or a path relative to `root` using '/'."""
+    include = [glob.casefold() for glob in include]
+    exclude = [glob.casefold() for glob in exclude]
+    lock_globs = [glob.casefold() for glob in LOCK_FILE_GLOBS]
+    pending = [(root, "")]
+    while pending:
+        directory, rel_dir = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirs = []
+                for entry in entries:
+                    rel_path = f"{rel_dir}{entry.name}"
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not _matches(entry.name, rel_path, exclude):
+                                subdirs.append((entry.path, rel_path + "/"))
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if (_matches(entry.name, rel_path, include)
+                            and not _matches(entry.name, rel_path, exclude)
+                            and not _matches(entry.name, rel_path, lock_globs)):
+                        yield entry.path
+        except OSError as err:
+            print(f"[WARNING] Cannot scan {directory}: {err}")
+            continue
+        # reversed so directories come out in listing order
+        pending.extend(reversed(subdirs))
+
+
+class FileDiscovery(threading.Thread):
+    """Walks `roots` on a background thread and queues found files in
+    batches; the UI calls drain() from root.after() to pick them up.
+    `done` is set once every root has been walked (or stop() was called)."""
+    def __init__(self, roots: Iterable[str], include: Sequence[str] = DEFAULT_INCLUDE,
+                 exclude: Sequence[str] = (), batch_size: int = BATCH_SIZE):
+        super().__init__(daemon=True)
+        self.roots = list(roots)
+        self.include = tuple(include) or DEFAULT_INCLUDE
+        self.exclude = tuple(exclude)
+        self.batch_size = batch_size
+        self.found = 0
+        self.done = threading.Event()
+        self._batches = queue.SimpleQueue()
+        self._stop = False
+
+    def stop(self):
+        """Request stop (best effort)."""
+        self._stop = True
+
+    def run(self):
+        batch = []
+        try:
+            for root in self.roots:
+                for path in iter_workbooks(root, self.include, self.exclude):
+                    if self._stop:
+                        return
+                    batch.append(path)
+                    if len(batch) >= self.batch_size:
+                        self._batches.put(batch)
+                        self.found += len(batch)
+                        batch = []
+        finally:
+            if batch:
+                self._batches.put(batch)
+                self.found += len(batch)
+            self.done.set()
+
+    def drain(self) -> List[str]:
+        """All paths queued since the last call."""
+        paths = []
+        while True:
+            try:
+                paths.extend(self._batches.get_nowait())
+            except queue.Empty:
+                return paths
@@ -0,0 +1,81 @@
+"""Cheap checks for workbooks that are open in Excel/LibreOffice."""
+import os
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+
+def office_lock_files(path: str, siblings: Optional[Set[str]] = None) -> list:
+    """Return existing owner/lock files for `path`.
+    Excel creates '~$name.xlsx' next to the workbook and LibreOffice
+    '.~lock.name.xlsx#'. `siblings` (names in the file's directory, see
+    list_siblings) replaces the per-candidate exists() calls."""
+    base = os.path.basename(path)
+    names = ["~$" + base, "~$" + base[2:] if len(base) > 2 else "", f".~lock.{base}#"]
+    if siblings is not None:
+        names = [name for name in names if name and name in siblings]
+        if not names:
+            return []
+    dirn = os.path.dirname(path) or "."
+    candidates = [os.path.join(dirn, name) for name in names if name]
+    if siblings is not None:
+        return candidates
+    return [cand for cand in candidates if os.path.exists(cand)]
+
+
+_listings: Dict[str, tuple] = {}  # directory -> (mtime_ns, lock-like names)
+_listings_lock = threading.Lock()
+
+
+def list_siblings(paths: Iterable[str]) -> Dict[str, Set[str]]:
+    """Names of possible lock files per directory of `paths`, for checking
+    many files of the same folders at once. A directory is listed again only
+    when its mtime changes (creating or deleting a lock file bumps it)."""
+    result: Dict[str, Set[str]] = {}
+    for path in paths:
+        dirn = os.path.dirname(path) or "."
+        if dirn in result:
+            continue
+        try:
+            mtime_ns = os.stat(dirn).st_mtime_ns
+        except OSError:
+            result[dirn] = set()
+            continue
+        with _listings_lock:
+            cached = _listings.get(dirn)
+        if cached is not None and cached[0] == mtime_ns:
+            result[dirn] = cached[1]
+            continue
+        try:
+            with os.scandir(dirn) as entries:
+                names = {entry.name for entry in entries
+                         if entry.name.startswith(("~$", ".~lock."))}
+        except OSError:
+            names = set()
+        with _listings_lock:
+            _listings[dirn] = (mtime_ns, names)
+        result[dirn] = names
+    return result
+
+
+def is_locked(path: str) -> bool:
+    """Return True if the file cannot be opened for read+write.
+    On Windows, a workbook open in Excel raises PermissionError here; the
+    same probe ExcelHandler.load_workbook uses."""
+    try:
+        with open(path, "r+b"):
+            pass
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def lock_status(path: str, siblings: Optional[Set[str]] = None) -> str:
+    """Return "locked", "lockfile" (an Office lock file exists but the file
+    itself is still writable, e.g. on shares without mandatory locks) or "free"."""
+    if is_locked(path):
+        return "locked"
+    if office_lock_files(path, siblings):
+        return "lockfile"
+    return "free"
@@ -0,0 +1,267 @@
+"""Per-storage-target I/O governor: concurrent-open cap, byte rate limits, latency-adaptive concurrency."""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+MB = 1024 * 1024
+LIMITS_ENV = "EXCEL_SORTER_IO_LIMITS"
+LATENCY_FACTOR = 2.0     # back off once latency exceeds the idle baseline by this factor
+MIN_SLOW_S = 0.005       # ...and is at least this slow, so fast local disks never back off
+ADJUST_INTERVAL_S = 0.5  # at most one concurrency change per interval
+EWMA_ALPHA = 0.2
+_SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": MB, "GB": 1024 * MB}
+
+
+class IoLimits(NamedTuple):
+    """Limits for one storage target; a rate of 0 means unlimited."""
+    max_open: int = 8
+    read_bps: float = 0.0
+    write_bps: float = 0.0
+
+
+DEFAULT_LIMITS = IoLimits()
+
+
+def _parse_size(text: str) -> float:
+    """"20MB" / "512KB" / "1048576" -> bytes."""
+    text = text.strip().upper()
+    number = text.rstrip("KMGB")
+    return float(number) * _SIZE_UNITS[text[len(number):]]
+
+
+def parse_limits(text: str) -> Dict[str, IoLimits]:
+    """Parse "root=open:4,read:20MB,write:10MB; other_root=open:2" (the
+    EXCEL_SORTER_IO_LIMITS format); rates are per second. Bad entries are skipped."""
+    limits = {}
+    for entry in text.split(";"):
+        root, _, spec = entry.rpartition("=")
+        if not root.strip():
+            continue
+        values = DEFAULT_LIMITS._asdict()
+        try:
+            for item in spec.split(","):
+                key, _, value = item.partition(":")
+                key = key.strip().lower()
+                if key == "open":
+                    values["max_open"] = max(1, int(value))
+                elif key in ("read", "write"):
+                    values[f"{key}_bps"] = _parse_size(value)
+                else:
+                    raise ValueError(f"unknown limit {key!r}")
+        except (KeyError, ValueError) as err:
+            print(f"[WARNING] Ignoring I/O limit {entry.strip()!r}: {err}")
+            continue
+        limits[root.strip()] = IoLimits(**values)
+    return limits
+
+
+def storage_target(path: str) -> str:
+    """Drive or \\\\server\\share (Windows) / mount point (POSIX) holding `path`."""
+    path = os.path.abspath(path)
+    if os.name == "nt":
+        return os.path.splitdrive(path)[0].lower() or path
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class TokenBucket:
+    """Bytes-per-second limiter; callers pay after the fact and sleep off any
+    debt, so large reads never have to be split up front. rate 0 = unlimited."""
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> float:
+        """Account for `nbytes`; sleeps if over the rate. Returns seconds slept."""
+        if self.rate <= 0 or nbytes <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class IoGovernor:
+    """Concurrency and bandwidth limits for one storage target.
+    At most `limit` operations hold a slot at once. `limit` starts at
+    limits.max_open and adapts AIMD-style to observed latency (seconds per
+    operation, or per MB for large transfers): it is cut by 30% when latency
+    climbs past LATENCY_FACTOR x the idle baseline, and grows by one while
+    callers are queueing and latency stays near the baseline."""
+    def __init__(self, target: str, limits: IoLimits = DEFAULT_LIMITS):
+        self.target = target
+        self.limits = limits
+        self.limit = max(1, limits.max_open)
+        self.active = 0
+        self.waiting = 0
+        self.reads = TokenBucket(limits.read_bps)
+        self.writes = TokenBucket(limits.write_bps)
+        self._cond = threading.Condition()
+        self._ewma: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._last_adjust = 0.0
+
+    @property
+    def rate_limited(self) -> bool:
+        """True when reads or writes have a byte rate limit."""
+        return self.limits.read_bps > 0 or self.limits.write_bps > 0
+
+    def acquire(self) -> None:
+        """Wait for a free slot."""
+        with self._cond:
+            self.waiting += 1
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.waiting -= 1
+            self.active += 1
+
+    def release(self, seconds: float, nbytes: int = 0) -> None:
+        """Free a slot and record how long the operation took (excluding throttling)."""
+        with self._cond:
+            self.active -= 1
+            self._observe(seconds / max(1.0, nbytes / MB))
+            self._cond.notify_all()
+
+    def _observe(self, latency: float) -> None:
+        """Update the latency estimate and maybe the limit (lock held)."""
+        self._ewma = latency if self._ewma is None else (
+            self._ewma + EWMA_ALPHA * (latency - self._ewma))
+        if self._baseline is None or self._ewma < self._baseline:
+            self._baseline = self._ewma
+        now = time.monotonic()
+        if now - self._last_adjust < ADJUST_INTERVAL_S:
+            return
+        self._last_adjust = now
+        old = self.limit
+        if self._ewma > max(self._baseline * LATENCY_FACTOR, MIN_SLOW_S):
+            self.limit = max(1, int(self.limit * 0.7))
+        elif (self.waiting and self.limit < self.limits.max_open
+              and self._ewma <= self._baseline * (1 + LATENCY_FACTOR) / 2):
+            self.limit += 1
+        # forget slowly, so a share that got permanently slower is re-learned
+        self._baseline += (self._ewma - self._baseline) * 0.05
+        if self.limit != old:
+            print(f"[INFO] I/O governor {self.target}: concurrency {old} -> {self.limit} "
+                  f"(latency {self._ewma * 1000:.1f} ms, baseline {self._baseline * 1000:.1f} ms)")
+
+
+class IoTicket:
+    """Handed out by governed(): report transferred bytes with read()/write()
+    so rate limits apply and latency is normalised by size."""
+    def __init__(self, reader: IoGovernor, writer: IoGovernor):
+        self.reader = reader
+        self.writer = writer
+        self.rate_limited = reader.rate_limited or writer.rate_limited
+        self.nbytes = 0
+        self.throttled = 0.0
+
+    def read(self, nbytes: int) -> None:
+        """Account for bytes read from the source."""
+        self.nbytes += nbytes
+        self.throttled += self.reader.reads.consume(nbytes)
+
+    def write(self, nbytes: int) -> None:
+        """Account for bytes written to the destination."""
+        self.nbytes += nbytes
+        self.throttled += self.writer.writes.consume(nbytes)
+
+
+class PacedFile:
+    """Binary file wrapper that reports every read()/write() to an IoTicket,
+    so libraries doing their own I/O (zipfile, openpyxl) are paced too."""
+    def __init__(self, fileobj: BinaryIO, ticket: IoTicket):
+        self._file = fileobj
+        self._ticket = ticket
+
+    def read(self, size: int = -1) -> bytes:
+        """Read from the file and account for the bytes."""
+        data = self._file.read(size)
+        self._ticket.read(len(data))
+        return data
+
+    def write(self, data) -> int:
+        """Account for the bytes, then write them."""
+        self._ticket.write(memoryview(data).nbytes)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+_governors: Dict[str, IoGovernor] = {}
+_roots: List[Tuple[str, IoLimits]] = []
+_targets: Dict[str, str] = {}
+_registry_lock = threading.Lock()
+_env_loaded = False
+
+
+def _norm(path: str) -> str:
+    """Comparable form of a path prefix."""
+    return os.path.normcase(os.path.abspath(path)).rstrip("\\/") + os.sep
+
+
+def configure(root: str, limits: IoLimits) -> None:
+    """Set limits for every file under `root` (overrides the mount point default)."""
+    with _registry_lock:
+        _roots[:] = [(prefix, old) for prefix, old in _roots if prefix != _norm(root)]
+        _roots.append((_norm(root), limits))
+        _roots.sort(key=lambda item: len(item[0]), reverse=True)  # longest prefix wins
+        _governors.pop(_norm(root), None)
+        _targets.clear()
+
+
+def governor_for(path: str) -> IoGovernor:
+    """Shared governor of the configured root or storage target holding `path`."""
+    global _env_loaded
+    if not _env_loaded:
+        _env_loaded = True
+        for root, limits in parse_limits(os.environ.get(LIMITS_ENV, "")).items():
+            configure(root, limits)
+    directory = os.path.dirname(os.path.abspath(path))
+    with _registry_lock:
+        key = _targets.get(directory)
+    if key is None:
+        candidate = _norm(directory)
+        key = next((prefix for prefix, _limits in _roots if candidate.startswith(prefix)), "")
+        key = key or storage_target(directory)
+        with _registry_lock:
+            _targets[directory] = key
+    with _registry_lock:
+        governor = _governors.get(key)
+        if governor is None:
+            limits = next((found for prefix, found in _roots if prefix == key), DEFAULT_LIMITS)
+            governor = _governors[key] = IoGovernor(key, limits)
+        return governor
+
+
+@contextmanager
+def governed(src: str, dst: str = "") -> Iterator[IoTicket]:
+    """Hold an I/O slot on `src`'s target (and `dst`'s, for copies) for the
+    duration of the block. Slots are taken in a fixed order, so two copies
+    in opposite directions cannot deadlock."""
+    reader = governor_for(src)
+    writer = governor_for(dst) if dst else reader
+    held = sorted({id(gov): gov for gov in (reader, writer)}.values(), key=lambda gov: gov.target)
+    for gov in held:
+        gov.acquire()
+    ticket = IoTicket(reader, writer)
+    start = time.monotonic()
+    try:
+        yield ticket
+    finally:
+        elapsed = max(0.0, time.monotonic() - start - ticket.throttled)
+        for gov in reversed(held):
+            gov.release(elapsed, ticket.nbytes)
@@ -0,0 +1,156 @@
+"""Local staging for workbooks on slow (network) shares: copy in, work locally, write back."""
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, Iterable, NamedTuple, Set, Union
+
+from atomic_save import discard_temp, install_temp, temp_path_for
+from backup_util import fast_copy
+
+DEFAULT_WINDOW = 4  # files copied ahead of the workers
+
+
+class StagedFile(NamedTuple):
+    """Local working copy of `source`; size/mtime_ns are the source's at copy time."""
+    source: str
+    local: str
+    size: int
+    mtime_ns: int
+
+
+def _signature(path: str):
+    """(size, mtime_ns) of `path`."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def stage_in(source: str, scratch_dir: str, name: str = "") -> StagedFile:
+    """Copy `source` into `scratch_dir` with large sequential reads (fast_copy).
+    Raises OSError if the source changed while it was being copied."""
+    before = _signature(source)
+    local = os.path.join(scratch_dir, name or os.path.basename(source))
+    fast_copy(source, local)
+    if _signature(source) != before:
+        os.remove(local)
+        raise OSError(f"file changed while staging: {source}")
+    return StagedFile(source, local, *before)
+
+
+def source_changed(staged: StagedFile) -> bool:
+    """True if the source was modified (or removed) since it was staged."""
+    try:
+        return _signature(staged.source) != (staged.size, staged.mtime_ns)
+    except OSError:
+        return True
+
+
+def write_back(staged: StagedFile) -> StagedFile:
+    """Copy the (already verified) local file over its source: one sequential
+    write to a temp file next to the source, then fsync + atomic os.replace.
+    Refuses (OSError) if someone else changed the source since it was staged.
+    Returns the StagedFile updated to the new source state."""
+    if source_changed(staged):
+        raise OSError(f"{staged.source} was modified by someone else since it was staged; "
+                      "not overwriting")
+    tmp_path = temp_path_for(staged.source)
+    try:
+        fast_copy(staged.local, tmp_path)
+        if os.path.getsize(tmp_path) != os.path.getsize(staged.local):
+            raise OSError(f"short write while copying back to {staged.source}")
+        install_temp(tmp_path, staged.source)
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    return staged._replace(size=os.path.getsize(staged.source),
+                           mtime_ns=os.stat(staged.source).st_mtime_ns)
+
+
+class StagingArea:
+    """Scratch directory plus a prefetch thread that keeps up to `window`
+    files of `paths` (in order) copied locally ahead of the workers.
+    acquire(path) returns the StagedFile (waiting for an in-flight copy, or
+    copying synchronously for paths outside the plan, e.g. retried files);
+    release(path) deletes the local copy and frees its window slot.
+    close() stops prefetching and removes the scratch directory."""
+    def __init__(self, paths: Iterable[str], window: int = DEFAULT_WINDOW, scratch_root: str = ""):
+        self.scratch_dir = tempfile.mkdtemp(prefix="excel_sorter_stage_", dir=scratch_root or None)
+        self.window = max(1, window)
+        self._plan = list(paths)
+        self._names = itertools.count()
+        self._states: Dict[str, Union[str, StagedFile, OSError]] = {}
+        self._slotted: Set[str] = set()
+        self._seen: Set[str] = set()  # paths already taken by acquire() or the prefetcher
+        self._slots = threading.Semaphore(self.window)
+        self._changed = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._prefetch, daemon=True, name="stage-prefetch")
+        self._thread.start()
+
+    def _copy(self, path: str) -> Union[StagedFile, OSError]:
+        """Stage one file under a unique local name; errors are returned."""
+        name = f"{next(self._names)}_{os.path.basename(path)}"
+        try:
+            return stage_in(path, self.scratch_dir, name)
+        except OSError as err:
+            return err
+
+    def _prefetch(self) -> None:
+        """Copy planned files in order, never more than `window` ahead."""
+        for path in self._plan:
+            while not self._slots.acquire(timeout=0.5):
+                if self._stop:
+                    return
+            with self._changed:
+                if self._stop or path in self._seen:
+                    self._slots.release()
+                    if self._stop:
+                        return
+                    continue
+                self._states[path] = "copying"
+                self._seen.add(path)
+                self._slotted.add(path)
+            result = self._copy(path)
+            with self._changed:
+                self._states[path] = result
+                self._changed.notify_all()
+
+    def acquire(self, path: str) -> StagedFile:
+        """Local copy of `path`; raises OSError if it cannot be staged.
+        A copy that went stale (the source changed since, e.g. while the
+        file was locked and edited) is refreshed first."""
+        with self._changed:
+            while self._states.get(path) == "copying":
+                self._changed.wait()
+            result = self._states.get(path)
+            if result is None:
+                self._states[path] = "copying"
+                self._seen.add(path)
+        if result is None or (isinstance(result, StagedFile) and source_changed(result)):
+            if isinstance(result, StagedFile):
+                discard_temp(result.local)
+            result = self._copy(path)
+            with self._changed:
+                self._states[path] = result
+                self._changed.notify_all()
+        if isinstance(result, OSError):
+            raise result
+        return result
+
+    def release(self, path: str) -> None:
+        """Drop the local copy of `path` (done with it, or parked as locked)."""
+        with self._changed:
+            result = self._states.pop(path, None)
+            slotted = path in self._slotted
+            self._slotted.discard(path)
+        if isinstance(result, StagedFile):
+            discard_temp(result.local)
+        if slotted:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Stop prefetching and delete every local copy."""
+        self._stop = True
+        self._thread.join(timeout=5.0)
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
@@ -0,0 +1,217 @@
+"""Persistent (SQLite) cache of workbook metadata, keyed by path + size + mtime + inode."""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+TOUCH_INTERVAL_S = 3600  # refresh last_used at most hourly (keeps reads read-only)
+_IN_CHUNK = 500          # stay below SQLite's host-parameter limit
+SCHEMA_VERSION = 1       # bump when the table layout changes; old caches are dropped
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path      TEXT PRIMARY KEY,
+    size      INTEGER NOT NULL,
+    mtime_ns  INTEGER NOT NULL,
+    inode     INTEGER NOT NULL,
+    sheet_count  INTEGER NOT NULL,
+    hidden_count INTEGER NOT NULL,
+    sort_mode TEXT NOT NULL,
+    payload   TEXT NOT NULL,
+    nbytes    INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+"""
+
+
+def default_cache_dir() -> str:
+    """Per-user cache folder (EXCEL_SORTER_CACHE_DIR overrides)."""
+    override = os.environ.get("EXCEL_SORTER_CACHE_DIR")
+    if override:
+        return override
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "ExcelSheetSorter")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "excel_sheet_sorter")
+
+
+def cache_key(path: str) -> str:
+    """Normalized path used as the primary key."""
+    return os.path.normcase(os.path.abspath(path))
+
+
+class Summary(NamedTuple):
+    """What a batch list row shows; stored as plain columns so listing a
+    huge batch never decodes JSON."""
+    sheet_count: int
+    hidden_count: int
+    sort_mode: str
+
+
+class MetaCache:
+    """Workbook metadata that survives restarts: a Summary plus the full JSON
+    `payload` (sheet names/states, part sizes). An entry is valid only while
+    the file's size, mtime and inode match.
+    The database runs in WAL mode, so any number of readers (UI, pre-flight,
+    other processes) proceed while one writer commits. Each thread gets its
+    own connection. Total payload is kept under `max_bytes` by evicting the
+    least recently used entries. Failures are logged and treated as misses;
+    the cache never breaks the caller."""
+    def __init__(self, db_path: str = "", max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = db_path or os.path.join(default_cache_dir(), "meta_cache.sqlite3")
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._disabled = False
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        """This thread's connection (created on first use)."""
+        if self._disabled:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+                conn = sqlite3.connect(self.db_path, timeout=5.0)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                    with conn:
+                        conn.execute("DROP TABLE IF EXISTS entries")
+                        conn.executescript(_SCHEMA)
+                        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            except (OSError, sqlite3.Error) as err:
+                print(f"[WARNING] Metadata cache disabled ({self.db_path}): {err}")
+                self._disabled = True
+                return None
+            self._local.conn = conn
+        return conn
+
+    def _select(self, stats: Dict[str, os.stat_result], columns: str) -> Dict[str, tuple]:
+        """Rows (the requested columns) of paths whose size/mtime/inode still
+        match `stats` ({path: os.stat result}); refreshes last_used."""
+        conn = self._conn()
+        if conn is None or not stats:
+            return {}
+        by_key = {cache_key(path): path for path in stats}
+        keys = list(by_key)
+        found = {}
+        stale_touch = []
+        now = time.time()
+        try:
+            for start in range(0, len(keys), _IN_CHUNK):
+                chunk = keys[start:start + _IN_CHUNK]
+                rows = conn.execute(
+                    f"SELECT path, size, mtime_ns, inode, last_used, {columns} FROM entries "
+                    f"WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+                for row in rows:
+                    path = by_key[row[0]]
+                    stat = stats[path]
+                    if row[1:4] != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                        continue
+                    found[path] = row[5:]
+                    if now - row[4] > TOUCH_INTERVAL_S:
+                        stale_touch.append(row[0])
+            if stale_touch:
+                with conn:
+                    conn.executemany("UPDATE entries SET last_used=? WHERE path=?",
+                                     [(now, key) for key in stale_touch])
+        except sqlite3.Error as err:
+            print(f"[WARNING] Metadata cache read failed: {err}")
+        return found
+
+    def get_summaries(self, stats: Dict[str, os.stat_result]) -> Dict[str, Summary]:
+        """{path: Summary} for the still-valid entries among `stats`."""
+        rows = self._select(stats, "sheet_count, hidden_count, sort_mode")
+        return {path: Summary._make(row) for path, row in rows.items()}
+
+    def get_payload(self, path: str, stat: Optional[os.stat_result] = None) -> Optional[dict]:
+        """Full payload of one file, or None if missing/stale."""
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return None
+        row = self._select({path: stat}, "payload").get(path)
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def put_many(self, items: Iterable[tuple]) -> None:
+        """Store (path, os.stat result, Summary, payload dict) tuples, then evict."""
+        conn = self._conn()
+        if conn is None:
+            return
+        now = time.time()
+        rows = []
+        for path, stat, summary, payload in items:
+            text = json.dumps(payload, separators=(",", ":"))
+            rows.append((cache_key(path), stat.st_size, stat.st_mtime_ns, stat.st_ino,
+                         summary.sheet_count, summary.hidden_count, summary.sort_mode,
+                         text, len(text), now))
+        if not rows:
+            return
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+            self.evict()
+        except sqlite3.Error as err:
+            print(f"[WARNING] Metadata cache write failed: {err}")
+
+    def evict(self) -> int:
+        """Drop least recently used entries until under max_bytes; returns rows removed."""
+        conn = self._conn()
+        if conn is None:
+            return 0
+        total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        doomed = []
+        for key, nbytes in conn.execute("SELECT path, nbytes FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes * 0.9:  # some headroom so we do not evict on every put
+                break
+            doomed.append((key,))
+            total -= nbytes
+        with conn:
+            removed = conn.executemany("DELETE FROM entries WHERE path=?", doomed).rowcount
+        return removed
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        conn = self._conn()
+        if conn is not None:
+            with conn:
+                conn.execute("DELETE FROM entries")
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> MetaCache:
+    """Process-wide cache shared by the UI, pre-flight and batch preview."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = MetaCache()
+        return _default
+
+
+def stat_many(paths: Sequence[str]) -> Dict[str, os.stat_result]:
+    """os.stat for each path; unreadable paths are left out."""
+    stats = {}
+    for path in paths:
+        try:
+            stats[path] = os.stat(path)
+        except OSError:
+            pass
+    return stats
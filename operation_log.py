@@ -0,0 +1,123 @@
+"""Undo/redo log of sheet operations, stored as permutations, rename maps and visibility changes."""
+from typing import List, NamedTuple, Optional, Tuple
+
+from ref_rewriter import rewrite_sheet_references
+from xlsx_zip import reorder_sheets_in_file, set_sheet_states_in_file
+
+OPERATION_KINDS = ("order", "rename", "visibility")
+
+
+class Operation(NamedTuple):
+    """One reversible change. `before`/`after` are:
+    order      - tuple of sheet names (full workbook order)
+    rename     - tuple of names in sheet order (old / new, position-aligned)
+    visibility - dict name -> state ("visible", "hidden", "veryHidden")"""
+    kind: str
+    before: object
+    after: object
+
+
+def inverse(op: Operation) -> Operation:
+    """Operation that undoes `op`."""
+    return Operation(op.kind, op.after, op.before)
+
+
+def rename_map(op: Operation) -> dict:
+    """old -> new names of a rename operation (unchanged names omitted)."""
+    return {old: new for old, new in zip(op.before, op.after) if old != new}
+
+
+def apply_to_workbook(workbook, op: Operation) -> None:
+    """Apply `op` to an openpyxl workbook in memory."""
+    if op.kind == "order":
+        by_name = {ws.title: ws for ws in workbook._sheets}
+        workbook._sheets = [by_name[name] for name in op.after]
+    elif op.kind == "rename":
+        mapping = rename_map(op)
+        moving = [ws for ws in workbook._sheets if ws.title in mapping]
+        # park on temporary names first so swaps never collide
+        for i, ws in enumerate(moving):
+            new_name = mapping[ws.title]
+            ws.title = f"~undo{i}~"
+            mapping[ws.title] = new_name
+        for ws in moving:
+            ws.title = mapping[ws.title]
+    elif op.kind == "visibility":
+        for ws in workbook._sheets:
+            if ws.title in op.after:
+                ws.sheet_state = op.after[ws.title]
+    else:
+        raise ValueError(f"Unknown operation kind: {op.kind}")
+
+
+def apply_to_file(path: str, op: Operation) -> bool:
+    """Apply `op` to a saved workbook at zip level (workbook.xml rewrite;
+    renames also rewrite sheet references). No workbook is loaded."""
+    if op.kind == "order":
+        return reorder_sheets_in_file(path, list(op.after))
+    if op.kind == "rename":
+        return rewrite_sheet_references(path, rename_map(op), rename_sheets=True)
+    if op.kind == "visibility":
+        return set_sheet_states_in_file(path, dict(op.after))
+    raise ValueError(f"Unknown operation kind: {op.kind}")
+
+
+class OperationLog:
+    """Done/undone stacks plus how many done operations are already in the
+    file on disk. Undoing a saved operation rewrites only workbook.xml (and,
+    for renames, the parts with references) instead of restoring a backup."""
+    def __init__(self):
+        self.done: List[Operation] = []
+        self.undone: List[Tuple[Operation, bool]] = []
+        self.disk_ops = 0
+
+    def record(self, op: Operation) -> None:
+        """Log a new operation; clears the redo stack."""
+        self.done.append(op)
+        self.undone.clear()
+
+    def mark_saved(self) -> None:
+        """Everything done so far is now in the file; undone ops are not."""
+        self.disk_ops = len(self.done)
+        self.undone = [(op, False) for op, _on_disk in self.undone]
+
+    def can_undo(self) -> bool:
+        """True if there is an operation to undo."""
+        return bool(self.done)
+
+    def can_redo(self) -> bool:
+        """True if there is an operation to redo."""
+        return bool(self.undone)
+
+    def undo(self, workbook=None, path: str = "") -> Optional[Operation]:
+        """Revert the last operation in memory and, if saved, on disk.
+        Returns the reverted operation or None (nothing to undo / failure)."""
+        if not self.done:
+            return None
+        op = self.done[-1]
+        on_disk = len(self.done) <= self.disk_ops
+        if on_disk and not apply_to_file(path, inverse(op)):
+            return None
+        if workbook is not None:
+            apply_to_workbook(workbook, inverse(op))
+        self.done.pop()
+        if on_disk:
+            self.disk_ops = len(self.done)
+        self.undone.append((op, on_disk))
+        return op
+
+    def redo(self, workbook=None, path: str = "") -> Optional[Operation]:
+        """Re-apply the last undone operation (on disk too if it was saved)."""
+        if not self.undone:
+            return None
+        op, on_disk = self.undone[-1]
+        on_disk = on_disk and self.disk_ops == len(self.done)
+        if on_disk and not apply_to_file(path, op):
+            return None
+        if workbook is not None:
+            apply_to_workbook(workbook, op)
+        self.undone.pop()
+        self.done.append(op)
+        if on_disk:
+            self.disk_ops = len(self.done)
+        return op
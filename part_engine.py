@@ -0,0 +1,311 @@
+"""Parallel per-part engine: parse or transform the worksheets of one workbook in a process pool."""
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from atomic_save import commit_temp, discard_temp, temp_path_for
+from io_governor import PacedFile, governed
+from workbook_meta import NS_MAIN, read_sheet_parts, workbook_part_name
+from xlsx_zip import CHUNK_SIZE, DEFAULT_LEVEL, ZIP32_LIMIT, ZipPartWriter, rewrite_parts
+
+# Below this much worksheet XML the work runs in-process: starting workers
+# (and, on Windows, re-importing the app in each) costs more than it saves.
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+# A per-part function gets (part name, opener, shared strings, *args); opener()
+# returns a fresh binary stream of the part, so it may read it more than once.
+#   map functions return any picklable result;
+#   transform functions return None (part unchanged) or an iterator of the new
+#   content in chunks; a generator's return value is passed back as its summary.
+PartFunc = Callable[..., object]
+
+_worker = threading.local()  # per pool process (or calling thread): path, zip, strings
+
+
+def read_shared_strings(zf: zipfile.ZipFile, part: str) -> List[str]:
+    """Plain text of every <si> in the sharedStrings part (rich text runs
+    joined, phonetic runs skipped), streamed with iterparse."""
+    if not part:
+        return []
+    strings = []
+    si_tag = f"{{{NS_MAIN}}}si"
+    t_tag = f"{{{NS_MAIN}}}t"
+    phonetic_tag = f"{{{NS_MAIN}}}rPh"
+    with zf.open(part) as stream:
+        for _event, element in ET.iterparse(stream, events=("end",)):
+            if element.tag == si_tag:
+                skip = {id(t) for phon in element.iter(phonetic_tag) for t in phon.iter(t_tag)}
+                strings.append("".join(t.text or "" for t in element.iter(t_tag) if id(t) not in skip))
+                element.clear()
+    return strings
+
+
+def _init_worker(path: str, strings: List[str]) -> None:
+    """Process-pool initializer. With fork the table is shared copy-on-write;
+    with spawn it is sent once per worker, never once per task."""
+    _worker.path = path
+    _worker.strings = strings
+    _worker.zip = None
+
+
+def _worker_zip() -> zipfile.ZipFile:
+    """This worker's handle on the workbook (opened on first use)."""
+    if _worker.zip is None:
+        _worker.zip = zipfile.ZipFile(_worker.path)
+    return _worker.zip
+
+
+def _run_map(func: PartFunc, part: str, args: tuple):
+    """Worker side of map_parts."""
+    zf = _worker_zip()
+    return func(part, lambda: zf.open(part), _worker.strings, *args)
+
+
+def _run_transform(func: PartFunc, part: str, args: tuple, level: int, scratch_dir: str):
+    """Worker side of transform_parts: run the transform and deflate its output
+    into a scratch file, so only (path, CRC, sizes, summary) crosses processes.
+    Returns None when the part is unchanged."""
+    zf = _worker_zip()
+    chunks = func(part, lambda: zf.open(part), _worker.strings, *args)
+    if chunks is None:
+        return None
+    fd, out_path = tempfile.mkstemp(suffix=".deflate", dir=scratch_dir)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    file_size = 0
+    summary = None
+    with os.fdopen(fd, "wb") as out:
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration as stop:
+                summary = stop.value
+                break
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            out.write(compressor.compress(chunk))
+        out.write(compressor.flush())
+        compress_size = out.tell()
+    return out_path, crc, compress_size, file_size, summary
+
+
+class _InProcess:
+    """Stand-in for the pool when parallelism does not pay (same call shape)."""
+    def __init__(self, path: str, strings: List[str]):
+        _init_worker(path, strings)
+
+    def map(self, func, *iterables):
+        """Run eagerly in the calling thread."""
+        return [func(*items) for items in zip(*iterables)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if _worker.zip is not None:
+            _worker.zip.close()
+            _worker.zip = None
+
+
+def _pool(path: str, strings: List[str], parts: Sequence[str], sizes: Dict[str, int],
+          processes: Optional[int]):
+    """Process pool sized to the work, or _InProcess for small workbooks."""
+    workers = min(len(parts), processes or os.cpu_count() or 1)
+    if workers <= 1 or sum(sizes[part] for part in parts) < PARALLEL_MIN_BYTES:
+        return _InProcess(path, strings)
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(path, strings))
+
+
+def _scan(path: str, shared_strings: bool):
+    """Worksheet (SheetMeta, part) pairs, the shared strings table (if asked
+    for), the zip directory and the workbook part of `path`."""
+    with zipfile.ZipFile(path) as zf:
+        sheet_parts, shared_part = read_sheet_parts(zf)
+        strings = read_shared_strings(zf, shared_part) if shared_strings else []
+        return sheet_parts, strings, zf.infolist(), workbook_part_name(zf)
+
+
+def _sheet_selection(sheet_parts, sheets: Optional[Sequence[str]]) -> Dict[str, str]:
+    """{part: sheet name} of the worksheets to process (all when `sheets` is None)."""
+    wanted = None if sheets is None else set(sheets)
+    return {part: meta.name for meta, part in sheet_parts if wanted is None or meta.name in wanted}
+
+
+def map_parts(path: str, func: PartFunc, parts: Sequence[str], args: tuple = (),
+              processes: Optional[int] = None, shared_strings: bool = True) -> Dict[str, object]:
+    """{part: func(part, opener, strings, *args)}, one part per pool task.
+    `func` must be a module-level function so it can be sent to worker processes."""
+    _sheets, strings, infos, _workbook = _scan(path, shared_strings)
+    sizes = {info.filename: info.file_size for info in infos}
+    parts = [part for part in parts if part in sizes]
+    with _pool(path, strings, parts, sizes, processes) as pool:
+        results = list(pool.map(_run_map, [func] * len(parts), parts, [args] * len(parts)))
+    return dict(zip(parts, results))
+
+
+def map_sheets(path: str, func: PartFunc, args: tuple = (), sheets: Optional[Sequence[str]] = None,
+               processes: Optional[int] = None) -> Dict[str, object]:
+    """{sheet name: result} of map_parts over every worksheet (or the named `sheets`)."""
+    with zipfile.ZipFile(path) as zf:
+        selection = _sheet_selection(read_sheet_parts(zf)[0], sheets)
+    results = map_parts(path, func, list(selection), args, processes)
+    return {selection[part]: result for part, result in results.items()}
+
+
+def transform_parts(path: str, func: PartFunc, parts: Sequence[str], args: tuple = (),
+                    dst_path: str = "", level: int = DEFAULT_LEVEL, processes: Optional[int] = None,
+                    extra: Optional[Dict[str, bytes]] = None,
+                    shared_strings: bool = True) -> Dict[str, object]:
+    """Rewrite `parts` in parallel and reassemble the zip.
+    Each worker streams its part through `func` and deflates the result
+    itself; the parent copies every other part raw and stitches the
+    compressed parts in, in the original order. `extra` replaces small
+    parts (e.g. workbook.xml) in the same pass. Writes through a verified
+    temp file to `dst_path` (in place by default).
+    Returns {part: summary} for the parts that changed."""
+    target = dst_path or path
+    tmp_path = temp_path_for(target)
+    scratch_dir = tempfile.mkdtemp(prefix="excel_sorter_parts_")
+    extra = extra or {}
+    try:
+        _sheets, strings, infos, workbook_part = _scan(path, shared_strings)
+        sizes = {info.filename: info.file_size for info in infos}
+        parts = [part for part in parts if part in sizes and part not in extra]
+        if (len(infos) >= 0xFFFF or os.path.getsize(path) * 2 >= ZIP32_LIMIT
+                or any(sizes[part] >= ZIP32_LIMIT for part in parts)):
+            changed, unchanged = _transform_zip64(path, tmp_path, func, args, parts, strings,
+                                                  level, extra)
+        else:
+            with _pool(path, strings, parts, sizes, processes) as pool:
+                outputs = dict(zip(parts, pool.map(
+                    _run_transform, [func] * len(parts), parts, [args] * len(parts),
+                    [level] * len(parts), [scratch_dir] * len(parts))))
+            changed, unchanged = _assemble(path, tmp_path, infos, outputs, extra, level)
+        if changed or extra:
+            commit_temp(tmp_path, target, unchanged, required=(workbook_part,))
+        else:
+            discard_temp(tmp_path)
+            if dst_path:
+                shutil.copyfile(path, dst_path)
+        return changed
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def transform_sheets(path: str, func: PartFunc, args: tuple = (), dst_path: str = "",
+                     sheets: Optional[Sequence[str]] = None, level: int = DEFAULT_LEVEL,
+                     processes: Optional[int] = None) -> Dict[str, object]:
+    """transform_parts over every worksheet (or the named `sheets`), with the
+    shared strings table; returns {sheet name: summary} of changed sheets."""
+    with zipfile.ZipFile(path) as zf:
+        selection = _sheet_selection(read_sheet_parts(zf)[0], sheets)
+    changed = transform_parts(path, func, list(selection), args, dst_path, level, processes)
+    return {selection[part]: summary for part, summary in changed.items()}
+
+
+def _assemble(path: str, tmp_path: str, infos: List[zipfile.ZipInfo], outputs: Dict[str, tuple],
+              extra: Dict[str, bytes], level: int
+              ) -> Tuple[Dict[str, object], Dict[str, Tuple[int, int, int]]]:
+    """Write the new zip: worker output for changed parts, `extra`
+    replacements, raw copies for everything else. Returns the changed parts'
+    summaries and (CRC, sizes) of the raw copies for commit_temp. This pass
+    is the bulk transfer, so it alone holds the I/O slot (the transforms are
+    CPU work on scratch files)."""
+    changed = {}
+    unchanged = {}
+    with governed(path, tmp_path) as io, open(path, "rb") as src, open(tmp_path, "wb") as dst:
+        src_fp = PacedFile(src, io)
+        writer = ZipPartWriter(PacedFile(dst, io))
+        for info in infos:
+            output = outputs.get(info.filename)
+            if info.filename in extra:
+                writer.write_bytes(info, extra[info.filename], level)
+            elif output is not None:
+                out_path, crc, compress_size, file_size, summary = output
+                with open(out_path, "rb") as part_fp:
+                    writer.write_raw(info, zipfile.ZIP_DEFLATED, crc, compress_size,
+                                     file_size, part_fp)
+                os.remove(out_path)
+                changed[info.filename] = summary
+            else:
+                writer.copy_raw(src_fp, info)
+                unchanged[info.filename] = (info.CRC, info.compress_size, info.file_size)
+        writer.close()
+    return changed, unchanged
+
+
+def _summarised(chunks: Iterator[bytes], changed: Dict[str, object], part: str) -> Callable:
+    """rewrite_parts transform that replays `chunks` and records its summary."""
+    def transform(_stream) -> Iterator[bytes]:
+        changed[part] = yield from chunks
+    return transform
+
+
+def _transform_zip64(path: str, tmp_path: str, func: PartFunc, args: tuple, parts: List[str],
+                     strings: List[str], level: int, extra: Dict[str, bytes]
+                     ) -> Tuple[Dict[str, object], Dict[str, Tuple[int, int, int]]]:
+    """Sequential, in-process fallback through rewrite_parts (zip64 archives)."""
+    changed = {}
+    transforms = {}
+    with zipfile.ZipFile(path) as zf:
+        for part in parts:
+            chunks = func(part, lambda part=part: zf.open(part), strings, *args)
+            if chunks is not None:
+                transforms[part] = _summarised(chunks, changed, part)
+        unchanged = rewrite_parts(path, tmp_path, extra, level, transforms)
+    return changed, unchanged
+
+
+def sheet_stats(part: str, opener: Callable, strings: List[str]) -> Dict[str, int]:
+    """Map function: cell statistics of one worksheet (streamed, constant memory)."""
+    stats = {"rows": 0, "cells": 0, "formulas": 0, "numbers": 0, "text": 0, "text_chars": 0}
+    row_tag = f"{{{NS_MAIN}}}row"
+    cell_tag = f"{{{NS_MAIN}}}c"
+    value_tag = f"{{{NS_MAIN}}}v"
+    formula_tag = f"{{{NS_MAIN}}}f"
+    with opener() as stream:
+        for _event, element in ET.iterparse(stream, events=("end",)):
+            if element.tag != row_tag:
+                continue
+            stats["rows"] += 1
+            for cell in element.iter(cell_tag):
+                stats["cells"] += 1
+                if cell.find(formula_tag) is not None:
+                    stats["formulas"] += 1
+                cell_type = cell.get("t", "n")
+                value = cell.findtext(value_tag)
+                if cell_type == "s" and value is not None:
+                    index = int(value)
+                    stats["text"] += 1
+                    stats["text_chars"] += len(strings[index]) if index < len(strings) else 0
+                elif cell_type == "inlineStr":
+                    stats["text"] += 1
+                    stats["text_chars"] += len("".join(cell.itertext()))
+                elif cell_type == "n" and value:
+                    stats["numbers"] += 1
+            element.clear()
+    return stats
+
+
+def workbook_stats(path: str, processes: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+    """{sheet name: sheet_stats} for every worksheet, parsed in parallel."""
+    return map_sheets(path, sheet_stats, processes=processes)
+
+
+def part_chunks(stream, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """A part's bytes in chunks (for transforms that pass content through)."""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
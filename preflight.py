@@ -0,0 +1,108 @@
+"""Pre-flight validation of a whole batch before any file is written."""
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Sequence
+
+from batch_preview import cached_sheet_meta
+from file_locks import lock_status
+from sheet_rules import plan_template_names
+from validator import validate_names
+
+SUPPORTED_EXTENSIONS = (".xlsx", ".xlsm", ".xltx", ".xltm")
+
+
+class FileCheck(NamedTuple):
+    """Pre-flight result for one file.
+    errors block processing; warnings are fixed automatically (e.g. rename
+    collisions resolved by validator.resolve_collisions)."""
+    path: str
+    errors: List[str]
+    warnings: List[str]
+    sheet_count: int
+
+
+class PreflightReport(NamedTuple):
+    """Consolidated pre-flight results, in input order."""
+    checks: List[FileCheck]
+
+    @property
+    def ok_paths(self) -> List[str]:
+        """Paths that passed (possibly with warnings)."""
+        return [check.path for check in self.checks if not check.errors]
+
+    @property
+    def failed(self) -> List[FileCheck]:
+        """Checks with at least one blocking error."""
+        return [check for check in self.checks if check.errors]
+
+    def summary(self) -> str:
+        """One-line summary for the status bar/log."""
+        warned = sum(1 for check in self.checks if check.warnings and not check.errors)
+        return (f"Pre-flight: {len(self.checks)} files, {len(self.ok_paths)} ok "
+                f"({warned} with warnings), {len(self.failed)} failed")
+
+    def format(self, limit: int = 50) -> str:
+        """Multi-line report of failures and warnings (first `limit` files)."""
+        lines = [self.summary()]
+        shown = 0
+        for check in self.checks:
+            if not (check.errors or check.warnings) or shown >= limit:
+                continue
+            shown += 1
+            issues = [f"ERROR {e}" for e in check.errors] + [f"WARN {w}" for w in check.warnings]
+            lines.append(f"{os.path.basename(check.path)}: " + "; ".join(issues))
+        return "\n".join(lines)
+
+
+def check_file(path: str, template: str = "{title}", pattern: str = "") -> FileCheck:
+    """Validate one file with metadata-only parsing (workbook.xml only)."""
+    errors = []
+    warnings = []
+    if not path.lower().endswith(SUPPORTED_EXTENSIONS):
+        errors.append("unsupported format (only .xlsx/.xlsm are supported)")
+        return FileCheck(path, errors, warnings, 0)
+    if not os.path.isfile(path):
+        errors.append("file not found")
+        return FileCheck(path, errors, warnings, 0)
+
+    status = lock_status(path)
+    if status == "locked":
+        # not blocking: the run parks it and retries until released (retry_queue)
+        warnings.append("file is open/locked by another program (will be retried)")
+    elif status == "lockfile":
+        warnings.append("Office lock file present (file may be open)")
+
+    try:
+        sheets = cached_sheet_meta(path)  # reuses the batch preview when fresh
+    except (zipfile.BadZipFile, KeyError) as err:
+        errors.append(f"not a readable workbook ({err})")
+        return FileCheck(path, errors, warnings, 0)
+    except Exception as err:  # malformed XML and the like
+        errors.append(f"unreadable workbook.xml ({err})")
+        return FileCheck(path, errors, warnings, 0)
+    if not sheets:
+        errors.append("workbook has no sheets")
+
+    if template and template != "{title}":
+        try:
+            planned = plan_template_names([sheet.name for sheet in sheets], template, pattern)
+        except Exception as err:
+            errors.append(f"rename template failed ({err})")
+        else:
+            problems = validate_names(planned)
+            if problems:
+                kinds = sorted({kind for found in problems.values() for kind in found})
+                warnings.append(f"{len(problems)} renamed sheet(s) need fixing: {', '.join(kinds)}")
+    return FileCheck(path, errors, warnings, len(sheets))
+
+
+def run_preflight(paths: Sequence[str], template: str = "{title}", pattern: str = "",
+                  max_workers: int = None) -> PreflightReport:
+    """Validate every file in parallel and return a consolidated report.
+    Work per file is a lock probe plus inflating workbook.xml, so threads
+    (I/O bound, zlib releases the GIL) are enough."""
+    workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        checks = list(pool.map(lambda p: check_file(p, template, pattern), paths))
+    return PreflightReport(checks)
@@ -0,0 +1,61 @@
+"""Thread-safe progress events from workers, drained by the UI once per frame."""
+import queue
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class ProgressEvent(NamedTuple):
+    """One state change reported by a worker (see worker.BatchWorker)."""
+    idx: int
+    total: int
+    path: str
+    state: str
+
+
+class ProgressSnapshot(NamedTuple):
+    """Everything that happened since the previous drain, coalesced.
+    counts: events per state ("error:..." counted as "error");
+    latest: newest event (only its status text is worth showing);
+    errors: (path, state) of every error, in order;
+    states: newest state per file path (for per-row status)."""
+    counts: Dict[str, int]
+    latest: Optional[ProgressEvent]
+    errors: List[Tuple[str, str]]
+    finished: bool
+    states: Dict[str, str]
+
+
+class ProgressBus:
+    """Workers call post() (same signature as the BatchWorker callback), the
+    Tk thread calls drain() from root.after(). However many events arrive,
+    the UI does one progress/status update and one log write per frame."""
+    def __init__(self):
+        self._events = queue.SimpleQueue()
+        self.totals: Dict[str, int] = {}
+
+    def post(self, idx: int, total: int, path: str, state: str) -> None:
+        """Queue an event; safe from any thread, never blocks."""
+        self._events.put(ProgressEvent(idx, total, path, state))
+
+    def drain(self, limit: int = 10000) -> ProgressSnapshot:
+        """Pop up to `limit` queued events and fold them into one snapshot."""
+        counts: Dict[str, int] = {}
+        errors = []
+        states: Dict[str, str] = {}
+        latest = None
+        finished = False
+        for _ in range(limit):
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            kind = "error" if event.state.startswith("error") else event.state
+            counts[kind] = counts.get(kind, 0) + 1
+            self.totals[kind] = self.totals.get(kind, 0) + 1
+            if kind == "error":
+                errors.append((event.path, event.state))
+            if kind == "finished":
+                finished = True
+            elif event.path:
+                states[event.path] = kind
+            latest = event
+        return ProgressSnapshot(counts, latest, errors, finished, states)
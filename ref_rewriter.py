@@ -0,0 +1,207 @@
+"""Streaming rewrite of sheet references (formulas, charts, names, pivot caches) after renames."""
+import functools
+import re
+import zipfile
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from part_engine import transform_parts
+from workbook_meta import workbook_part_name
+from xlsx_zip import (
+    CHUNK_SIZE,
+    NAME_ATTR_RE,
+    SHEETS_BLOCK_RE,
+    SHEET_RE,
+    xml_attr_escape,
+    xml_attr_unescape,
+)
+
+# Element text that holds formulas: worksheet <f>, data validation
+# <formula1>/<formula2>, conditional formatting <formula>, chart <c:f>,
+# workbook <definedName>. Hyperlink location="..." attributes are handled too,
+# as are the bare sheet="..." names of pivot cache <worksheetSource>.
+_FORMULA_TEXT_RE = re.compile(
+    rb"(<(?:\w+:)?(?:f|formula|formula1|formula2|definedName)\b[^>]*>)([^<]+)")
+_LOCATION_ATTR_RE = re.compile(rb"(\blocation=\")([^\"]*)")
+_WORKSHEET_SOURCE_RE = re.compile(rb"(<(?:\w+:)?worksheetSource\b)([^>]*)")
+_SIMPLE_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*\Z")
+_CELL_LIKE_RE = re.compile(r"([A-Za-z]{1,3}\d+|[Rr]\d*[Cc]\d*)\Z")
+
+
+def _xml_text(text: str) -> bytes:
+    """Escape text the way it appears in element content."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").encode("utf-8")
+
+
+def _needs_quotes(name: str) -> bool:
+    """True when `name` must be written as 'name'! in a formula."""
+    return not _SIMPLE_NAME_RE.match(name) or bool(_CELL_LIKE_RE.match(name))
+
+
+def build_matcher(mapping: Dict[str, str]) -> Tuple["re.Pattern", Callable]:
+    """Compile one matcher for every old name in `mapping`.
+    Returns (pattern, replace) where replace(match) gives the new reference
+    prefix (quoted when needed), or the new bare name for a sheet="..."
+    attribute. Matching is case-insensitive like Excel.
+    3D references (Jan:Mar!A1) are not rewritten."""
+    quoted = []
+    plain = []
+    bare = set()
+    lookup = {}
+    for old, new in mapping.items():
+        lookup[old.casefold()] = new
+        quoted.append(re.escape(_xml_text(old.replace("'", "''"))))
+        if not _needs_quotes(old):
+            plain.append(re.escape(old.encode("utf-8")))
+        bare.add(re.escape(xml_attr_escape(old)))
+        bare.add(re.escape(_xml_text(old).replace(b'"', b"&quot;")))
+    # longest first so a name never shadows a longer one sharing its prefix
+    quoted.sort(key=len, reverse=True)
+    plain.sort(key=len, reverse=True)
+    alternatives = [rb"(?:'|&apos;)(?P<q>" + b"|".join(quoted) + rb")(?:'|&apos;)!",
+                    rb"(?<=\ssheet=\")(?P<s>" + b"|".join(sorted(bare, key=len, reverse=True))
+                    + rb")(?=\")"]
+    if plain:
+        alternatives.append(rb"(?<![\w.'\]])(?P<u>" + b"|".join(plain) + rb")!")
+    pattern = re.compile(b"|".join(alternatives), re.IGNORECASE)
+
+    def replace(match) -> bytes:
+        if match.group("s") is not None:
+            new = lookup.get(xml_attr_unescape(match.group("s")).casefold())
+            return match.group(0) if new is None else xml_attr_escape(new)
+        if match.group("q") is not None:
+            old = xml_attr_unescape(match.group("q")).replace("''", "'")
+        else:
+            old = match.group("u").decode("utf-8")
+        new = lookup.get(old.casefold())
+        if new is None:
+            return match.group(0)
+        if _needs_quotes(new):
+            return b"'" + _xml_text(new.replace("'", "''")) + b"'!"
+        return new.encode("utf-8") + b"!"
+    return pattern, replace
+
+
+def rewrite_segment(segment: bytes, pattern, replace) -> Tuple[bytes, int]:
+    """Rewrite references inside formula text, location attributes and
+    pivot cache sources only."""
+    count = 0
+
+    def _sub_refs(match):
+        nonlocal count
+        new_text, hits = pattern.subn(replace, match.group(2))
+        count += hits
+        return match.group(1) + new_text
+
+    segment = _FORMULA_TEXT_RE.sub(_sub_refs, segment)
+    segment = _LOCATION_ATTR_RE.sub(_sub_refs, segment)
+    segment = _WORKSHEET_SOURCE_RE.sub(_sub_refs, segment)
+    return segment, count
+
+
+def iter_segments(stream, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield XML in chunks cut just before a '<', so no element text or
+    attribute value (and therefore no reference) spans two segments."""
+    pending = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            if pending:
+                yield pending
+            return
+        pending += chunk
+        cut = pending.rfind(b"<")
+        if cut <= 0:
+            continue
+        yield pending[:cut]
+        pending = pending[cut:]
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_matcher(mapping_items: Tuple[Tuple[str, str], ...]):
+    """build_matcher once per process for a mapping (workers get items, not regexes)."""
+    return build_matcher(dict(mapping_items))
+
+
+def _rewrite_stream(opener: Callable, pattern, replace) -> Iterator[bytes]:
+    """Rewritten segments of a part; returns the number of references changed."""
+    hits_total = 0
+    with opener() as stream:
+        for segment in iter_segments(stream):
+            out, hits = rewrite_segment(segment, pattern, replace)
+            hits_total += hits
+            yield out
+    return hits_total
+
+
+def rewrite_refs_part(_part: str, opener: Callable, _strings: List[str],
+                      mapping_items: Tuple[Tuple[str, str], ...]) -> Optional[Iterator[bytes]]:
+    """part_engine transform: None when the part holds no reference to an old
+    name (cheap first pass that stops at the first hit), else the rewrite."""
+    pattern, replace = _cached_matcher(mapping_items)
+    with opener() as stream:
+        if not any(pattern.search(segment) for segment in iter_segments(stream)):
+            return None
+    return _rewrite_stream(opener, pattern, replace)
+
+
+def _rename_sheet_entries(data: bytes, mapping: Dict[str, str]) -> bytes:
+    """Rename <sheet name="..."> entries of workbook.xml."""
+    lookup = {old.casefold(): new for old, new in mapping.items()}
+    block = SHEETS_BLOCK_RE.search(data)
+    if not block:
+        return data
+
+    def _rename(match):
+        element = match.group(0)
+        name = NAME_ATTR_RE.search(element)
+        if not name:
+            return element
+        new = lookup.get(xml_attr_unescape(name.group(2)).casefold())
+        if new is None:
+            return element
+        return element[:name.start()] + b'name="' + xml_attr_escape(new) + b'"' + element[name.end():]
+
+    body = SHEET_RE.sub(_rename, block.group(2))
+    return data[:block.start(2)] + body + data[block.end(2):]
+
+
+def is_reference_part(name: str, workbook_part: str) -> bool:
+    """Parts that can carry sheet references."""
+    return (name == workbook_part
+            or (name.startswith("xl/worksheets/") and name.endswith(".xml"))
+            or (name.startswith("xl/charts/chart") and name.endswith(".xml"))
+            or (name.startswith("xl/pivotCache/pivotCacheDefinition")
+                and name.endswith(".xml")))
+
+
+def rewrite_sheet_references(path: str, mapping: Dict[str, str], dst_path: str = "",
+                             rename_sheets: bool = False) -> bool:
+    """Rewrite sheet references for an old->new name map at zip level.
+    Worksheet, chart, pivot cache and workbook parts are streamed through one compiled
+    matcher; parts without any reference, and all other parts, are copied
+    raw. With `rename_sheets` the <sheet> entries are renamed too (a full
+    rename without openpyxl); otherwise the names are assumed to be renamed
+    already (e.g. by ExcelHandler before saving).
+    Worksheets, charts and pivot caches are rewritten by part_engine, in parallel worker
+    processes when the workbook is large enough to benefit."""
+    mapping = {old: new for old, new in mapping.items() if old != new}
+    if not mapping:
+        return True
+    pattern, replace = build_matcher(mapping)
+    try:
+        with zipfile.ZipFile(path) as zf:
+            workbook_part = workbook_part_name(zf)
+            data = zf.read(workbook_part)
+            parts = [name for name in zf.namelist()
+                     if name != workbook_part and is_reference_part(name, workbook_part)]
+        if rename_sheets:
+            data = _rename_sheet_entries(data, mapping)
+        data, refs = rewrite_segment(data, pattern, replace)
+        changed = transform_parts(path, rewrite_refs_part, parts, (tuple(mapping.items()),),
+                                  dst_path, extra={workbook_part: data}, shared_strings=False)
+        refs += sum(changed.values())
+        print(f"[INFO] Sheet references rewritten: {refs} in {path}")
+        return True
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile, zipfile.LargeZipFile) as err:
+        print(f"[ERROR while rewriting sheet references] {path}: {err}")
+        return False
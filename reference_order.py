@@ -0,0 +1,127 @@
+"""Order sheets after a reference (master) workbook."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Sequence
+
+from backup_util import make_backup
+from file_locks import is_locked
+from io_governor import governed
+from workbook_meta import read_sheet_meta, read_sheet_names
+from xlsx_zip import reorder_sheets_in_file
+
+# Where sheets missing from the reference go:
+#   "end"   - after all known sheets, alphabetically
+#   "start" - before all known sheets, alphabetically
+#   "keep"  - after all known sheets, in their current relative order
+FALLBACK_RULES = ("end", "start", "keep")
+
+
+class ReferenceOrder:
+    """Name -> rank index built from a reference workbook.
+    Planned orders are cached by a hash of the target's sheet-name set, so
+    a batch of copies of the same template is planned only once. The cache
+    is bounded and guarded by a lock so BatchWorker threads can share it."""
+    def __init__(self, names: Sequence[str], fallback: str = "end", cache_size: int = 1024):
+        if fallback not in FALLBACK_RULES:
+            raise ValueError(f"Unknown fallback rule: {fallback}")
+        self.names = list(names)
+        self.rank: Dict[str, int] = {}
+        for idx, name in enumerate(self.names):
+            self.rank.setdefault(name.casefold(), idx)
+        self.fallback = fallback
+        self.cache_size = cache_size
+        self._plans: "OrderedDict[bytes, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_workbook(cls, path: str, fallback: str = "end") -> "ReferenceOrder":
+        """Build the index from a reference workbook's sheet order."""
+        return cls(read_sheet_names(path), fallback=fallback)
+
+    def _layout_hash(self, names: Sequence[str]) -> bytes:
+        """Hash of the sheet-name set (ordered tuple for the 'keep' rule)."""
+        folded = [name.casefold() for name in names]
+        if self.fallback != "keep":
+            folded.sort()
+        return hashlib.sha1("\0".join(folded).encode("utf-8")).digest()
+
+    def _plan_uncached(self, names: Sequence[str]) -> List[str]:
+        """Compute the casefolded target order for `names`."""
+        known = []
+        unknown = []
+        for name in names:
+            folded = name.casefold()
+            if folded in self.rank:
+                known.append(folded)
+            else:
+                unknown.append(folded)
+        known.sort(key=self.rank.__getitem__)
+        if self.fallback != "keep":
+            unknown.sort()
+        if self.fallback == "start":
+            return unknown + known
+        return known + unknown
+
+    def plan(self, names: Sequence[str]) -> List[str]:
+        """Return `names` reordered after the reference."""
+        digest = self._layout_hash(names)
+        with self._lock:
+            planned = self._plans.get(digest)
+            if planned is not None:
+                self._plans.move_to_end(digest)
+                self.hits += 1
+        if planned is None:
+            planned = self._plan_uncached(names)
+            with self._lock:
+                self.misses += 1
+                self._plans[digest] = planned
+                if len(self._plans) > self.cache_size:
+                    self._plans.popitem(last=False)
+        by_folded = {name.casefold(): name for name in names}
+        return [by_folded[folded] for folded in planned]
+
+    def key(self) -> Callable:
+        """Sort key for ExcelHandler.apply_custom_sort / BatchWorker."""
+        unknown_rank = -1 if self.fallback == "start" else len(self.names)
+
+        def key(ws):
+            rank = self.rank.get(ws.title.casefold())
+            if rank is not None:
+                return (rank, "")
+            tiebreak = "" if self.fallback == "keep" else ws.title.lower()
+            return (unknown_rank, tiebreak)
+        return key
+
+    def apply_to_file(self, path: str, dst_path: str = "", backup_mode: str = "") -> str:
+        """Reorder one target workbook at zip level (only workbook.xml changes).
+        Like ExcelHandler.apply_custom_sort, visible sheets follow the
+        reference and hidden ones go last in their current order.
+        backup_mode: back up first (see backup_util.BACKUP_MODES), "" = no backup.
+        Returns "sorted", "unchanged", "locked" or "error"."""
+        try:
+            sheets = read_sheet_meta(path)
+        except Exception as err:
+            print(f"[ERROR while reading sheet names] {path}: {err}")
+            return "error"
+        names = [sheet.name for sheet in sheets]
+        planned = self.plan([sheet.name for sheet in sheets if sheet.state == "visible"])
+        planned += [sheet.name for sheet in sheets if sheet.state != "visible"]
+        if planned == names and not dst_path:
+            print(f"[INFO] Already in reference order: {path}")
+            return "unchanged"
+        if not dst_path and is_locked(path):
+            return "locked"
+        if backup_mode:
+            backup = make_backup(path, backup_mode)
+            if backup:
+                print(f"[INFO] Backup created: {backup}")
+            else:
+                print(f"[WARNING] Backup could not be created for: {path}")
+        with governed(path, dst_path) as io:
+            ok = reorder_sheets_in_file(path, planned, dst_path)
+            io.read(os.path.getsize(path))
+        return "sorted" if ok else "error"
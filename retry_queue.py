@@ -0,0 +1,101 @@
+"""Retry queue for locked workbooks: exponential backoff up to a deadline."""
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from file_locks import is_locked
+
+
+class RetryPolicy(NamedTuple):
+    """Backoff between lock re-checks and how long a file may stay locked.
+    Delays: initial_delay, then * factor per attempt, capped at max_delay.
+    deadline: seconds after the file was first parked (0 = never retry)."""
+    initial_delay: float = 2.0
+    factor: float = 2.0
+    max_delay: float = 60.0
+    deadline: float = 300.0
+
+
+DEFAULT_RETRY = RetryPolicy()
+
+
+def is_released(path: str) -> bool:
+    """Cheap re-check: the read+write open probe succeeds. An Office lock file
+    alone ("lockfile", e.g. left behind by an Excel crash) does not keep a
+    writable workbook parked until the deadline."""
+    return not is_locked(path)
+
+
+class RetryQueue:
+    """Locked files parked by due time. pop_released() probes only entries
+    whose backoff has elapsed, so re-checks cost a few syscalls and never
+    slow down the rest of the batch. Thread-safe."""
+    def __init__(self, policy: RetryPolicy = DEFAULT_RETRY,
+                 probe: Callable[[str], bool] = is_released, clock: Callable[[], float] = time.monotonic):
+        self.policy = policy
+        self.probe = probe
+        self.clock = clock
+        self.expired: List[str] = []
+        self._heap: List[Tuple[float, int, str, int, float]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._heap)
+
+    def park(self, path: str, attempt: int = 0, first_seen: Optional[float] = None) -> bool:
+        """Queue `path` for a later retry; False if the policy allows none."""
+        now = self.clock()
+        first_seen = now if first_seen is None else first_seen
+        if now - first_seen >= self.policy.deadline:
+            with self._lock:
+                self.expired.append(path)
+            return False
+        delay = min(self.policy.initial_delay * self.policy.factor ** attempt, self.policy.max_delay)
+        due = min(now + delay, first_seen + self.policy.deadline)
+        with self._changed:
+            heapq.heappush(self._heap, (due, next(self._seq), path, attempt, first_seen))
+            self._changed.notify_all()
+        return True
+
+    def pop_released(self) -> List[str]:
+        """Paths whose backoff elapsed and that are no longer locked. Still
+        locked ones are re-parked with a longer delay, or expire."""
+        now = self.clock()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        released = []
+        for _due, _seq, path, attempt, first_seen in due:
+            if self.probe(path):
+                released.append(path)
+            else:
+                self.park(path, attempt + 1, first_seen)
+        return released
+
+    def next_due(self) -> Optional[float]:
+        """Seconds until the next re-check (None when empty)."""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self.clock())
+
+    def wait_released(self, should_stop: Callable[[], bool] = lambda: False,
+                      poll: float = 0.5) -> List[str]:
+        """Block until at least one parked file is released (returned) or
+        the queue is empty (every file expired; returns [])."""
+        while not should_stop():
+            released = self.pop_released()
+            if released:
+                return released
+            wait = self.next_due()
+            if wait is None:
+                return []
+            with self._changed:
+                self._changed.wait(min(wait, poll))
+        return []
@@ -0,0 +1,527 @@
+"""Sort the rows of a worksheet by key columns, streamed at part level with spill to disk."""
+import heapq
+import pickle
+import re
+import tempfile
+import zipfile
+from array import array
+from typing import BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from part_engine import transform_sheets
+from workbook_meta import NS_REL, read_part_rels, read_sheet_parts
+from xlsx_zip import CHUNK_SIZE, DEFAULT_LEVEL, xml_attr_unescape
+
+RUN_ROWS = 1_000_000  # keys held in memory; larger sheets are sorted in runs merged from disk
+
+# Excel's ascending order by type: numbers < text < logicals < errors < blanks.
+# Blanks stay last in descending order too.
+RANK_NUMBER, RANK_TEXT, RANK_BOOL, RANK_ERROR, RANK_BLANK = range(5)
+
+_SHEET_DATA_RE = re.compile(rb"<(?:\w+:)?sheetData\b[^>]*?(/?)>")
+_SHEET_DATA_END_RE = re.compile(rb"</(?:\w+:)?sheetData>")
+_ROW_START_RE = re.compile(rb"<(?:\w+:)?row\b")
+_ROW_END_RE = re.compile(rb"</(?:\w+:)?row>")
+_ROW_NUM_RE = re.compile(rb"(<(?:\w+:)?row\b[^>]*?\sr=\")(\d+)(\")")
+_CELL_RE = re.compile(rb"<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)", re.S)
+_CELL_REF_RE = re.compile(rb"(\sr=\")([A-Z]{1,3})(\d+)(\")")
+_ATTR_RE = re.compile(rb"\s(\w+)=\"([^\"]*)\"")
+_VALUE_RE = re.compile(rb"<(?:\w+:)?v>(.*?)</(?:\w+:)?v>", re.S)
+_TEXT_RE = re.compile(rb"<(?:\w+:)?t\b[^>]*>(.*?)</(?:\w+:)?t>", re.S)
+_FORMULA_RE = re.compile(rb"<((?:\w+:)?f)\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?f>)", re.S)
+_MERGE_RE = re.compile(rb"<(?:\w+:)?mergeCell\b[^>]*\sref=\"([A-Z]+)(\d+):([A-Z]+)(\d+)\"")
+_HYPERLINK_RE = re.compile(rb"(<(?:\w+:)?hyperlink\b[^>]*?\sref=\")([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?(\")")
+_COMMENT_REF_RE = re.compile(rb"<(?:\w+:)?comment\b[^>]*?\sref=\"([A-Z]+)(\d+)(?::[A-Z]+(\d+))?\"")
+_RANGE_ROWS_RE = re.compile(rb"([A-Z]+)(\d+)")
+COMMENTS_REL = NS_REL + "/comments"
+
+
+class SortKey(NamedTuple):
+    """One key column: 0-based column index and direction."""
+    column: int
+    descending: bool = False
+
+
+def column_index(letters: str) -> int:
+    """"A" -> 0, "AB" -> 27."""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def parse_sort_keys(spec: Sequence) -> List[SortKey]:
+    """Keys from "B", "-C", 3 (1-based) or SortKey items; '-' means descending."""
+    keys = []
+    for item in spec:
+        if isinstance(item, SortKey):
+            keys.append(item)
+            continue
+        text = str(item).strip()
+        descending = text.startswith("-")
+        text = text.lstrip("+-").strip()
+        if text.isdigit() and int(text) > 0:
+            keys.append(SortKey(int(text) - 1, descending))
+        elif text.isalpha() and len(text) <= 3:
+            keys.append(SortKey(column_index(text), descending))
+        else:
+            raise ValueError(f"invalid sort column: {item!r}")
+    if not keys:
+        raise ValueError("at least one sort column is required")
+    return keys
+
+
+class _Descending:
+    """Wraps a key so it compares in reverse (for merging runs)."""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __reduce__(self):
+        return _Descending, (self.key,)
+
+
+def _cell_key(attrs: bytes, body: Optional[bytes], strings: List[str]) -> Tuple[int, float, str]:
+    """(rank, number, text) sort key of one <c> element."""
+    if not body:
+        return RANK_BLANK, 0.0, ""
+    cell_type = dict(_ATTR_RE.findall(attrs)).get(b"t", b"n")
+    if cell_type == b"inlineStr":
+        text = "".join(xml_attr_unescape(part) for part in _TEXT_RE.findall(body))
+        return (RANK_TEXT, 0.0, text.casefold()) if text else (RANK_BLANK, 0.0, "")
+    value = _VALUE_RE.search(body)
+    if value is None or not value.group(1):
+        return RANK_BLANK, 0.0, ""
+    raw = value.group(1)
+    if cell_type == b"n":
+        return RANK_NUMBER, float(raw), ""
+    if cell_type == b"s":
+        index = int(raw)
+        text = strings[index] if index < len(strings) else ""
+        return (RANK_TEXT, 0.0, text.casefold()) if text else (RANK_BLANK, 0.0, "")
+    if cell_type == b"b":
+        return RANK_BOOL, float(raw == b"1"), ""
+    if cell_type == b"e":
+        return RANK_ERROR, 0.0, xml_attr_unescape(raw)
+    # "str" (formula text) and "d" (ISO 8601 dates sort correctly as text)
+    return RANK_TEXT, 0.0, xml_attr_unescape(raw).casefold()
+
+
+def _row_keys(row: bytes, wanted: Sequence[int], strings: List[str]) -> List[Tuple[int, float, str]]:
+    """Sort keys of the `wanted` columns of one <row> element."""
+    found = {}
+    position = -1
+    for match in _CELL_RE.finditer(row):
+        attrs, body = match.group(1), match.group(2)
+        ref = _CELL_REF_RE.search(attrs)
+        position = column_index(ref.group(2).decode("ascii")) if ref else position + 1
+        if position in wanted:
+            found[position] = _cell_key(attrs, body, strings)
+    blank = (RANK_BLANK, 0.0, "")
+    return [found.get(column, blank) for column in wanted]
+
+
+class _SharedFormulas:
+    """Expands shared formulas (<f t="shared" si=...>) into plain per-cell
+    formulas, since the cells of a shared group no longer sit together
+    once rows move."""
+    def __init__(self):
+        self.masters = {}  # si -> (formula text, origin cell)
+
+    def expand(self, row: bytes) -> bytes:
+        """Row XML with every shared formula written out in full."""
+        if b"shared" not in row:
+            return row
+        return _CELL_RE.sub(self._expand_cell, row)
+
+    def _expand_cell(self, match) -> bytes:
+        cell = match.group(0)
+        formula = _FORMULA_RE.search(cell)
+        if formula is None:
+            return cell
+        attrs = dict(_ATTR_RE.findall(formula.group(2)))
+        if attrs.get(b"t") != b"shared":
+            return cell
+        ref = _CELL_REF_RE.search(match.group(1))
+        if ref is None:
+            raise ValueError("shared formula in a cell without a reference")
+        origin = (ref.group(2) + ref.group(3)).decode("ascii")
+        si = attrs.get(b"si")
+        if formula.group(3):  # master cell
+            text = xml_attr_unescape(formula.group(3))
+            self.masters[si] = (text, origin)
+        elif si in self.masters:
+            text = _translate(*self.masters[si], origin)
+        else:
+            raise ValueError(f"shared formula {si!r} used before its master cell")
+        tag = formula.group(1)
+        plain = b"<" + tag + b">" + _xml_text(text) + b"</" + tag + b">"
+        return cell[:formula.start()] + plain + cell[formula.end():]
+
+
+def _xml_text(text: str) -> bytes:
+    """Escape text for element content."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").encode("utf-8")
+
+
+def _translate(formula: str, origin: str, destination: str) -> str:
+    """Move a formula like a copy (relative references shift), as Excel does when sorting."""
+    from openpyxl.formula.translate import Translator  # deferred: heavy import
+    return Translator("=" + formula, origin=origin).translate_formula(destination)[1:]
+
+
+def _renumber(row: bytes, old: int, new: int) -> bytes:
+    """Row XML moved from row `old` to row `new`: r attributes and formulas."""
+    if old == new:
+        return row
+    new_bytes = str(new).encode("ascii")
+    row = _ROW_NUM_RE.sub(lambda m: m.group(1) + new_bytes + m.group(3), row, count=1)
+
+    def _move_cell(match):
+        cell = match.group(0)
+        ref = _CELL_REF_RE.search(match.group(1))
+        if ref is None:
+            return cell
+        column = ref.group(2).decode("ascii")
+        cell = _CELL_REF_RE.sub(lambda m: m.group(1) + m.group(2) + new_bytes + m.group(4), cell, count=1)
+        formula = _FORMULA_RE.search(cell)
+        if formula is None or not formula.group(3):
+            return cell
+        text = _translate(xml_attr_unescape(formula.group(3)), f"{column}{old}", f"{column}{new}")
+        attrs = formula.group(2)
+        if b"ref=" in attrs:  # single-row array formula (see _check_data_row): its range moves too
+            attrs = re.sub(rb"(\sref=\")([^\"]*)",
+                           lambda m: m.group(1) + _RANGE_ROWS_RE.sub(rb"\g<1>" + new_bytes, m.group(2)),
+                           attrs)
+        tag = formula.group(1)
+        moved = b"<" + tag + attrs + b">" + _xml_text(text) + b"</" + tag + b">"
+        return cell[:formula.start()] + moved + cell[formula.end():]
+
+    return _CELL_RE.sub(_move_cell, row)
+
+
+def _check_data_row(row: bytes) -> None:
+    """Like Excel, refuse to split array formulas spanning several rows, and
+    refuse to move what-if data tables (their input cells are fixed)."""
+    if b"ref=" not in row:
+        return
+    for formula in _FORMULA_RE.finditer(row):
+        attrs = dict(_ATTR_RE.findall(formula.group(2)))
+        ref = attrs.get(b"ref", b"")
+        if attrs.get(b"t") == b"dataTable":
+            raise ValueError(f"data table in the rows to sort ({ref.decode('ascii')})")
+        if len({number for _column, number in _RANGE_ROWS_RE.findall(ref)}) > 1:
+            raise ValueError(f"array formula spans several rows ({ref.decode('ascii')})")
+
+
+def _check_tail(tail: bytes, first: int, last: int, comment_rows: Sequence[int]) -> Set[int]:
+    """Refuse merged cells and hyperlinks spanning several data rows, and notes
+    (comments) on data rows; returns the data rows holding hyperlinks."""
+    for match in _MERGE_RE.finditer(tail):
+        top, bottom = int(match.group(2)), int(match.group(4))
+        if bottom > top and bottom >= first and top <= last:
+            raise ValueError("merged cells span several data rows "
+                             f"({match.group(1).decode()}{top}:{match.group(3).decode()}{bottom})")
+    linked = set()
+    for match in _HYPERLINK_RE.finditer(tail):
+        top = int(match.group(3))
+        bottom = int(match.group(5) or top)
+        if bottom < first or top > last:
+            continue
+        if bottom != top:
+            raise ValueError(f"hyperlink spans several data rows ({match.group(2).decode()}{top}:"
+                             f"{match.group(4).decode()}{bottom})")
+        linked.add(top)
+    noted = sorted(row for row in comment_rows if first <= row <= last)
+    if noted:
+        raise ValueError(f"notes/comments on data rows (row {noted[0]}) would not move with "
+                         "their cells; remove them or sort in Excel")
+    return linked
+
+
+def _remap_hyperlinks(tail: bytes, moved: Dict[int, int]) -> bytes:
+    """Tail XML with single-row hyperlink refs following their rows."""
+    if not moved:
+        return tail
+
+    def _move(match):
+        new = moved.get(int(match.group(3)))
+        if new is None:
+            return match.group(0)
+        number = str(new).encode("ascii")
+        second = b":" + match.group(4) + number if match.group(4) else b""
+        return match.group(1) + match.group(2) + number + second + match.group(6)
+
+    return _HYPERLINK_RE.sub(_move, tail)
+
+
+class _RowSource:
+    """Splits worksheet XML into head, <row> elements and tail, streaming."""
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.buffer = b""
+        self.head = b""
+        self.tail = b""
+
+    def _fill(self, pos: int) -> bool:
+        """Drop the consumed buffer[:pos] and append the next chunk."""
+        chunk = self.stream.read(CHUNK_SIZE)
+        self.buffer = self.buffer[pos:] + chunk
+        return bool(chunk)
+
+    def rows(self) -> Iterator[bytes]:
+        """Yield each <row> element; head and tail are set as they are seen.
+        Scans forward from a moving position, so each byte is searched a
+        bounded number of times and the buffer is trimmed once per chunk."""
+        while True:
+            match = _SHEET_DATA_RE.search(self.buffer)
+            if match:
+                break
+            if not self._fill(0):
+                raise ValueError("worksheet has no <sheetData>")
+        self.head = self.buffer[:match.end()]
+        pos = match.end()
+        if match.group(1):  # <sheetData/>: no rows at all
+            self.tail = self.buffer[pos:] + self.stream.read()
+            return
+        while True:
+            start = _ROW_START_RE.search(self.buffer, pos)
+            limit = start.start() if start else len(self.buffer)
+            end_data = _SHEET_DATA_END_RE.search(self.buffer, pos, limit)
+            if end_data:
+                self.tail = self.buffer[end_data.start():] + self.stream.read()
+                return
+            end = self._row_end(start.end()) if start else None
+            if end is None:
+                # refill; keep an unfinished row, or a possibly split tag at the end
+                keep = start.start() if start else max(pos, len(self.buffer) - 32)
+                if not self._fill(keep):
+                    raise ValueError("worksheet XML ends inside <sheetData>")
+                pos = 0
+                continue
+            yield self.buffer[start.start():end]
+            pos = end
+
+    def _row_end(self, after: int) -> Optional[int]:
+        """End offset of the <row> whose tag name ends at `after` (None if
+        the row is not complete in the buffer yet)."""
+        open_end = self.buffer.find(b">", after)
+        if open_end < 0:
+            return None
+        if self.buffer[open_end - 1:open_end] == b"/":
+            return open_end + 1
+        close = _ROW_END_RE.search(self.buffer, open_end)
+        return close.end() if close else None
+
+
+class _KeyColumns:
+    """Array-backed key columns: per key a rank array, a float array and a
+    list of casefolded texts, plus a stable row index. Rows beyond RUN_ROWS
+    are sorted and spilled as runs, then merged from disk."""
+    def __init__(self, keys: Sequence[SortKey], run_rows: int):
+        self.keys = keys
+        self.run_rows = run_rows
+        self.count = 0
+        self.runs: List[BinaryIO] = []
+        self._reset()
+
+    def _reset(self) -> None:
+        self.ranks = [array("b") for _ in self.keys]
+        self.numbers = [array("d") for _ in self.keys]
+        self.texts: List[List[str]] = [[] for _ in self.keys]
+        self.first = self.count
+
+    def add(self, row_keys: List[Tuple[int, float, str]]) -> None:
+        """Append one row's keys."""
+        for column, (rank, number, text) in enumerate(row_keys):
+            self.ranks[column].append(rank)
+            self.numbers[column].append(number)
+            self.texts[column].append(text)
+        self.count += 1
+        if self.count - self.first >= self.run_rows:
+            self._spill_run()
+
+    def _composite(self, offset: int) -> tuple:
+        """Single comparable key of one buffered row (for runs and merging)."""
+        parts = []
+        for column, key in enumerate(self.keys):
+            rank = self.ranks[column][offset]
+            value = (rank, self.numbers[column][offset], self.texts[column][offset])
+            if key.descending:
+                value = _Descending((-1 if rank == RANK_BLANK else rank,) + value[1:])
+            parts.append(value)
+        return tuple(parts)
+
+    def _spill_run(self) -> None:
+        """Sort the buffered keys and write them as one run file."""
+        run = tempfile.TemporaryFile(prefix="excel_sorter_run_")
+        for offset in self._order():
+            pickle.dump((self._composite(offset), self.first + offset), run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.runs.append(run)
+        self._reset()
+
+    def _order(self) -> Sequence[int]:
+        """Stable order of the buffered rows (offsets into the buffer)."""
+        size = self.count - self.first
+        try:  # optional: vectorised multi-key sort; imported here so app startup never pays for it
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None and size > 1:
+            columns = []
+            for column, key in reversed(list(enumerate(self.keys))):
+                _unique, codes = numpy.unique(numpy.array(self.texts[column], dtype=object),
+                                              return_inverse=True)
+                ranks = numpy.frombuffer(self.ranks[column], dtype=numpy.int8).astype(numpy.int16)
+                numbers = numpy.frombuffer(self.numbers[column], dtype=numpy.float64)
+                if key.descending:
+                    ranks = numpy.where(ranks == RANK_BLANK, 1, -ranks)
+                    numbers = -numbers
+                    codes = -codes
+                columns.extend((codes, numbers, ranks))
+            return numpy.lexsort(columns).tolist()
+        order = list(range(size))
+        for column, key in reversed(list(enumerate(self.keys))):
+            ranks, numbers, texts = self.ranks[column], self.numbers[column], self.texts[column]
+            if key.descending:
+                order.sort(key=lambda i: (-1 if ranks[i] == RANK_BLANK else ranks[i],
+                                          numbers[i], texts[i]), reverse=True)
+            else:
+                order.sort(key=lambda i: (ranks[i], numbers[i], texts[i]))
+        return order
+
+    def sorted_rows(self) -> Iterator[int]:
+        """Row indexes in sorted order."""
+        if not self.runs:
+            yield from (self.first + offset for offset in self._order())
+            return
+        if self.count > self.first:
+            self._spill_run()
+        yield from (index for _key, index in heapq.merge(*(_read_run(run) for run in self.runs)))
+
+    def close(self) -> None:
+        for run in self.runs:
+            run.close()
+
+
+def _read_run(run: BinaryIO) -> Iterator[tuple]:
+    """(key, index) records of one run file."""
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def _row_number(row: bytes, fallback: int) -> int:
+    """The r attribute of a <row> (rows may omit it)."""
+    match = _ROW_NUM_RE.search(row)
+    return int(match.group(2)) if match else fallback
+
+
+def sort_rows_part(_part: str, opener: Callable, strings: List[str], keys: Sequence[SortKey],
+                   header_rows: int = 1, run_rows: int = RUN_ROWS,
+                   comment_rows: Sequence[int] = ()) -> Optional[Iterator[bytes]]:
+    """part_engine transform: sort the rows below `header_rows` by `keys`.
+    Pass 1 streams the worksheet, spills every data row to a temp file
+    (offset index in an array) and keeps only the key columns; the sorted
+    sheet is then written by reading rows back in order. Returns None when
+    the rows are already in order. Raises ValueError where Excel would
+    refuse to sort (merged cells or array formulas spanning data rows, data
+    tables) and for notes on data rows (`comment_rows`, from the sheet's
+    comments part, which this transform does not rewrite)."""
+    wanted = [key.column for key in keys]
+    shared = _SharedFormulas()
+    columns = _KeyColumns(keys, run_rows)
+    spill = tempfile.TemporaryFile(prefix="excel_sorter_rows_")
+    offsets = array("q", [0])
+    numbers = array("l")
+    header = []
+    try:
+        with opener() as stream:
+            source = _RowSource(stream)
+            previous = 0
+            for row in source.rows():
+                number = _row_number(row, previous + 1)
+                previous = number
+                row = shared.expand(row)
+                if number <= header_rows:
+                    header.append(row)
+                    continue
+                _check_data_row(row)
+                spill.write(row)
+                offsets.append(spill.tell())
+                numbers.append(number)
+                columns.add(_row_keys(row, wanted, strings))
+            head, tail = source.head, source.tail
+        first_data = numbers[0] if numbers else header_rows + 1
+        linked = _check_tail(tail, first_data, numbers[-1] if numbers else 0, comment_rows)
+        order = list(columns.sorted_rows()) if len(numbers) <= run_rows else None
+        if order is not None and order == list(range(len(order))):
+            spill.close()
+            columns.close()
+            return None
+    except BaseException:
+        spill.close()
+        columns.close()
+        raise
+    return _write_sorted(head, header, tail, spill, offsets, numbers, first_data,
+                         order if order is not None else columns.sorted_rows(), columns, linked)
+
+
+def _write_sorted(head: bytes, header: List[bytes], tail: bytes, spill: BinaryIO,
+                  offsets: array, numbers: array, first_data: int, order, columns: _KeyColumns,
+                  linked: Set[int]) -> Iterator[bytes]:
+    """Worksheet XML with the data rows in `order`, renumbered from `first_data`;
+    hyperlinks on the `linked` rows move with them."""
+    moved = {}
+    try:
+        yield head
+        yield from header
+        for position, index in enumerate(order):
+            spill.seek(offsets[index])
+            row = spill.read(offsets[index + 1] - offsets[index])
+            if numbers[index] in linked:
+                moved[numbers[index]] = first_data + position
+            yield _renumber(row, numbers[index], first_data + position)
+        yield _remap_hyperlinks(tail, moved)
+    finally:
+        spill.close()
+        columns.close()
+    return len(numbers)
+
+
+def _comment_rows(path: str, sheet: str) -> Tuple[int, ...]:
+    """Rows of `sheet` that carry notes (from its comments part). Raises
+    KeyError for an unknown sheet."""
+    with zipfile.ZipFile(path) as zf:
+        part = next((part for meta, part in read_sheet_parts(zf)[0] if meta.name == sheet), None)
+        if part is None:
+            raise KeyError(f"no worksheet named {sheet!r}")
+        rows = set()
+        for rel_type, target in read_part_rels(zf, part).values():
+            if rel_type == COMMENTS_REL and target in zf.NameToInfo:
+                for match in _COMMENT_REF_RE.finditer(zf.read(target)):
+                    top = int(match.group(2))
+                    rows.update(range(top, int(match.group(3) or top) + 1))
+        return tuple(sorted(rows))
+
+
+def sort_rows_in_file(path: str, sheet: str, keys: Sequence, header_rows: int = 1,
+                      dst_path: str = "", level: int = DEFAULT_LEVEL, run_rows: int = RUN_ROWS) -> int:
+    """Sort the data rows of `sheet` by `keys` (see parse_sort_keys) at zip
+    level: only that worksheet part is rewritten, everything else is copied
+    raw. Returns the number of rows sorted (0 when already in order).
+    Raises KeyError for an unknown sheet and ValueError for unsortable ones."""
+    keys = parse_sort_keys(keys)
+    changed = transform_sheets(path, sort_rows_part,
+                               (keys, header_rows, run_rows, _comment_rows(path, sheet)),
+                               dst_path, sheets=[sheet], level=level)
+    return changed.get(sheet) or 0
@@ -0,0 +1,88 @@
+"""Incremental substring and fuzzy search over sheet names (casefold + trigram index)."""
+from typing import Dict, List, Sequence, Set
+
+MIN_FUZZY_SCORE = 0.4
+
+
+def trigrams(text: str) -> Set[str]:
+    """All 3-character slices of `text`."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SheetIndex:
+    """Casefolded names plus a trigram -> positions index (names padded with
+    a space, so word starts and ends count), built once per sheet list. search() returns matching positions in sheet order; a query
+    that contains the previous one only rescans the previous result."""
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        self.folded = [name.casefold() for name in self.names]
+        self._grams: Dict[str, Set[int]] = {}
+        for pos, name in enumerate(self.folded):
+            for gram in trigrams(f" {name} "):
+                self._grams.setdefault(gram, set()).add(pos)
+        self._gram_counts = [len(trigrams(f" {name} ")) for name in self.folded]
+        self._last_query = ""
+        self._last_result = list(range(len(self.names)))
+        self._fuzzy_grams: Set[str] = set()
+        self._fuzzy_hits: Dict[int, int] = {}
+
+    def _candidates(self, query: str) -> List[int]:
+        """Positions that can contain `query`, before the substring check."""
+        if self._last_query and self._last_query in query:
+            return self._last_result  # refinement: narrow the previous result
+        if len(query) < 3:
+            return list(range(len(self.names)))
+        postings = sorted((self._grams.get(gram, set()) for gram in trigrams(query)), key=len)
+        found = set(postings[0]).intersection(*postings[1:])
+        return sorted(found)
+
+    def search(self, query: str) -> List[int]:
+        """Positions of names containing `query` (case-insensitive)."""
+        query = query.casefold()
+        if not query:
+            result = list(range(len(self.names)))
+        else:
+            folded = self.folded
+            result = [pos for pos in self._candidates(query) if query in folded[pos]]
+        self._last_query = query
+        self._last_result = result
+        return result
+
+    def _shared_grams(self, grams: Set[str]) -> Dict[int, int]:
+        """position -> number of `grams` its name contains. When `grams`
+        extends the previous query's set (typing more characters), only the
+        new trigrams' postings are counted."""
+        if self._fuzzy_grams and self._fuzzy_grams <= grams:
+            hits = dict(self._fuzzy_hits)
+            new_grams = grams - self._fuzzy_grams
+        else:
+            hits = {}
+            new_grams = grams
+        for gram in new_grams:
+            for pos in self._grams.get(gram, ()):
+                hits[pos] = hits.get(pos, 0) + 1
+        self._fuzzy_grams = grams
+        self._fuzzy_hits = hits
+        return hits
+
+    def rank(self, query: str, limit: int = 200,
+             min_score: float = MIN_FUZZY_SCORE) -> List[int]:
+        """Typo-tolerant search: substring matches first (sheet order), then
+        names sharing enough trigrams with `query`, best first. Score is the
+        share of query trigrams found, ties broken by overall (Jaccard) overlap,
+        so "recievables" still finds "Receivables_Q3"."""
+        exact = self.search(query)
+        query = query.casefold()
+        grams = trigrams(f" {query}")  # no end pad: typing on keeps the set growing
+        if len(grams) < 3:
+            return exact
+        exact_set = set(exact)
+        scored = []
+        for pos, shared in self._shared_grams(grams).items():
+            coverage = shared / len(grams)
+            if pos in exact_set or coverage < min_score:
+                continue
+            overlap = shared / (len(grams) + self._gram_counts[pos] - shared)
+            scored.append((-coverage, -overlap, pos))
+        scored.sort()
+        return exact + [pos for _c, _o, pos in scored[:max(0, limit - len(exact))]]
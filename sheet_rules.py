@@ -1,6 +1,8 @@
 """Sheet sorting and renaming helpers."""
 import re
-from typing import Callable, List, Tuple
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, List, Sequence, Tuple
 
 # Mapping of common month representations to calendar index (1–12).
 MONTH_NAME_MAP = {
@@ -93,9 +95,146 @@ def month_order_desc_key(ws) -> Tuple[int, str]:
     reversed_rank = 13 - rank
     return reversed_rank, normalized_title
 
+# Capture types understood by multi_regex_order_key. A pattern spec may be
+# prefixed with "int:", "date:" or "str:"; unprefixed patterns sort as str.
+CAPTURE_TYPES = ("int", "date", "str")
+
+# Date layouts tried (in order) for "date:" captures.
+DATE_CAPTURE_FORMATS = (
+    "%Y-%m-%d", "%Y-%m", "%Y%m%d", "%Y%m", "%d.%m.%Y", "%d-%m-%Y",
+    "%m-%Y", "%b %Y", "%B %Y", "%b-%Y", "%B-%Y", "%b%Y", "%b %y", "%b-%y",
+)
+
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern: str):
+    """Compile a single pattern once per process (shared by every file)."""
+    return re.compile(pattern)
+
+# Patterns that change meaning inside the combined alternation: numbered
+# backreferences (group numbers shift) and global inline flags (which must
+# lead the whole expression, and apply to every pattern).
+_UNCOMBINABLE_RE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?[aiLmsux]+\))")
+
+@lru_cache(maxsize=128)
+def compile_order_patterns(patterns: Tuple[str, ...]):
+    """Combine ordered patterns into one compiled alternation.
+    Each pattern is wrapped in a named group `_p<N>` inside an anchored
+    lookahead, so a single match tells which pattern hit first in priority
+    order (not merely leftmost in the title). Returns (compiled, group_offsets) where
+    group_offsets[N] is the absolute index of pattern N's first own group,
+    or (None, ()) when the patterns cannot share one expression (numbered
+    backreferences, global inline flags such as (?i), clashing group names);
+    callers then search each pattern on its own.
+    Results are cached, so every file (and every BatchWorker thread) in the
+    process reuses the same compiled object."""
+    if any(_UNCOMBINABLE_RE.search(pattern) for pattern in patterns):
+        return None, ()
+    parts = []
+    offsets = []
+    next_group = 1
+    for idx, pattern in enumerate(patterns):
+        own_groups = _compile_pattern(pattern).groups
+        # wrapper group itself takes one slot; the pattern's groups follow
+        offsets.append(next_group + 1)
+        next_group += 1 + own_groups
+        parts.append(f"(?=.*?(?P<_p{idx}>{pattern}))")
+    try:
+        return re.compile("^(?:" + "|".join(parts) + ")", re.DOTALL), tuple(offsets)
+    except re.error:
+        return None, ()
+
+def parse_regex_spec(spec: str) -> Tuple[Tuple[str, str], ...]:
+    """Parse UI text into ((capture_type, pattern), ...).
+    Patterns are separated by ';;' or new lines and may carry a type prefix:
+    'int:Q(\\d)', 'date:(\\d{4}-\\d{2})', 'str:^([A-Z]+)_'."""
+    rules = []
+    for item in re.split(r";;|\n", spec or ""):
+        item = item.strip()
+        if not item:
+            continue
+        ctype = "str"
+        head, sep, rest = item.partition(":")
+        if sep and head.lower() in CAPTURE_TYPES:
+            ctype, item = head.lower(), rest
+        rules.append((ctype, item))
+    return tuple(rules)
+
+def _parse_date(raw: str):
+    """Parse a captured date string using DATE_CAPTURE_FORMATS, or None."""
+    for fmt in DATE_CAPTURE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _typed_capture(raw: str, ctype: str) -> tuple:
+    """Convert a capture to a comparable value.
+    Returns (0, value) on success and (1, raw) when conversion fails, so
+    unparsable captures sort after parsed ones of the same pattern."""
+    if raw is None:
+        return (1, "")
+    if ctype == "int":
+        try:
+            return (0, int(raw))
+        except ValueError:
+            return (1, raw.lower())
+    if ctype == "date":
+        parsed = _parse_date(raw.strip())
+        return (0, parsed) if parsed is not None else (1, raw.lower())
+    return (0, raw.lower())
+
+def multi_regex_order_key(rules: Sequence) -> Callable:
+    """Return a key function ordering sheets by an ordered list of patterns.
+    `rules` is a sequence of patterns or (capture_type, pattern) pairs (see
+    parse_regex_spec). Titles matching an earlier pattern sort first, then by
+    the typed captures of that pattern, then by title. Non-matching titles
+    follow all matches, alphabetically. Every title is scanned once against
+    the combined alternation."""
+    normalized = []
+    for rule in rules:
+        if isinstance(rule, str):
+            normalized.append(("str", rule))
+        else:
+            normalized.append((rule[0], rule[1]))
+    patterns = tuple(pattern for _ctype, pattern in normalized)
+    prog, offsets = compile_order_patterns(patterns)
+    singles = tuple(_compile_pattern(pattern) for pattern in patterns)
+    counts = tuple(single.groups for single in singles)
+    no_match_rank = len(patterns)
+
+    def first_match(title):
+        """(pattern index, match, index of its first own group, whole-match group)."""
+        if prog is None:
+            for idx, single in enumerate(singles):
+                m = single.search(title)
+                if m:
+                    return idx, m, 1, 0
+            return no_match_rank, None, 0, 0
+        m = prog.match(title)
+        if not m:
+            return no_match_rank, None, 0, 0
+        idx = int(m.lastgroup[2:]) if m.lastgroup else 0
+        return idx, m, offsets[idx], f"_p{idx}"
+
+    def key(ws):
+        title = ws.title
+        idx, m, start, whole = first_match(title)
+        if not m:
+            return (no_match_rank, (), title.lower())
+        ctype = normalized[idx][0]
+        if counts[idx]:
+            raws = m.group(*range(start, start + counts[idx]))
+            if counts[idx] == 1:
+                raws = (raws,)
+        else:
+            raws = (m.group(whole),)
+        return (idx, tuple(_typed_capture(raw, ctype) for raw in raws), title.lower())
+    return key
+
 def regex_order_key(pattern: str) -> Callable:
     """Return a key function that matches regex groups for ordering."""
-    prog = re.compile(pattern)
+    prog = _compile_pattern(pattern)
 
     def key(ws):
         m = prog.search(ws.title)
@@ -105,12 +244,107 @@ def regex_order_key(pattern: str) -> Callable:
         return (m.group(1), ws.title.lower())
     return key
 
+_TOKEN_RE = re.compile(r"\{([^{}]+)\}")
+
+def _title_token(title, _index, _match, _when):
+    """{title}: the original sheet name."""
+    return title
+
+def _make_index_token(width: int) -> Callable:
+    """{i} / {index}, optionally zero-padded to `width`."""
+    def token(_title, index, _match, _when):
+        return str(index).zfill(width)
+    return token
+
+def _make_date_token(fmt: str) -> Callable:
+    """{date:FMT} and date shortcuts, formatted with strftime."""
+    def token(_title, _index, _match, when):
+        return when.strftime(fmt)
+    return token
+
+def _make_group_token(group) -> Callable:
+    """{g:N} / {g:name}: a capture of the template pattern."""
+    def token(_title, _index, match, _when):
+        if match is None:
+            return ""
+        try:
+            return match.group(group) or ""
+        except IndexError:
+            return ""
+    return token
+
+_DATE_SHORTCUTS = {"yyyy": "%Y", "yy": "%y", "mm": "%m", "dd": "%d", "mon": "%b", "month": "%B"}
+
+def _compile_token(name: str, has_pattern: bool):
+    """Return a token callable for `name`, or None for an unknown token."""
+    head, _sep, arg = name.partition(":")
+    if name == "title":
+        return _title_token
+    if head in ("i", "index"):
+        if not arg:
+            return _make_index_token(0)
+        if arg.isdigit():
+            return _make_index_token(int(arg))
+        return None
+    if head == "date" and arg:
+        return _make_date_token(arg)
+    if name in _DATE_SHORTCUTS:
+        return _make_date_token(_DATE_SHORTCUTS[name])
+    if has_pattern and head == "g" and arg:
+        return _make_group_token(int(arg) if arg.isdigit() else arg)
+    return None
+
+@lru_cache(maxsize=128)
+def compile_template(template: str, pattern: str = "") -> Callable:
+    """Compile a rename template once into a formatter.
+    Returns fmt(title, index=None, when=None) -> str. Supported tokens:
+    {title}; {i}/{index}, zero-padded with {i:03}; {date:%Y-%m} and the
+    shortcuts {yyyy} {yy} {mm} {dd} {mon} {month} (date of `when`, default
+    now); {g:1} / {g:name} for captures of `pattern` searched in the title.
+    Unknown tokens (and index tokens when index is None) stay literal."""
+    prog = _compile_pattern(pattern) if pattern else None
+    pieces = []
+    pos = 0
+    for m in _TOKEN_RE.finditer(template):
+        if m.start() > pos:
+            pieces.append(template[pos:m.start()])
+        name = m.group(1)
+        token = _compile_token(name, prog is not None)
+        if token is None:
+            pieces.append(m.group(0))
+        elif name.partition(":")[0] in ("i", "index"):
+            pieces.append((token, m.group(0)))
+        else:
+            pieces.append((token, None))
+        pos = m.end()
+    if pos < len(template):
+        pieces.append(template[pos:])
+    pieces = tuple(pieces)
+
+    def fmt(title: str, index: int = None, when: datetime = None) -> str:
+        match = prog.search(title) if prog is not None else None
+        when = when or datetime.now()
+        out = []
+        for piece in pieces:
+            if isinstance(piece, str):
+                out.append(piece)
+            elif index is None and piece[1] is not None:
+                out.append(piece[1])
+            else:
+                out.append(piece[0](title, index, match, when))
+        return "".join(out)
+    return fmt
+
+def plan_template_names(titles: Sequence[str], template: str, pattern: str = "",
+                        when: datetime = None) -> List[str]:
+    """Compute every new name up front (index runs from 1 in sheet order)."""
+    fmt = compile_template(template, pattern)
+    when = when or datetime.now()
+    return [fmt(title, i, when) for i, title in enumerate(titles, start=1)]
+
 def apply_template(title: str, template: str, index: int = None) -> str:
     """
     Apply a simple template for renaming.
-    Supported tokens: {title}, {i}, {index}
+    Supported tokens: {title}, {i}, {index} (see compile_template for more)
     """
-    out = template.replace("{title}", title)
-    if index is not None:
-        out = out.replace("{i}", str(index)).replace("{index}", str(index))
-    return out
+    return compile_template(template)(title, index)
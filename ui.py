@@ -1,24 +1,49 @@
 """Tkinter GUI for Excel Sheet Sorter with enhanced features and correct scoping."""
 import os
+import re
 import subprocess
-import winsound
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
-from excel_operations import ExcelHandler
+from batch_preview import BatchPreview
+from excel_operations import ExcelHandler, warm_up
+from file_discovery import DEFAULT_INCLUDE, FileDiscovery, is_wanted_file, parse_globs
+from local_staging import DEFAULT_WINDOW, StagingArea
 from sheet_rules import (
     alpha_key,
     numeric_suffix_key,
     month_order_key,
     month_order_desc_key,
+    multi_regex_order_key,
+    parse_regex_spec,
 )
+from preflight import run_preflight
+from progress_bus import ProgressBus
+from sheet_filter import SheetIndex
+from reference_order import ReferenceOrder
+from retry_queue import DEFAULT_RETRY, RetryPolicy, RetryQueue
+from workbook_meta import read_sheet_names
+from virtual_list import VirtualList
 from worker import BatchWorker
+from xlsx_zip import COMPRESSION_LEVELS
 try:
     from tkinterdnd2 import DND_FILES, TkinterDnD
 except ImportError:
     DND_FILES = None
     TkinterDnD = None
 
+POLL_MS = 16  # one frame at 60 fps
+FILTER_DEBOUNCE_MS = 120
+# BatchWorker state -> list row status (see virtual_list.STATUS_STYLES)
+ROW_STATUS = {"started": "working", "loaded": "working", "sorted": "sorted",
+              "done": "sorted", "locked": "locked", "error": "error"}
+
+def _ascending(items) -> bool:
+    """True if `items` is strictly increasing."""
+    return all(a < b for a, b in zip(items, items[1:]))
+
 class ExcelSorterApp:
     """Tkinter GUI for sorting Excel sheets alphabetically."""
     def __init__(self, root: tk.Tk):
@@ -37,6 +62,7 @@ class ExcelSorterApp:
         # ✅ Add graceful exit confirmation
         def on_close():
             if messagebox.askokcancel("Exit", "Are you sure you want to exit?"):
+                self._batch_cancel.set()
                 self.root.destroy()
         self.root.protocol("WM_DELETE_WINDOW", on_close)
 
@@ -60,6 +86,18 @@ class ExcelSorterApp:
         self.root.configure(bg="#f0f4f8")  # Soft background
         self.file_path = ""
         self.excel_handler = None
+        self.reference_order = None
+        # All workbook I/O runs here; results come back via _poll_future.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ui-work")
+        self._busy = False
+        self._batch_cancel = threading.Event()  # set on Clear/close: stops waits for locked files
+        self._sheet_index = None    # SheetIndex of the loaded workbook
+        self._shown = []            # sheet positions currently in the listbox
+        self._batch_rows = {}       # batch mode: path -> row in the list view
+        self._discovery = None      # FileDiscovery walking dropped folders
+        self._preview = None        # BatchPreview of the current batch
+        self._preview_job = None
+        self._filter_job = None
         self.batch_var = tk.BooleanVar()  # Batch mode toggle
         self.log_visible = tk.BooleanVar(value=False)
 
@@ -95,7 +133,31 @@ class ExcelSorterApp:
         self.root.bind("<Control-o>", lambda _event: self.browse_file())
         self.root.bind("<Control-s>", lambda _event: self.sort_sheets())
         self.root.bind("<Control-q>", lambda _event: self.root.quit())
+        self.root.bind("<Control-z>", lambda event: self._history_key(event, self.undo_last))
+        self.root.bind("<Control-y>", lambda event: self._history_key(event, self.redo_last))
         self.setup_ui()
+        # Window first: PIL and openpyxl load once the first frame is drawn
+        self.root.after_idle(self._after_first_frame)
+
+    def _after_first_frame(self):
+        """Deferred startup work: title icon, then openpyxl warm-up on the worker."""
+        self._load_app_icon()
+        self._executor.submit(warm_up)
+
+    def _load_app_icon(self):
+        """Load the title icon via PIL (imported lazily; missing PIL or icon is fine)."""
+        icon_path = "appIcon.ico"
+        try:
+            from PIL import Image, ImageTk
+            if not os.path.exists(icon_path):
+                raise FileNotFoundError(icon_path)
+            pil_icon = Image.open(icon_path)
+            pil_icon = pil_icon.resize((28, 28), Image.Resampling.LANCZOS)  # Adjust size for your UI
+            self.app_icon_img = ImageTk.PhotoImage(pil_icon)
+        except (ImportError, OSError, tk.TclError):
+            print("⚠️ Warning: app.ico not found. Default window icon will be used.")
+            return
+        self.title_label.config(image=self.app_icon_img)
 
     def _center_window(self):
         """Center window on screen."""
@@ -108,25 +170,11 @@ class ExcelSorterApp:
     # ---------------------------- UI SETUP ----------------------------
     def setup_ui(self):
         """Sets up all visual UI components."""
-        # ✅ Apply app icon (window)
-        icon_path = "appIcon.ico"
-        try:
-            if os.path.exists(icon_path):
-                pil_icon = Image.open(icon_path)
-                pil_icon = pil_icon.resize((28, 28), Image.Resampling.LANCZOS)  # Adjust size for your UI
-                self.app_icon_img = ImageTk.PhotoImage(pil_icon)
-            else:
-                raise FileNotFoundError
-        except tk.TclError:
-            # Load fallback/default icon. You can use a bundled image or built-in default.
-            pil_icon = Image.new("RGBA", (28, 28), (240,240,240,0))
-            self.app_icon_img = ImageTk.PhotoImage(pil_icon)
-            print("⚠️ Warning: app.ico not found. Default window icon will be used.")
-
-        # App Title
-        title_label = tk.Label(self.root, text="Excel Sheet Sorter",
+        # App Title (the icon is added after the first frame, see _load_app_icon)
+        self.app_icon_img = None
+        self.title_label = title_label = tk.Label(self.root, text="Excel Sheet Sorter",
             font=("Helvetica", 18, "bold"), bg="#f0f4f8",
-            fg="#0056b3", image=self.app_icon_img, compound="left", padx=14)
+            fg="#0056b3", compound="left", padx=14)
         title_label.pack(pady=(10,4))
         ttk.Separator(self.root, orient="horizontal").pack(fill="x", padx=24, pady=(0, 6))
 
@@ -229,7 +277,7 @@ class ExcelSorterApp:
         self.search_var = tk.StringVar()
         self.search_entry = tk.Entry(search_frame, textvariable=self.search_var, width=44)
         self.search_entry.pack(side="left", padx=(2, 0))
-        self.search_entry.bind("<KeyRelease>", self._filter_sheets)
+        self.search_entry.bind("<KeyRelease>", self._schedule_filter)
 
         listbox_container = tk.Frame(frame_sheet, bg="#e1e7ed")
         listbox_container.pack(padx=6, pady=(2, 4), fill="x", expand=False)
@@ -242,16 +290,14 @@ class ExcelSorterApp:
         scrollbar = tk.Scrollbar(
             listbox_container,
             orient="vertical",
-            command=self.sheet_listbox.yview,
             troughcolor="#d6dce2",  # gives contrast so arrows stay visible
             bg="#c5ccd3",
             activebackground="#aab3bb",
         )
         scrollbar.pack(side="right", fill="y")
 
-        # Correctly link listbox and scrollbar before drawing
-        self.sheet_listbox.config(yscrollcommand=scrollbar.set)
-        self.sheet_listbox.update_idletasks()
+        # Only the visible rows live in the Listbox; the scrollbar drives the window
+        self.sheet_list = VirtualList(self.sheet_listbox, scrollbar)
 
         # Sheet Summary
         self.sheet_summary = tk.Label(
@@ -274,6 +320,8 @@ class ExcelSorterApp:
             "numeric_suffix",
             "Jan→Dec",
             "Dec→Jan",
+            "regex",
+            "reference",
         )
         sort_menu.pack(side="left", padx=(6, 10))
 
@@ -288,6 +336,50 @@ class ExcelSorterApp:
         tk.Checkbutton(adv_frame, text="Run in background",
                        variable=self.bg_var, bg="#dfe6ee").pack(side="right")
 
+        # Regex patterns (used by the "regex" sort mode), e.g. int:Q(\d+);;date:(\d{4}-\d{2})
+        regex_frame = tk.Frame(frame_sheet, bg="#dfe6ee")
+        regex_frame.pack(fill="x", padx=10, pady=(0, 6))
+        tk.Label(regex_frame, text="Regex patterns (;; separated):", bg="#dfe6ee").pack(side="left")
+        self.regex_spec_var = tk.StringVar(value="")
+        tk.Entry(regex_frame, textvariable=self.regex_spec_var, width=40).pack(
+            side="left", padx=(6, 10))
+
+        # Part-level deduplicated backups (backup_store) instead of full copies
+        self.dedup_backup_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(regex_frame, text="Dedup backups",
+                       variable=self.dedup_backup_var, bg="#dfe6ee").pack(side="right")
+
+        # Globs applied to dropped folders (and dropped files)
+        glob_frame = tk.Frame(frame_sheet, bg="#dfe6ee")
+        glob_frame.pack(fill="x", padx=10, pady=(0, 6))
+        tk.Label(glob_frame, text="Folder drop include:", bg="#dfe6ee").pack(side="left")
+        self.include_var = tk.StringVar(value="; ".join(DEFAULT_INCLUDE))
+        tk.Entry(glob_frame, textvariable=self.include_var, width=16).pack(side="left", padx=(6, 10))
+        tk.Label(glob_frame, text="exclude:", bg="#dfe6ee").pack(side="left")
+        self.exclude_var = tk.StringVar(value="")
+        tk.Entry(glob_frame, textvariable=self.exclude_var, width=14).pack(side="left", padx=(6, 0))
+        # How long locked files are retried (exponential backoff) before being skipped
+        self.lock_wait_var = tk.StringVar(value=str(int(DEFAULT_RETRY.deadline)))
+        tk.Spinbox(glob_frame, from_=0, to=3600, increment=30, width=5,
+                   textvariable=self.lock_wait_var).pack(side="right")
+        tk.Label(glob_frame, text="Locked wait (s):", bg="#dfe6ee").pack(side="right", padx=(6, 2))
+
+        # Local staging for slow network shares: copy in, sort locally, write back once
+        stage_frame = tk.Frame(frame_sheet, bg="#dfe6ee")
+        stage_frame.pack(fill="x", padx=10, pady=(0, 6))
+        self.stage_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(stage_frame, text="Stage files locally (network shares)",
+                       variable=self.stage_var, bg="#dfe6ee").pack(side="left")
+        self.prefetch_var = tk.StringVar(value=str(DEFAULT_WINDOW))
+        tk.Spinbox(stage_frame, from_=1, to=32, width=4,
+                   textvariable=self.prefetch_var).pack(side="right")
+        tk.Label(stage_frame, text="Prefetch (files):", bg="#dfe6ee").pack(side="right", padx=(6, 2))
+        # zlib level for saved files: fastest for intermediate outputs, best for archives
+        self.compression_var = tk.StringVar(value="default")
+        tk.OptionMenu(stage_frame, self.compression_var, *COMPRESSION_LEVELS).pack(
+            side="right", padx=(0, 10))
+        tk.Label(stage_frame, text="Compression:", bg="#dfe6ee").pack(side="right", padx=(6, 2))
+
         # -------------------- Action Buttons --------------------
         frame_actions = tk.Frame(self.root, bg="#f0f4f8")
         frame_actions.pack(pady=8)
@@ -348,40 +440,105 @@ class ExcelSorterApp:
         self.log_text.config(state="disabled")
         self.log_text.see(tk.END)
 
+    def _schedule_filter(self, _event=None):
+        """Debounce keystrokes: filter once typing pauses."""
+        if self._filter_job is not None:
+            self.root.after_cancel(self._filter_job)
+        self._filter_job = self.root.after(FILTER_DEBOUNCE_MS, self._filter_sheets)
+
     def _filter_sheets(self, _event=None):
         """Filter sheet names by search input."""
-        query = self.search_var.get().lower()
-        self.sheet_listbox.delete(0, tk.END)
-        if self.excel_handler:
-            for name in self.excel_handler.get_sheet_names():
-                if query in name.lower():
-                    self.sheet_listbox.insert(tk.END, name)
-
-    def _batch_callback(self, idx, total, path, state):
-        """
-        Handle events from BatchWorker on UI thread.
-        state values: started, loaded, locked, sorted, done, finished, error:...
-        """
-        if state == "started":
-            self.status_label.config(text=f"🔄 Starting: {os.path.basename(path)} ({idx}/{total})")
-        elif state == "loaded":
-            self.status_label.config(text=f"🔄 Loaded: {os.path.basename(path)}")
-        elif state == "locked":
-            self.status_label.config(text=f"⚠️ Locked: {os.path.basename(path)}")
-        elif state == "sorted":
-            self.status_label.config(text=f"✅ Sorted: {os.path.basename(path)}")
-        elif state.startswith("error"):
-            self.status_label.config(text=f"❌ Error: {os.path.basename(path)}")
-            self._log(f"[ERROR] {state} for {path}")
-        elif state == "finished":
-            self.status_label.config(text="✅ Batch finished.")
-            self.progress["value"] = total
-        # update progress bar if available
-        try:
-            self.progress["value"] = idx
-        except (tk.TclError, KeyError):
-            self.log("[WARN] Failed to update progress bar.")
-            pass
+        self._filter_job = None
+        if self._sheet_index is None:
+            return
+        self._show_positions(self._sheet_index.rank(self.search_var.get()))
+
+    def _show_positions(self, positions):
+        """Update the listbox to show `positions` with the fewest delete/insert
+        calls; rows both lists share are left alone."""
+        names = self._sheet_index.names
+        old = self._shown
+        if not (_ascending(old) and _ascending(positions)):
+            # ranked (fuzzy) order: keep the common head and tail, replace the middle
+            head = 0
+            while head < min(len(old), len(positions)) and old[head] == positions[head]:
+                head += 1
+            tail = 0
+            while (tail < min(len(old), len(positions)) - head
+                   and old[-1 - tail] == positions[-1 - tail]):
+                tail += 1
+            if len(old) - tail > head:
+                self.sheet_list.delete(head, len(old) - tail - 1)
+            if len(positions) - tail > head:
+                self.sheet_list.insert(head, *(names[pos] for pos in positions[head:len(positions) - tail]))
+            self._shown = list(positions)
+            return
+        i = j = row = 0
+        while i < len(old) or j < len(positions):
+            if j >= len(positions) or (i < len(old) and old[i] < positions[j]):
+                start = i
+                while i < len(old) and (j >= len(positions) or old[i] < positions[j]):
+                    i += 1
+                self.sheet_list.delete(row, row + i - start - 1)
+            elif i >= len(old) or positions[j] < old[i]:
+                start = j
+                while j < len(positions) and (i >= len(old) or positions[j] < old[i]):
+                    j += 1
+                self.sheet_list.insert(row, *(names[pos] for pos in positions[start:j]))
+                row += j - start
+            else:
+                i += 1
+                j += 1
+                row += 1
+        self._shown = list(positions)
+
+    def _reset_sheet_index(self, names=None):
+        """Clear the listbox and (re)index `names`; None leaves it for other content."""
+        self.sheet_list.set_items([])
+        self._batch_rows = {}
+        self._shown = []
+        self._sheet_index = SheetIndex(names) if names is not None else None
+
+    def _set_row_status(self, path, state):
+        """Reflect a worker state for `path` on its batch row (if listed)."""
+        row = self._batch_rows.get(path)
+        if row is not None and state in ROW_STATUS:
+            self.sheet_list.set_status(row, ROW_STATUS[state])
+
+    def _drain_progress(self, bus):
+        """Apply everything BatchWorker queued since the last frame:
+        one progress update, the newest status text, one batched log write."""
+        snap = bus.drain()
+        for path, state in snap.states.items():
+            self._set_row_status(path, state)
+        if snap.errors:
+            self._log("\n".join(f"[ERROR] {state} for {path}" for path, state in snap.errors))
+        if snap.latest is not None:
+            event = snap.latest
+            name = os.path.basename(event.path)
+            if snap.finished:
+                done = bus.totals.get("done", 0)
+                self.status_label.config(
+                    text=f"✅ Batch finished: {done}/{event.total} sorted, "
+                         f"{bus.totals.get('locked', 0)} locked, {bus.totals.get('error', 0)} errors.")
+            elif event.state == "started":
+                self.status_label.config(text=f"🔄 Starting: {name} ({event.idx}/{event.total})")
+            elif event.state == "loaded":
+                self.status_label.config(text=f"🔄 Loaded: {name}")
+            elif event.state == "locked":
+                self.status_label.config(text=f"⚠️ Locked: {name}")
+            elif event.state in ("sorted", "done"):
+                self.status_label.config(text=f"✅ Sorted: {name} ({event.idx}/{event.total})")
+            elif event.state.startswith("error"):
+                self.status_label.config(text=f"❌ Error: {name}")
+            try:
+                self.progress["value"] = event.idx
+            except (tk.TclError, KeyError):
+                self._log("[WARN] Failed to update progress bar.")
+        if snap.finished:
+            self._set_busy(False)
+            return
+        self.root.after(POLL_MS, lambda: self._drain_progress(bus))
 
     def add_tooltip(self, widget, text):
         tip = tk.Toplevel(widget)
@@ -401,79 +558,152 @@ class ExcelSorterApp:
         widget.bind("<Leave>", hide)
 
     # ---------------------------- MAIN ACTIONS ----------------------------
-    def _load_paths(self, paths: list):
+    def _load_paths(self, paths: list, batch: bool = False):
         """Shared loader for a list of file paths.
-        Both browse_file() and drag-and-drop handler call this."""
-        if not paths:
+        Both browse_file() and drag-and-drop handler call this.
+        batch=True shows even 0 or 1 paths as a batch (folder drops add more)."""
+        if not paths and not batch:
             return
+        if self._discovery is not None and not batch:
+            self._discovery.stop()
+            self._discovery = None
+        self._stop_preview()
 
         # Ensure proper list type and normalize
         paths = list(paths)
         # ✅ Store selected paths (list)
         self.file_path = paths
         # ✅ Clear any previous listbox data
-        self.sheet_listbox.delete(0, tk.END)
+        self._reset_sheet_index()
         # ✅ Handle single vs multiple file preview
-        if len(paths) == 1:
+        if len(paths) == 1 and not batch:
             selected_path = paths[0]
-            self.excel_handler = ExcelHandler(selected_path)
-
-            loaded = self.excel_handler.load_workbook()
-            if getattr(self.excel_handler, "file_open_locked", False):
-                self.excel_handler = None
-                self.sheet_listbox.delete(0, tk.END)
-                messagebox.showwarning(
-                    "File Open",
-                    "The selected file appears to be open in Excel.\nPlease close it and try again."
-                )
-                return
-
-            if loaded:
-                sheets = self.excel_handler.get_sheet_names()
-                for s in sheets:
-                    self.sheet_listbox.insert(tk.END, s)
-                # Auto-detect month-based sheets and preselect calendar sort mode.
-                try:
-                    from sheet_rules import contains_month_sheets
-                    if contains_month_sheets(sheets):
-                        # Auto-switch sort mode only if user has not manually selected another
-                        current_mode = self.sort_mode_var.get()
-                        if current_mode in ("alpha", "reverse_alpha", "numeric_suffix"):
-                            self.sort_mode_var.set("Jan→Dec")
-                            self._log("[INFO] Month-based sheets detected → auto-selected 'Jan→Dec'.")
-                except (ImportError, AttributeError) as exc:
-                    # Log specific issues without interrupting UI flow
-                    self._log(f"[WARN] Month detection unavailable: {exc}")
-
-                # file size display (existing behavior)
-                try:
-                    size_kb = os.path.getsize(selected_path) / 1024.0
-                except OSError:
-                    size_kb = 0.0
-                self.sheet_summary.config(text=f"Sheets detected: {len(sheets)} | File size: {size_kb:.1f} KB")
-            else:
-                messagebox.showerror("Load Error", "Failed to load workbook. Check console logs.")
+            self.excel_handler = None
+            self.status_label.config(text=f"🔄 Loading: {os.path.basename(selected_path)}…")
+            # names straight from workbook.xml first, so searching works while openpyxl parses
+            self._submit(read_sheet_names, lambda fut: self._on_sheet_names(selected_path, fut),
+                         selected_path)
+            self._submit(self._open_workbook, lambda fut: self._on_workbook_opened(selected_path, fut),
+                         selected_path)
         else:
             # Batch Mode: show file names in the listbox instead of sheets
             self.excel_handler = None
-            for p in paths:
-                self.sheet_listbox.insert(tk.END, os.path.basename(p))
+            self.sheet_list.set_items((os.path.basename(p) for p in paths), status="queued")
+            self._batch_rows = {p: row for row, p in enumerate(paths)}
             self.sheet_summary.config(text=f"{len(paths)} files selected (batch mode)")
             self._log(f"[INFO] Batch mode: {len(paths)} files selected")
+            self._start_preview(paths)
 
         # ✅ Update display
-        self.sheet_listbox.update_idletasks()
-        self.sheet_listbox.yview_moveto(0)
-        self.root.after(200, lambda: self.sheet_listbox.yview_moveto(0))
+        self.sheet_list.yview_moveto(0)
 
         # ✅ Enable/disable search field depending on mode
-        if len(paths) == 1:
+        if len(paths) == 1 and not batch:
             self.search_entry.config(state="normal")
         else:
             self.search_entry.config(state="disabled")
 
             self.status_label.config(text="✅ File(s) loaded successfully.")
 
+    # ---------------------------- BACKGROUND WORK ----------------------------
+    def _submit(self, func, on_done, *args):
+        """Run func(*args) on the work executor; on_done(future) runs on the Tk thread."""
+        future = self._executor.submit(func, *args)
+        self._poll_future(future, on_done)
+        return future
+
+    def _run_detached(self, func, on_done, *args):
+        """Like _submit, but on its own daemon thread: for long waits that must
+        neither block the work executor nor keep the process alive on exit."""
+        future = Future()
+
+        def _run():
+            try:
+                future.set_result(func(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+        threading.Thread(target=_run, daemon=True, name="ui-wait").start()
+        self._poll_future(future, on_done)
+        return future
+
+    def _poll_future(self, future, on_done):
+        """Check `future` once per frame (~60 fps) without blocking the event loop."""
+        if future.done():
+            on_done(future)
+        else:
+            self.root.after(POLL_MS, lambda: self._poll_future(future, on_done))
+
+    def _set_busy(self, busy: bool):
+        """Disable the sort button while background work is running."""
+        self._busy = busy
+        self.btn_sort.config(state="disabled" if busy else "normal")
+
+    @staticmethod
+    def _open_workbook(path):
+        """Executor side of _load_paths: load the workbook without backup."""
+        handler = ExcelHandler(path, backup=False)
+        return handler, handler.load_workbook()
+
+    def _on_sheet_names(self, selected_path, future):
+        """Show and index the metadata-only sheet list of the file being loaded."""
+        if self.file_path != [selected_path] or self.excel_handler is not None:
+            return
+        try:
+            names = future.result()
+        except (OSError, KeyError, SyntaxError, zipfile.BadZipFile) as exc:
+            # not a readable package; the full load reports the real error
+            self._log(f"[WARN] Could not read sheet list of {selected_path}: {exc}")
+            return
+        if names:
+            self._reset_sheet_index(names)
+            self._filter_sheets()
+
+    def _on_workbook_opened(self, selected_path, future):
+        """UI-thread continuation of _load_paths for a single file."""
+        if self.file_path != [selected_path]:
+            return  # selection changed while loading
+        try:
+            handler, loaded = future.result()
+        except Exception as exc:
+            self._log(f"[ERROR] Exception while loading {selected_path}: {exc}")
+            handler, loaded = None, False
+        if handler is not None and getattr(handler, "file_open_locked", False):
+            self._reset_sheet_index()
+            messagebox.showwarning(
+                "File Open",
+                "The selected file appears to be open in Excel.\nPlease close it and try again."
+            )
+            return
+        if not loaded:
+            messagebox.showerror("Load Error", "Failed to load workbook. Check console logs.")
+            return
+
+        self.excel_handler = handler
+        sheets = self.excel_handler.get_sheet_names()
+        if self._sheet_index is None or self._sheet_index.names != sheets:
+            self._reset_sheet_index(sheets)
+            self._filter_sheets()
+        # Auto-detect month-based sheets and preselect calendar sort mode.
+        try:
+            from sheet_rules import contains_month_sheets
+            if contains_month_sheets(sheets):
+                # Auto-switch sort mode only if user has not manually selected another
+                current_mode = self.sort_mode_var.get()
+                if current_mode in ("alpha", "reverse_alpha", "numeric_suffix"):
+                    self.sort_mode_var.set("Jan→Dec")
+                    self._log("[INFO] Month-based sheets detected → auto-selected 'Jan→Dec'.")
+        except (ImportError, AttributeError) as exc:
+            # Log specific issues without interrupting UI flow
+            self._log(f"[WARN] Month detection unavailable: {exc}")
+
+        # file size display (existing behavior)
+        try:
+            size_kb = os.path.getsize(selected_path) / 1024.0
+        except OSError:
+            size_kb = 0.0
+        self.sheet_summary.config(text=f"Sheets detected: {len(sheets)} | File size: {size_kb:.1f} KB")
+        self.status_label.config(text="✅ File(s) loaded successfully.")
+
     def browse_file(self):
         """Handles single or multi-file selection."""
         filetypes = [("Excel Files", "*.xlsx *.xls")]
@@ -491,68 +721,136 @@ class ExcelSorterApp:
         self._load_paths(paths)
 
     def _on_drop(self, event):
-        """Handle dropped files. event.data is a string of file paths;
-        on Windows it may be like '{C:/path/file1.xlsx} {C:/path/file2.xlsx}'
-        We parse carefully and then call _load_paths(paths)."""
+        """Handle dropped files and folders. event.data is a Tcl list of
+        paths (e.g. '{C:/my dir/file1.xlsx} C:/path/file2.xlsx'); files go
+        straight to _load_paths, folders are walked on a background thread
+        and stream into the batch list (see _start_discovery)."""
         data = event.data
         if not data:
             return
-        paths = []
-        cur = ""
-        in_brace = False
-        for ch in data:
-            if ch == '{':
-                in_brace = True
-                cur = ""
-            elif ch == '}':
-                in_brace = False
-                if cur:
-                    paths.append(cur)
-                cur = ""
-            elif ch == ' ' and not in_brace:
-                if cur:
-                    paths.append(cur)
-                    cur = ""
-            else:
-                cur += ch
-        if cur:
-            paths.append(cur)
-
-        # filter non-files and only keep Excel files
-        paths = [p for p in paths if p and os.path.isfile(p) and p.lower().endswith(('.xlsx', '.xls'))]
-
+        dropped = [p for p in self.root.tk.splitlist(data) if p]
+        include = parse_globs(self.include_var.get()) or DEFAULT_INCLUDE
+        exclude = parse_globs(self.exclude_var.get())
+        folders = [p for p in dropped if os.path.isdir(p)]
+        # filter non-files and only keep wanted Excel files (no lock files)
+        paths = [p for p in dropped if os.path.isfile(p) and is_wanted_file(p, include, exclude)]
+
+        if folders:
+            self._start_discovery(paths, folders, include, exclude)
+            return
         if not paths:
             messagebox.showinfo("Drop Files", "No valid Excel files detected in the drop.")
             return
         # call the common loader
         self._load_paths(paths)
 
+    def _start_discovery(self, paths, folders, include, exclude):
+        """Enter batch mode with `paths` and stream in files found under `folders`."""
+        if self._discovery is not None:
+            self._discovery.stop()
+        self._load_paths(paths, batch=True)
+        self._discovery = FileDiscovery(folders, include, exclude)
+        self._discovery.start()
+        self._log(f"[INFO] Scanning {len(folders)} folder(s) for workbooks…")
+        self._drain_discovery(self._discovery)
+
+    def _drain_discovery(self, discovery):
+        """Move newly found files into the batch list once per frame."""
+        if discovery is not self._discovery:
+            return  # superseded by a new drop or selection
+        done = discovery.done.is_set()
+        found = discovery.drain()
+        if found:
+            self._append_batch_paths(found)
+        if done:
+            self._discovery = None
+            self._log(f"[INFO] Folder scan finished: {len(self.file_path)} files in batch")
+            if not self.file_path:
+                messagebox.showinfo("Drop Files", "No valid Excel files detected in the drop.")
+            return
+        self.status_label.config(text=f"🔎 Scanning… {len(self.file_path)} files found")
+        self.root.after(POLL_MS, lambda: self._drain_discovery(discovery))
+
+    def _append_batch_paths(self, paths):
+        """Add files to the current batch (list rows start as 'queued')."""
+        start = len(self.file_path)
+        self.file_path.extend(paths)
+        self.sheet_list.append((os.path.basename(p) for p in paths), status="queued")
+        for row, path in enumerate(paths, start):
+            self._batch_rows.setdefault(path, row)
+        self.sheet_summary.config(text=f"{len(self.file_path)} files selected (batch mode)")
+        if self._preview is not None:
+            self._preview.add(paths)
+            if self._preview_job is None:
+                self._drain_preview(self._preview)
+
+    def _start_preview(self, paths):
+        """Inspect batch files in the background (see batch_preview)."""
+        self._preview = BatchPreview()
+        self._preview_totals = {"files": 0, "sheets": 0, "hidden": 0, "locked": 0, "errors": 0}
+        self._preview.add(paths)
+        self._drain_preview(self._preview)
+
+    def _stop_preview(self):
+        """Cancel the pending preview of the previous batch."""
+        if self._preview is not None:
+            self._preview.cancel()
+            self._preview = None
+        if self._preview_job is not None:
+            self.root.after_cancel(self._preview_job)
+            self._preview_job = None
+
+    def _drain_preview(self, preview):
+        """Show finished previews once per frame: row text, lock/error status
+        and running totals in the summary line."""
+        self._preview_job = None
+        if preview is not self._preview:
+            return
+        totals = self._preview_totals
+        for info in preview.drain():
+            row = self._batch_rows.get(info.path)
+            if row is None:
+                continue
+            self.sheet_list.set_item(row, info.describe())
+            totals["files"] += 1
+            if info.error:
+                totals["errors"] += 1
+                self.sheet_list.set_status(row, "error")
+                continue
+            totals["sheets"] += info.sheet_count
+            totals["hidden"] += info.hidden_count
+            if info.lock == "locked":
+                totals["locked"] += 1
+                self.sheet_list.set_status(row, "locked")
+        if totals["files"]:
+            self.sheet_summary.config(
+                text=f"{len(self.file_path)} files (batch mode) · {totals['sheets']} sheets, "
+                     f"{totals['hidden']} hidden · {totals['locked']} locked · "
+                     f"{totals['errors']} unreadable ({totals['files']} inspected)")
+        if preview.pending > 0:
+            self._preview_job = self.root.after(POLL_MS, lambda: self._drain_preview(preview))
+
     def sort_sheets(self):
-        """Sorts sheets alphabetically and saves workbook(s)."""
+        """Sorts sheets alphabetically and saves workbook(s).
+        Only dialogs and widget updates run here; loading, sorting, pre-flight
+        and saving run on the background executor (see _submit)."""
         if not self.file_path:
             self.status_label.config(text="⚠️ No file selected.")
             messagebox.showinfo("No File Selected", "Please select one or more Excel files first.")
             return
+        if self._busy:
+            self.status_label.config(text="⏳ Still working on the previous request…")
+            return
+        if self._discovery is not None:
+            self.status_label.config(text="🔎 Still scanning dropped folders…")
+            return
 
         paths = list(self.file_path)
-        # Determinate progress setup (safe to use paths now)
-        self.progress["mode"] = "determinate"
-        self.progress["maximum"] = len(paths)
-        self.progress["value"] = 0
-        self.progress.update()
-
         if not paths:
-            self.root.update()
             messagebox.showwarning("Warning", "No Excel files to process.")
             self.status_label.config(text="⚠️ No files.")
             return
 
-        self.status_label.config(text=f"🔄 Process starting batch ({len(paths)} files)…")
-        self.root.update()
-        self.progress["value"] = 0
-        self.progress.update()
-        self.root.after(1700)    # small delay for UI draw
-
         # Determine key function from UI selection
         mode = getattr(self, "sort_mode_var", None)
         key_func = None
@@ -572,171 +870,421 @@ class ExcelSorterApp:
                 key_func = month_order_key
             elif mode == "Dec→Jan":
                 key_func = month_order_desc_key
+            elif mode == "regex":
+                rules = parse_regex_spec(self.regex_spec_var.get())
+                if not rules:
+                    messagebox.showwarning("Regex Sort", "Enter at least one regex pattern.")
+                    return
+                try:
+                    key_func = multi_regex_order_key(rules)
+                except re.error as exc:
+                    messagebox.showerror("Regex Sort", f"Invalid regex pattern:\n{exc}")
+                    return
+            elif mode == "reference":
+                ref_path = filedialog.askopenfilename(
+                    title="Select Reference Workbook", filetypes=[("Excel Files", "*.xlsx")])
+                if not ref_path:
+                    return
+                try:
+                    self.reference_order = ReferenceOrder.from_workbook(ref_path)
+                except Exception as exc:
+                    messagebox.showerror("Reference Sort", f"Cannot read reference workbook:\n{exc}")
+                    return
+                self._log(f"[INFO] Reference order loaded from: {ref_path}")
+                key_func = self.reference_order.key()
 
+        # Determinate progress setup (safe to use paths now)
+        self.progress["mode"] = "determinate"
+        self.progress["maximum"] = len(paths)
+        self.progress["value"] = 0
+        self.status_label.config(text=f"🔄 Process starting batch ({len(paths)} files)…")
+
+        rules = parse_regex_spec(self.regex_spec_var.get())
+        ctx = {
+            "key_func": key_func,
+            "template": self.rename_template_var.get(),
+            "pattern": rules[0][1] if rules else "",
+            "preview": self.preview_var.get(),
+            "backup_mode": "store" if self.dedup_backup_var.get() else "copy",
+            "compression": COMPRESSION_LEVELS[self.compression_var.get()],
+            "retry": RetryQueue(RetryPolicy(deadline=self._lock_wait_seconds())),
+            "reference": self.reference_order if mode == "reference" else None,
+        }
+        self._batch_cancel = ctx["cancel"] = threading.Event()
+        self._set_busy(True)
+
+        # Pre-flight: validate the whole batch before anything is written
+        if len(paths) > 1:
+            self._submit(run_preflight, lambda fut: self._after_preflight(paths, ctx, fut),
+                         paths, ctx["template"], ctx["pattern"])
+        else:
+            self._start_processing(paths, ctx)
+
+    def _lock_wait_seconds(self) -> float:
+        """Retry deadline for locked files from the spinbox (default if invalid)."""
+        try:
+            return max(0.0, float(self.lock_wait_var.get()))
+        except ValueError:
+            return DEFAULT_RETRY.deadline
+
+    def _staging_for(self, paths):
+        """StagingArea for `paths` when local staging is enabled, else None."""
+        if not self.stage_var.get():
+            return None
+        try:
+            window = max(1, int(self.prefetch_var.get()))
+        except ValueError:
+            window = DEFAULT_WINDOW
+        try:
+            return StagingArea(paths, window)
+        except OSError as exc:
+            self._log(f"[WARNING] Local staging unavailable, working in place: {exc}")
+            return None
+
+    def _after_preflight(self, paths, ctx, future):
+        """UI-thread continuation once the pre-flight report is ready."""
+        try:
+            report = future.result()
+        except Exception as exc:
+            self._log(f"[ERROR] Pre-flight failed: {exc}")
+            self._set_busy(False)
+            return
+        self._log("[INFO] " + report.format())
+        self.status_label.config(text=report.summary())
+        if report.failed:
+            if not report.ok_paths:
+                messagebox.showerror("Pre-flight", "No file passed pre-flight checks. See log.")
+                self._set_busy(False)
+                return
+            if not messagebox.askyesno(
+                "Pre-flight",
+                f"{len(report.failed)} file(s) failed pre-flight checks (see log).\n"
+                f"Continue with the remaining {len(report.ok_paths)}?"
+            ):
+                self._set_busy(False)
+                return
+            paths = report.ok_paths
+            self.progress["maximum"] = len(paths)
+        self._start_processing(paths, ctx)
+
+    def _start_processing(self, paths, ctx):
+        """Hand the batch to BatchWorker or to the per-file foreground chain."""
         # If background requested, use worker
         if getattr(self, "bg_var", None) and self.bg_var.get():
-            def cb(idx, total, path, state):
-                # executed in worker thread; schedule UI updates on main thread
-                self.root.after(0, lambda: self._batch_callback(idx, total, path, state))
-
-            worker = BatchWorker(paths, ExcelHandler, cb)
+            # worker threads only queue events; the UI drains them once per frame.
+            # The worker never saves, so local staging would only copy files in
+            # and throw them away: it reads the originals.
+            bus = ProgressBus()
+            worker = BatchWorker(paths, ExcelHandler, bus.post, key_func=ctx["key_func"],
+                                 retry_policy=ctx["retry"].policy)
             worker.start()
             self._log("[INFO] Batch worker started.")
+            self._drain_progress(bus)
+            return
+        ctx["paths"] = paths
+        if (ctx["reference"] is not None and len(paths) > 1 and not ctx["preview"]
+                and ctx["template"] in ("", "{title}")):
+            ctx["staging"] = None
+            self._reference_file(ctx, 0)
+            return
+        ctx["staging"] = self._staging_for(paths)
+        self._process_file(ctx, 0)
+
+    def _reference_file(self, ctx, pos):
+        """Reference-order batch: each file is reordered at zip level (only
+        workbook.xml is rewritten, layouts are planned once per sheet set),
+        without an openpyxl load/save or save dialogs. Locked files are
+        parked and go through the normal per-file chain once released."""
+        paths = ctx["paths"]
+        if pos >= len(paths):
+            self._process_file(ctx, pos)  # parked files, then the end of the batch
+            return
+        path = paths[pos]
+        self.progress["value"] = pos
+        self._set_row_status(path, "started")
+        self.status_label.config(text=f"🔄 Sorting: {os.path.basename(path)} ({pos + 1}/{len(paths)})")
+        self._submit(ctx["reference"].apply_to_file,
+                     lambda fut: self._after_reference_file(ctx, pos, fut), path, "", ctx["backup_mode"])
+
+    def _after_reference_file(self, ctx, pos, future):
+        """UI-thread result of one zip-level reference reorder."""
+        path = ctx["paths"][pos]
+        try:
+            status = future.result()
+        except Exception as exc:
+            self._log(f"[ERROR] Exception while processing {path}: {exc}")
+            status = "error"
+        if status == "locked":
+            self._log(f"[WARN] File is open/locked, will retry: {path}")
+            self._set_row_status(path, "locked")
+            ctx["retry"].park(path)
+        elif status == "error":
+            self._log(f"[ERROR] Failed to sort: {path}")
+            self._set_row_status(path, "error")
+        else:
+            self._log(f"[INFO] Sorted successfully: {path}" if status == "sorted"
+                      else f"[INFO] Already in reference order: {path}")
+            self._set_row_status(path, "sorted")
+        self._reference_file(ctx, pos + 1)
+
+    @staticmethod
+    def _prepare_file(path, ctx):
+        """Executor side: load, sort and rename one workbook (no Tk calls)."""
+        staged = ctx["staging"].acquire(path) if ctx["staging"] is not None else None
+        handler = ExcelHandler(path, backup=not ctx["preview"], backup_mode=ctx["backup_mode"],
+                               staged=staged, compression_level=ctx["compression"])
+        loaded = handler.load_workbook()
+        result = {"handler": handler, "loaded": loaded, "success": False, "notes": []}
+        if not loaded:
+            return result
+        key_func = ctx["key_func"]
+        if key_func is not None:
+            ok = handler.apply_custom_sort(key_func)
+            result["notes"].append(f"[INFO] custom sort applied: {path}" if ok
+                                   else f"[WARN] custom sort failed for {path}")
+
+        # rename if template not default
+        template = ctx["template"]
+        if template and template != "{title}":
+            renamed = handler.rename_sheets_with_template(template, ctx["pattern"])
+            result["notes"].append(f"[INFO] sheets renamed using template for: {path}" if renamed
+                                   else f"[WARN] rename failed for: {path}")
+
+        if key_func is not None:
+            # Use the user-selected custom key (numeric/reverse/alpha)
+            result["success"] = handler.apply_custom_sort(key_func)
+        else:
+            # Default alphabetical sort
+            result["success"] = handler.sort_sheets_alphabetically()
+        return result
+
+    def _process_file(self, ctx, pos):
+        """Start file `pos` of the foreground chain (or finish the batch)."""
+        paths = ctx["paths"]
+        retry = ctx["retry"]
+        if pos > 0 and ctx["staging"] is not None:
+            # previous file is finished (saved, skipped or parked): drop its local copy
+            ctx["staging"].release(paths[pos - 1])
+        # locked files whose backoff elapsed and that are free now go next
+        released = retry.pop_released() if len(retry) else []
+        if released:
+            paths[pos:pos] = released
+            self.progress["maximum"] = len(paths)
+        if pos >= len(paths):
+            if len(retry):
+                self.status_label.config(text=f"🔒 Waiting for {len(retry)} locked file(s)…")
+                self._run_detached(retry.wait_released, lambda fut: self._on_released(ctx, pos, fut),
+                                   ctx["cancel"].is_set)
+                return
+            self._finish_processing(ctx)
+            return
+        path = paths[pos]
+        self.progress["value"] = pos
+        self._set_row_status(path, "started")
+        self.status_label.config(text=f"🔄 Sorting: {os.path.basename(path)} ({pos + 1}/{len(paths)})")
+        self._submit(self._prepare_file, lambda fut: self._on_file_prepared(ctx, pos, fut), path, ctx)
+
+    def _on_released(self, ctx, pos, future):
+        """Locked files came free (or all expired): continue the chain."""
+        if ctx["cancel"].is_set():
+            self._log(f"[INFO] Batch cancelled; {len(ctx['retry'])} locked file(s) not retried.")
+            if ctx["staging"] is not None:
+                ctx["staging"].close()
+            self._set_busy(False)
+            return
+        try:
+            released = future.result()
+        except Exception as exc:
+            self._log(f"[ERROR] Waiting for locked files failed, {len(ctx['retry'])} skipped: {exc}")
+            self._finish_processing(ctx)
+            return
+        ctx["paths"].extend(released)
+        self.progress["maximum"] = len(ctx["paths"])
+        self._process_file(ctx, pos)
+
+    def _on_file_prepared(self, ctx, pos, future):
+        """UI-thread handling of one prepared workbook: warnings, preview, save dialogs."""
+        path = ctx["paths"][pos]
+        name = os.path.basename(path)
+        try:
+            result = future.result()
+        except Exception as exc:  # e.g. a staging or openpyxl error; the batch goes on
+            self._log(f"[ERROR] Exception while processing {path}: {exc}")
+            self._set_row_status(path, "error")
+            messagebox.showerror("Error", f"Unexpected error opening {name}.\nSee log.")
+            self._process_file(ctx, pos + 1)
             return
 
+        self.excel_handler = result["handler"]
+        for note in result["notes"]:
+            self._log(note)
+
+        # File locked detection
+        if getattr(self.excel_handler, "file_open_locked", False):
+            # Park it and keep going; it is retried once released (see retry_queue)
+            self._log(f"[WARN] File is open/locked, will retry: {path}")
+            self.status_label.config(text=f"🔒 Locked, retrying later: {name}")
+            self._set_row_status(path, "locked")
+            ctx["retry"].park(path)
+            self._process_file(ctx, pos + 1)
+            return
+
+        if not result["loaded"]:
+            self._log(f"[ERROR] Cannot load: {path}")
+            self._set_row_status(path, "error")
+            messagebox.showwarning("Warning", f"Cannot load {name}")
+            self._process_file(ctx, pos + 1)
+            return
+
+        if not result["success"]:
+            self._log(f"[ERROR] Failed to sort: {path}")
+            self._set_row_status(path, "error")
+            messagebox.showerror("Error", f"Failed to sort or save: {name}")
+            self._process_file(ctx, pos + 1)
+            return
+
+        if len(ctx["paths"]) == 1:
+            self._refresh_sheet_list()
+        else:
+            self._set_row_status(path, "sorted")
+        # Preview-only (dry run): show order but still update progress
+        if ctx["preview"]:
+            sheets = self.excel_handler.get_sheet_names()
+            preview_text = "\n".join(sheets)
+            messagebox.showinfo("Preview Mode", f"The sheets will be sorted as follows:\n\n{preview_text}")
+            self._log(f"[PREVIEW] Sorted order for {name}: {sheets}")
+            self._process_file(ctx, pos + 1)
+            return
+
+        # Save flow: dialogs here, the write itself on the executor
+        handler = self.excel_handler
+        if messagebox.askyesno(
+            "Save As", f"Do you want to save '{name}' as a new file instead of overwriting?"
+        ):
+            new_path = filedialog.asksaveasfilename(
+                title="Save Sorted Workbook As",
+                defaultextension=".xlsx",
+                filetypes=[("Excel Files", "*.xlsx")]
+            )
+            if not new_path:
+                self._log(f"[INFO] Save-as cancelled for: {path}")
+                self._after_save(ctx, pos, None)
+                return
+            self._submit(handler.save_as, lambda fut: self._after_save(
+                ctx, pos, fut, f"[INFO] Saved as: {new_path}",
+                f"[ERROR] Save-as failed for: {new_path}"), new_path)
+        else:
+            self._submit(handler.save_workbook, lambda fut: self._after_save(
+                ctx, pos, fut, f"[INFO] Overwritten: {path}",
+                f"[ERROR] Overwrite failed: {path}"))
+
+    def _after_save(self, ctx, pos, future, ok_msg="", fail_msg=""):
+        """UI-thread continuation after a save finished (or was skipped)."""
+        path = ctx["paths"][pos]
+        if future is not None:
+            try:
+                self._log(ok_msg if future.result() else fail_msg)
+            except Exception as exc:
+                self._log(f"[ERROR] Exception while saving {path}: {exc}")
+                messagebox.showerror("Error", f"Error saving {os.path.basename(path)}. See log.")
+
+        # Play success sound (best-effort)
         try:
-            for idx, path in enumerate(paths, start=1):
-                # Set per-file progress and status
-                self.progress["value"] = idx - 1
-                self.progress.update()
-                self.status_label.config(text=f"🔄 Sorting: {os.path.basename(path)} ({idx}/{len(paths)})")
-                self.root.update_idletasks()
+            import winsound  # Windows only
+            winsound.MessageBeep(winsound.MB_ICONASTERISK)
+        except Exception:
+            pass
 
-                try:
-                    self.excel_handler = ExcelHandler(path)
-                    loaded = self.excel_handler.load_workbook()
-                except (OSError, AttributeError, RuntimeError) as exc:
-                    self._log(f"[ERROR] Exception while initializing ExcelHandler for {path}: {exc}")
-                    messagebox.showerror("Error", f"Unexpected error opening {os.path.basename(path)}.\nSee log.")
-                    # update progress and continue
-                    self.progress["value"] = idx
-                    self.progress.update()
-                    continue
-
-                # If loaded and a key_func was chosen, use it
-                if loaded and key_func is not None:
-                    ok = self.excel_handler.apply_custom_sort(key_func)
-                    if not ok:
-                        self._log(f"[WARN] custom sort failed for {path}")
-                    else:
-                        self._log(f"[INFO] custom sort applied: {path}")
-
-                # rename if template not default
-                tpl = getattr(self, "rename_template_var", None)
-                if tpl and tpl.get() and tpl.get() != "{title}":
-                    renamed = self.excel_handler.rename_sheets_with_template(tpl.get())
-                    if renamed:
-                        self._log(f"[INFO] sheets renamed using template for: {path}")
-                    else:
-                        self._log(f"[WARN] rename failed for: {path}")
-
-                # File locked detection
-                if getattr(self.excel_handler, "file_open_locked", False):
-                    self._log(f"[WARN] File is open/locked: {path}")
-                    self.status_label.config(text="⚠️ File Locked.")
-                    self.progress["value"] = idx
-                    self.root.update()
-                    messagebox.showwarning(
-                        "File Open",
-                        f"The file '{os.path.basename(path)}' is open in Excel. Close it and retry.")
-                    continue    # Skip this file cleanly
-
-                if not loaded:
-                    self._log(f"[ERROR] Cannot load: {path}")
-                    self.root.update()
-                    messagebox.showwarning("Warning", f"Cannot load {os.path.basename(path)}")
-                    self.progress["value"] = idx
-                    self.root.update_idletasks()
-                    continue
-
-                # Try sorting using chosen method; catch exceptions so batch continues
-                try:
-                    if key_func is not None:
-                        # Use the user-selected custom key (numeric/reverse/alpha)
-                        success = self.excel_handler.apply_custom_sort(key_func)
-                    else:
-                        # Default alphabetical sort
-                        success = self.excel_handler.sort_sheets_alphabetically()
-                except (OSError, AttributeError, RuntimeError) as exc:
-                    self._log(f"[ERROR] Exception during sorting for {path}: {exc}")
-                    messagebox.showerror("Error", f"Error sorting {os.path.basename(path)}. See log.")
-                    self.progress["value"] = idx
-                    self.root.update_idletasks()
-                    continue
-
-                # Preview-only (dry run): show order but still update progress
-                if self.preview_var.get():
-                    sheets = self.excel_handler.get_sheet_names()
-                    preview_text = "\n".join(sheets)
-                    messagebox.showinfo(
-                        "Preview Mode",
-                        f"The sheets will be sorted as follows:\n\n{preview_text}"
-                    )
-                    self._log(f"[PREVIEW] Sorted order for {os.path.basename(path)}: {sheets}")
-                    # mark this file as processed in progress and continue
-                    self.progress["value"] = idx
-                    self.root.update_idletasks()
-                    continue
-                # If sorting succeeded, handle save flow
-                if success:
-                    try:
-                        if messagebox.askyesno(
-                            "Save As",
-                            f"Do you want to save '{os.path.basename(path)}' as a new file instead of overwriting?"
-                        ):
-                            new_path = filedialog.asksaveasfilename(
-                                title="Save Sorted Workbook As",
-                                defaultextension=".xlsx",
-                                filetypes=[("Excel Files", "*.xlsx")]
-                            )
-                            if new_path:
-                                saved = self.excel_handler.save_as(new_path)
-                                if saved:
-                                    self._log(f"[INFO] Saved as: {new_path}")
-                                else:
-                                    self._log(f"[ERROR] Save-as failed for: {new_path}")
-                            else:
-                                self._log(f"[INFO] Save-as cancelled for: {path}")
-                        else:
-                            saved = self.excel_handler.save_workbook()
-                            if saved:
-                                self._log(f"[INFO] Overwritten: {path}")
-                            else:
-                                self._log(f"[ERROR] Overwrite failed: {path}")
-                    except (PermissionError, OSError) as exc:
-                        self._log(f"[ERROR] Exception while saving {path}: {exc}")
-                        messagebox.showerror("Error", f"Error saving {os.path.basename(path)}. See log.")
-
-                    # Play success sound (best-effort)
-                    try:
-                        winsound.MessageBeep(winsound.MB_ICONASTERISK)
-                    except Exception:
-                        pass
-
-                    # Offer to open in Excel (non-blocking)
-                    if messagebox.askyesno("Open File", f"Do you want to open '{os.path.basename(path)}' in Excel?"):
-                        try:
-                            subprocess.Popen(["start", "", path], shell=True)
-                        except (OSError, subprocess.SubprocessError) as exc:
-                            self._log(f"[WARN] Could not open file in Excel: {exc}")
-
-                    self._log(f"[INFO] Sorted successfully: {path}")
-                else:
-                    self._log(f"[ERROR] Failed to sort: {path}")
-                    messagebox.showerror("Error", f"Failed to sort or save: {os.path.basename(path)}")
-
-                # Update progress for this file
-                self.progress["value"] = idx
-                self.root.update_idletasks()
-
-            # All done
-            self.progress["value"] = len(paths)
-            self.progress.update()
-            self.status_label.config(text="✅ All files processed successfully.")
-            self.root.update()
-
-        except (OSError, RuntimeError, tk.TclError) as e:
-            self._log(f"[FATAL] Unexpected runtime error: {e}")
-            messagebox.showerror("Fatal Error", f"Unexpected runtime error.\n{e}")
-        finally:
-            self.root.after(1200, lambda: self.status_label.config(text="✅ Ready."))
-            self.root.update_idletasks()
+        # Offer to open in Excel (non-blocking)
+        if messagebox.askyesno("Open File", f"Do you want to open '{os.path.basename(path)}' in Excel?"):
+            try:
+                subprocess.Popen(["start", "", path], shell=True)
+            except (OSError, subprocess.SubprocessError) as exc:
+                self._log(f"[WARN] Could not open file in Excel: {exc}")
+
+        self._log(f"[INFO] Sorted successfully: {path}")
+        self._process_file(ctx, pos + 1)
+
+    def _finish_processing(self, ctx):
+        """All files of the foreground chain are done."""
+        self.progress["value"] = len(ctx["paths"])
+        expired = ctx["retry"].expired
+        if ctx["staging"] is not None:
+            ctx["staging"].close()
+            if self.excel_handler is not None:
+                self.excel_handler.staged = None  # later saves go straight to the file
+        self._set_busy(False)
+        if expired:
+            for path in expired:
+                self._set_row_status(path, "error")
+                self._log(f"[ERROR] Still locked at deadline, skipped: {path}")
+            names = "\n".join(os.path.basename(p) for p in expired[:10])
+            more = f"\n… and {len(expired) - 10} more" if len(expired) > 10 else ""
+            self.status_label.config(text=f"⚠️ Done; {len(expired)} file(s) stayed locked.")
+            messagebox.showwarning(
+                "Files Open", f"These files stayed open in Excel and were skipped:\n\n{names}{more}")
+            return
+        self.status_label.config(text="✅ All files processed successfully.")
+        self.root.after(1200, lambda: self.status_label.config(text="✅ Ready."))
+
+    def _refresh_sheet_list(self):
+        """Re-list the current handler's sheets (respecting the search box).
+        Sheet order or names may have changed, so the index is rebuilt."""
+        self._reset_sheet_index(self.excel_handler.get_sheet_names() if self.excel_handler else None)
+        self._filter_sheets()
+
+    @staticmethod
+    def _history_key(event, action):
+        """Ctrl+Z/Ctrl+Y: leave text editing to the focused input field; the
+        workbook history (which may rewrite the saved file) only runs elsewhere."""
+        if isinstance(event.widget, (tk.Entry, tk.Spinbox, tk.Text)):
+            return None
+        action()
+        return "break"
+
+    def undo_last(self):
+        """Undo the last sort/rename on the current workbook (Ctrl+Z)."""
+        self._run_history("undo", "↩️ Undone.", "Nothing to undo.")
+
+    def redo_last(self):
+        """Redo the last undone change on the current workbook (Ctrl+Y)."""
+        self._run_history("redo", "↪️ Redone.", "Nothing to redo.")
+
+    def _run_history(self, action, done_text, empty_text):
+        """Run handler.undo/redo (may rewrite the saved file) off the Tk thread."""
+        handler = self.excel_handler
+        if not handler or self._busy:
+            self.status_label.config(text=empty_text)
+            return
+
+        def _done(future):
+            self._set_busy(False)
+            try:
+                applied = future.result()
+            except Exception as exc:
+                self._log(f"[ERROR] {action.capitalize()} failed: {exc}")
+                self.status_label.config(text=f"⚠️ {action.capitalize()} failed. See log.")
+                return
+            if not applied:
+                self.status_label.config(text=empty_text)
+                return
+            self._refresh_sheet_list()
+            self.status_label.config(text=done_text)
+            self._log(f"[INFO] {action.capitalize()} applied: {handler.file_path}")
+
+        self._set_busy(True)
+        self._submit(getattr(handler, action), _done)
 
     def clear_selection(self):
         """Clears current selection, resets file path and preview list."""
+        if self._discovery is not None:
+            self._discovery.stop()
+            self._discovery = None
+        self._stop_preview()
+        self._batch_cancel.set()
         self.file_path = ""
         self.excel_handler = None
-        self.sheet_listbox.delete(0, tk.END)
+        self._reset_sheet_index()
         self.sheet_summary.config(text="")
         self.batch_var.set(0)
         self.preview_var.set(0)
@@ -1,8 +1,10 @@
 """Sheet name validation helpers."""
 import re
-from typing import List
+from typing import Dict, List, Sequence
 
 INVALID_CHARS_RE = re.compile(r'[:\\/?*\[\]]')  # Excel forbids these
+MAX_SHEET_NAME = 31
+RESERVED_NAMES = {"history"}  # Excel reserves "History" (any case)
 
 def has_invalid_chars(name: str) -> bool:
     """Return True if name contains Excel-invalid characters."""
@@ -22,3 +24,68 @@ def find_duplicates(names: List[str]) -> List[str]:
         if c > 1:
             dup.append(n)
     return dup
+
+def validate_names(names: Sequence[str], limit: int = MAX_SHEET_NAME) -> Dict[int, List[str]]:
+    """Validate a full list of new sheet names in one pass.
+    Returns {position: [problem, ...]} for every offending name; problems are
+    "empty", "invalid_chars", "too_long", "reserved", "apostrophe" and
+    "duplicate" (case-insensitive, reported on the later occurrences)."""
+    problems: Dict[int, List[str]] = {}
+    seen = set()
+    for pos, name in enumerate(names):
+        found = []
+        if not name:
+            found.append("empty")
+        if has_invalid_chars(name):
+            found.append("invalid_chars")
+        if is_too_long(name, limit):
+            found.append("too_long")
+        if name.casefold() in RESERVED_NAMES:
+            found.append("reserved")
+        if name.startswith("'") or name.endswith("'"):
+            found.append("apostrophe")
+        folded = name.casefold()
+        if folded in seen:
+            found.append("duplicate")
+        seen.add(folded)
+        if found:
+            problems[pos] = found
+    return problems
+
+def sanitize_name(name: str, limit: int = MAX_SHEET_NAME, fallback: str = "Sheet") -> str:
+    """Make a single name legal: replace invalid characters, strip edge
+    apostrophes, avoid reserved words and cut to `limit` characters."""
+    cleaned = INVALID_CHARS_RE.sub("_", name).strip("'")[:limit].strip("'")
+    if not cleaned:
+        cleaned = fallback
+    if cleaned.casefold() in RESERVED_NAMES:
+        cleaned = (cleaned + "_")[:limit]
+    return cleaned
+
+def resolve_collisions(names: Sequence[str], limit: int = MAX_SHEET_NAME) -> List[str]:
+    """Return legal, case-insensitively unique names for `names`.
+    Every name is sanitized; later duplicates get a " (2)", " (3)", ...
+    suffix, truncating the base so the result still fits in `limit`."""
+    cleaned = [sanitize_name(name, limit) for name in names]
+    taken = set()
+    # first occurrences keep their (clean) name even if a later one collides
+    first = {}
+    for pos, name in enumerate(cleaned):
+        first.setdefault(name.casefold(), pos)
+    taken.update(first)
+    result = []
+    for pos, name in enumerate(cleaned):
+        folded = name.casefold()
+        if first[folded] == pos:
+            result.append(name)
+            continue
+        counter = 2
+        while True:
+            suffix = f" ({counter})"
+            candidate = name[:limit - len(suffix)].rstrip("'") + suffix
+            if candidate.casefold() not in taken:
+                break
+            counter += 1
+        taken.add(candidate.casefold())
+        result.append(candidate)
+    return result
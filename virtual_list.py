@@ -0,0 +1,155 @@
+"""Virtualized list view: a fixed-height Listbox showing a window of a backing array."""
+import tkinter as tk
+from typing import Dict, List, Optional
+
+# status -> (row prefix, foreground colour)
+STATUS_STYLES = {
+    "queued": ("⏳ ", "#6c757d"),
+    "working": ("🔄 ", "#007bff"),
+    "sorted": ("✅ ", "#28a745"),
+    "locked": ("🔒 ", "#e67e22"),
+    "error": ("❌ ", "#dc3545"),
+}
+
+
+class VirtualList:
+    """Keeps all rows in a Python list and only puts the visible `height`
+    rows into the Tk Listbox, so tens of thousands of entries cost no more
+    to show or scroll than ten. delete()/insert() follow tk.Listbox
+    semantics (indices into the backing array); redraws are coalesced to
+    one per idle cycle. Rows may carry a status (see STATUS_STYLES)."""
+    def __init__(self, listbox: tk.Listbox, scrollbar: Optional[tk.Scrollbar] = None):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.height = int(listbox.cget("height"))
+        self.items: List[str] = []
+        self.status: Dict[int, str] = {}
+        self.top = 0
+        self._render_job = None
+        listbox.config(yscrollcommand="")
+        if scrollbar is not None:
+            scrollbar.config(command=self.yview)
+        listbox.bind("<MouseWheel>", self._on_wheel)
+        listbox.bind("<Button-4>", lambda _e: self._scroll(-3))
+        listbox.bind("<Button-5>", lambda _e: self._scroll(3))
+
+    # ---- tk.Listbox-like API on the backing array ----
+    def size(self) -> int:
+        """Number of rows in the backing array."""
+        return len(self.items)
+
+    def _index(self, index) -> int:
+        """Resolve an int or "end"."""
+        return len(self.items) if index == tk.END else int(index)
+
+    def delete(self, first, last=None) -> None:
+        """Remove rows first..last (inclusive), like tk.Listbox.delete."""
+        first = self._index(first)
+        last = first if last is None else min(self._index(last), len(self.items) - 1)
+        if last < first:
+            return
+        del self.items[first:last + 1]
+        removed = last - first + 1
+        self.status = {pos if pos < first else pos - removed: state
+                       for pos, state in self.status.items() if not first <= pos <= last}
+        self._schedule_render()
+
+    def insert(self, index, *items: str) -> None:
+        """Insert rows before `index`, like tk.Listbox.insert."""
+        index = self._index(index)
+        self.items[index:index] = items
+        if self.status:
+            self.status = {pos if pos < index else pos + len(items): state
+                           for pos, state in self.status.items()}
+        self._schedule_render()
+
+    def append(self, items, status: Optional[str] = None) -> None:
+        """Add rows at the end (optionally with a status); the view stays put."""
+        start = len(self.items)
+        self.items.extend(items)
+        if status:
+            self.status.update(dict.fromkeys(range(start, len(self.items)), status))
+        if start < self.top + self.height:
+            self._schedule_render()
+        elif self.scrollbar is not None:
+            total = len(self.items)
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.height) / total))
+
+    def set_items(self, items, status: Optional[str] = None) -> None:
+        """Replace all rows (optionally all with the same status) and scroll to top."""
+        self.items = list(items)
+        self.status = dict.fromkeys(range(len(self.items)), status) if status else {}
+        self.top = 0
+        self._schedule_render()
+
+    def set_item(self, index: int, text: str) -> None:
+        """Replace one row's text; redraws only if the row is on screen."""
+        self.items[index] = text
+        if self.top <= index < self.top + self.height:
+            self._schedule_render()
+
+    def set_status(self, index: int, status: str) -> None:
+        """Change one row's status; redraws only if the row is on screen."""
+        if self.status.get(index) == status:
+            return
+        self.status[index] = status
+        if self.top <= index < self.top + self.height:
+            self._schedule_render()
+
+    def selected_index(self) -> Optional[int]:
+        """Backing-array index of the selected row, if any."""
+        selection = self.listbox.curselection()
+        return self.top + selection[0] if selection else None
+
+    # ---- scrolling ----
+    def yview(self, *args) -> None:
+        """Scrollbar command: ("moveto", fraction) or ("scroll", n, "units"|"pages")."""
+        if not args:
+            return
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * len(self.items)))
+        elif args[0] == "scroll":
+            step = int(args[1]) * (self.height if args[2] == "pages" else 1)
+            self._scroll(step)
+
+    def yview_moveto(self, fraction: float) -> None:
+        """Scroll so `fraction` of the rows are above the view."""
+        self.yview("moveto", fraction)
+
+    def _on_wheel(self, event):
+        """Windows/macOS wheel: three rows per notch."""
+        self._scroll(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def _scroll(self, rows: int):
+        """Scroll by `rows` (negative = up)."""
+        self._scroll_to(self.top + rows)
+        return "break"
+
+    def _scroll_to(self, top: int) -> None:
+        """Make row `top` the first visible one (clamped)."""
+        top = max(0, min(top, len(self.items) - self.height))
+        if top != self.top:
+            self.top = top
+            self._schedule_render()
+
+    # ---- drawing ----
+    def _schedule_render(self) -> None:
+        """Coalesce any number of changes into one redraw."""
+        if self._render_job is None:
+            self._render_job = self.listbox.after_idle(self._render)
+
+    def _render(self) -> None:
+        """Put the visible window of rows into the Listbox."""
+        self._render_job = None
+        self.top = max(0, min(self.top, len(self.items) - self.height))
+        rows = range(self.top, min(self.top + self.height, len(self.items)))
+        self.listbox.delete(0, tk.END)
+        for pos in rows:
+            prefix, colour = STATUS_STYLES.get(self.status.get(pos), ("", ""))
+            self.listbox.insert(tk.END, prefix + self.items[pos])
+            if colour:
+                self.listbox.itemconfig(tk.END, foreground=colour)
+        if self.scrollbar is not None:
+            total = max(len(self.items), 1)
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.height) / total))
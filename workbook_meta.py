@@ -0,0 +1,101 @@
+"""Metadata-only workbook parsing: sheet names and states straight from the zip."""
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, List, NamedTuple, Tuple
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+OFFICE_DOCUMENT_REL = NS_REL + "/officeDocument"
+WORKSHEET_REL = NS_REL + "/worksheet"
+SHARED_STRINGS_REL = NS_REL + "/sharedStrings"
+DEFAULT_WORKBOOK_PART = "xl/workbook.xml"
+
+
+class SheetMeta(NamedTuple):
+    """One <sheet> entry of workbook.xml, in workbook order."""
+    name: str
+    state: str
+    sheet_id: str
+    rel_id: str
+
+
+def workbook_part_name(zf: zipfile.ZipFile) -> str:
+    """Return the zip member holding the workbook part (usually xl/workbook.xml)."""
+    try:
+        root = ET.fromstring(zf.read("_rels/.rels"))
+    except (KeyError, ET.ParseError):
+        return DEFAULT_WORKBOOK_PART
+    for rel in root.iter(f"{{{NS_PKG_REL}}}Relationship"):
+        if rel.get("Type") == OFFICE_DOCUMENT_REL:
+            return posixpath.normpath(rel.get("Target", DEFAULT_WORKBOOK_PART).lstrip("/"))
+    return DEFAULT_WORKBOOK_PART
+
+
+def parse_sheets_xml(data: bytes) -> List[SheetMeta]:
+    """Parse the <sheets> list out of workbook.xml bytes."""
+    root = ET.fromstring(data)
+    sheets = []
+    for sheet in root.iter(f"{{{NS_MAIN}}}sheet"):
+        sheets.append(SheetMeta(
+            name=sheet.get("name", ""),
+            state=sheet.get("state", "visible"),
+            sheet_id=sheet.get("sheetId", ""),
+            rel_id=sheet.get(f"{{{NS_REL}}}id", ""),
+        ))
+    return sheets
+
+
+def read_sheet_meta(path: str) -> List[SheetMeta]:
+    """Read sheet metadata without loading any worksheet.
+    Only _rels/.rels and workbook.xml are inflated, so this stays fast for
+    workbooks of any size. Raises zipfile.BadZipFile/KeyError/ET.ParseError
+    for files that are not readable xlsx packages."""
+    with zipfile.ZipFile(path) as zf:
+        return parse_sheets_xml(zf.read(workbook_part_name(zf)))
+
+
+def read_package_meta(path: str) -> Tuple[List[SheetMeta], Dict[str, int]]:
+    """Sheet metadata plus the uncompressed size of every part, from one open
+    of the zip (sizes come from the central directory, nothing is inflated)."""
+    with zipfile.ZipFile(path) as zf:
+        sizes = {info.filename: info.file_size for info in zf.infolist()}
+        return parse_sheets_xml(zf.read(workbook_part_name(zf))), sizes
+
+
+def read_sheet_names(path: str) -> List[str]:
+    """Return sheet names in workbook order using the metadata-only parser."""
+    return [sheet.name for sheet in read_sheet_meta(path)]
+
+
+def read_part_rels(zf: zipfile.ZipFile, part: str) -> Dict[str, Tuple[str, str]]:
+    """{rel id: (type, target part)} from the .rels of `part` ({} if none)."""
+    directory, base = posixpath.split(part)
+    try:
+        root = ET.fromstring(zf.read(posixpath.join(directory, "_rels", base + ".rels")))
+    except (KeyError, ET.ParseError):
+        return {}
+    rels = {}
+    for rel in root.iter(f"{{{NS_PKG_REL}}}Relationship"):
+        target = rel.get("Target", "")
+        if rel.get("TargetMode") == "External" or not target:
+            continue
+        target = target.lstrip("/") if target.startswith("/") else posixpath.join(directory, target)
+        rels[rel.get("Id", "")] = (rel.get("Type", ""), posixpath.normpath(target))
+    return rels
+
+
+def read_sheet_parts(zf: zipfile.ZipFile) -> Tuple[List[Tuple[SheetMeta, str]], str]:
+    """Worksheets as (SheetMeta, zip member) in workbook order (chartsheets
+    and dialog sheets left out), plus the sharedStrings member ("" if none)."""
+    workbook_part = workbook_part_name(zf)
+    rels = read_part_rels(zf, workbook_part)
+    sheets = []
+    for sheet in parse_sheets_xml(zf.read(workbook_part)):
+        rel_type, target = rels.get(sheet.rel_id, ("", ""))
+        if rel_type == WORKSHEET_REL and target in zf.NameToInfo:
+            sheets.append((sheet, target))
+    shared = next((target for rel_type, target in rels.values()
+                   if rel_type == SHARED_STRINGS_REL and target in zf.NameToInfo), "")
+    return sheets, shared
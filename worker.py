@@ -1,55 +1,96 @@
 """Background worker for batch Excel processing."""
 import threading
-from typing import Callable, List
+from typing import Callable, List, Optional
+
+from retry_queue import DEFAULT_RETRY, RetryPolicy, RetryQueue
 
 class BatchWorker(threading.Thread):
     """Threaded worker for processing a list of file paths.
     callback signature:
         progress_cb(idx:int, total:int, path:str, state:str)
-    states: "started", "locked", "loaded", "sorted", "saved", "error", "done" """
-    def __init__(self, paths: List[str], handler_cls, callback: Callable):
+    states: "started", "locked", "loaded", "sorted", "saved", "error", "done"
+    key_func: optional sort key (see sheet_rules); alphabetical when None.
+    Locked files are reported as "locked", parked in a RetryQueue and
+    processed once released ("started"... again), or reported as an error
+    when still locked at the retry_policy deadline."""
+    def __init__(self, paths: List[str], handler_cls, callback: Callable,
+                 key_func: Optional[Callable] = None, retry_policy: RetryPolicy = DEFAULT_RETRY):
         super().__init__(daemon=True)
         self.paths = list(paths)
         self.handler_cls = handler_cls
         self.callback = callback
+        self.key_func = key_func
+        self.retry = RetryQueue(retry_policy)
+        self._positions = {path: idx for idx, path in enumerate(self.paths, start=1)}
         self._stop = False
 
     def stop(self):
         """Request stop (best effort)."""
         self._stop = True
 
+    def _process(self, idx: int, total: int, path: str) -> bool:
+        """Load and sort one file; False if it is locked (caller parks it)."""
+        self.callback(idx, total, path, "started")
+        try:
+            # the worker does not save, so skip the protective backup copy
+            handler = self.handler_cls(path, backup=False)
+            loaded = handler.load_workbook()
+        except Exception as exc:  # pragma: no cover - top-level safety
+            self.callback(idx, total, path, f"error:{exc}")
+            return True
+
+        if getattr(handler, "file_open_locked", False):
+            return False
+
+        if not loaded:
+            self.callback(idx, total, path, "error:load_failed")
+            return True
+        self.callback(idx, total, path, "loaded")
+
+        try:
+            if self.key_func is not None:
+                ok = handler.apply_custom_sort(self.key_func)
+            else:
+                ok = handler.sort_sheets_alphabetically()
+            if not ok:
+                self.callback(idx, total, path, "error:sort_failed")
+                return True
+            self.callback(idx, total, path, "sorted")
+        except Exception as exc:  # pragma: no cover
+            self.callback(idx, total, path, f"error:{exc}")
+            return True
+        # saving left to caller (UI) via handler methods if needed
+        self.callback(idx, total, path, "done")
+        return True
+
+    def _park(self, idx: int, total: int, path: str) -> None:
+        """Report a locked file and queue it for a retry."""
+        self.callback(idx, total, path, "locked")
+        self.retry.park(path)
+
+    def _retry(self, released: List[str], total: int) -> None:
+        """Process parked files whose lock has gone away; report expired ones."""
+        for path in released:
+            idx = self._positions[path]
+            if not self._process(idx, total, path):
+                # locked again between probe and load: back to the end of the line
+                self._park(idx, total, path)
+        for path in self.retry.expired:
+            self.callback(self._positions[path], total, path, "error:still locked at deadline")
+        self.retry.expired.clear()
+
     def run(self):
         total = len(self.paths)
         for idx, path in enumerate(self.paths, start=1):
             if self._stop:
                 break
-            self.callback(idx, total, path, "started")
-            try:
-                handler = self.handler_cls(path)
-                loaded = handler.load_workbook()
-            except Exception as exc:  # pragma: no cover - top-level safety
-                self.callback(idx, total, path, f"error:{exc}")
-                continue
-
-            if getattr(handler, "file_open_locked", False):
-                self.callback(idx, total, path, "locked")
-                continue
-
-            if not loaded:
-                self.callback(idx, total, path, "error:load_failed")
-                continue
-            self.callback(idx, total, path, "loaded")
-
-            try:
-                ok = handler.sort_sheets_alphabetically()
-                if not ok:
-                    self.callback(idx, total, path, "error:sort_failed")
-                    continue
-                self.callback(idx, total, path, "sorted")
-            except Exception as exc:  # pragma: no cover
-                self.callback(idx, total, path, f"error:{exc}")
-                continue
-            # saving left to caller (UI) via handler methods if needed
-            self.callback(idx, total, path, "done")
+            if not self._process(idx, total, path):
+                self._park(idx, total, path)
+            # locked files are re-checked between files, never blocking the batch
+            self._retry(self.retry.pop_released(), total)
+        # main pass done: wait for the remaining locked files until the deadline
+        while len(self.retry) and not self._stop:
+            self._retry(self.retry.wait_released(lambda: self._stop), total)
+        self._retry([], total)
         # finished
         self.callback(total, total, "", "finished")
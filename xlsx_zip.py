@@ -0,0 +1,426 @@
+"""Zip-level xlsx rewriting: replace a few parts and copy everything else raw."""
+import html
+import os
+import re
+import shutil
+import struct
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from atomic_save import commit_temp, discard_temp, temp_path_for
+from workbook_meta import workbook_part_name
+
+CHUNK_SIZE = 1024 * 1024
+ZIP32_LIMIT = 0xFFFFFFFF
+# zlib levels offered for saves: "fastest" for intermediate files, "best" for archives
+COMPRESSION_LEVELS = {"fastest": 1, "default": 6, "best": 9}
+DEFAULT_LEVEL = COMPRESSION_LEVELS["default"]
+DEFLATE_BLOCK = 1024 * 1024      # parts above this are split into blocks deflated in parallel
+DEFLATE_WINDOW = 64 * 1024 * 1024  # uncompressed bytes in flight while re-deflating an archive
+
+# zlib releases the GIL while compressing, so threads use every core.
+_DEFLATE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="deflate")
+
+SHEETS_BLOCK_RE = re.compile(rb"(<(?:\w+:)?sheets\b[^>]*>)(.*?)(</(?:\w+:)?sheets>)", re.S)
+SHEET_RE = re.compile(
+    rb"<(?:\w+:)?sheet\b[^>]*?/>|<(?:\w+:)?sheet\b[^>]*>.*?</(?:\w+:)?sheet>", re.S)
+NAME_ATTR_RE = re.compile(rb"\bname=([\"'])(.*?)\1", re.S)
+_LOCAL_SHEET_ID_RE = re.compile(rb"\blocalSheetId=\"(\d+)\"")
+_BOOK_VIEW_INDEX_RE = re.compile(rb"\b(activeTab|firstSheet)=\"(\d+)\"")
+
+
+def xml_attr_unescape(raw: bytes) -> str:
+    """Decode an XML attribute value to text (named and numeric references).
+    html instead of xml.sax.saxutils: the latter drags in urllib at import."""
+    return html.unescape(raw.decode("utf-8"))
+
+
+def xml_attr_escape(text: str) -> bytes:
+    """Encode text for use inside a double-quoted XML attribute."""
+    return html.escape(text, quote=True).encode("utf-8")
+
+
+def reorder_sheets_xml(data: bytes, new_order: Sequence[str]) -> bytes:
+    """Return workbook.xml bytes with <sheet> entries in `new_order`.
+    Everything outside <sheets> is kept byte for byte except sheet-index
+    attributes (definedName localSheetId, bookView activeTab/firstSheet),
+    which are remapped so they keep pointing at the same sheets."""
+    block = SHEETS_BLOCK_RE.search(data)
+    if not block:
+        raise ValueError("workbook.xml has no <sheets> element")
+    elements = SHEET_RE.findall(block.group(2))
+    names = []
+    for element in elements:
+        match = NAME_ATTR_RE.search(element)
+        names.append(xml_attr_unescape(match.group(2)) if match else "")
+    if sorted(names) != sorted(new_order) or len(set(new_order)) != len(names):
+        raise ValueError("new sheet order does not match the workbook's sheets")
+
+    position = {name: idx for idx, name in enumerate(names)}
+    old_to_new = [0] * len(names)
+    for new_idx, name in enumerate(new_order):
+        old_to_new[position[name]] = new_idx
+
+    body = b"".join(elements[position[name]] for name in new_order)
+    out = data[:block.start(2)] + body + data[block.end(2):]
+
+    def _remap_local(match):
+        old = int(match.group(1))
+        if old >= len(old_to_new):
+            return match.group(0)
+        return b'localSheetId="%d"' % old_to_new[old]
+
+    def _remap_view(match):
+        old = int(match.group(2))
+        if old >= len(old_to_new):
+            return match.group(0)
+        return match.group(1) + b'="%d"' % old_to_new[old]
+
+    out = _LOCAL_SHEET_ID_RE.sub(_remap_local, out)
+    return _BOOK_VIEW_INDEX_RE.sub(_remap_view, out)
+
+
+def _dos_datetime(date_time) -> tuple:
+    """Convert a ZipInfo.date_time tuple to (dos_time, dos_date)."""
+    year, month, day, hour, minute, second = date_time
+    year = max(year, 1980)
+    return ((hour << 11) | (minute << 5) | (second // 2),
+            ((year - 1980) << 9) | (month << 5) | day)
+
+
+def raw_member_offset(src_fp, info: zipfile.ZipInfo) -> int:
+    """Return the file offset of a member's compressed data."""
+    src_fp.seek(info.header_offset)
+    header = src_fp.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def _deflate_block(block, level: int, last: bool) -> bytes:
+    """Raw-deflate one block; all but the last end on a byte boundary
+    (Z_SYNC_FLUSH) so the blocks concatenate into a single deflate stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class PendingPart(NamedTuple):
+    """A part being deflated on the pool: block futures in order, CRC and size."""
+    blocks: List[Future]
+    crc: int
+    file_size: int
+
+
+def deflate_parallel(data: bytes, level: int = DEFAULT_LEVEL) -> PendingPart:
+    """Start deflating `data` on the shared pool, DEFLATE_BLOCK bytes per task
+    (pigz-style; costs well under 1% in ratio). Returns at once; the CRC is
+    computed here while the blocks compress."""
+    view = memoryview(data)
+    starts = range(0, len(data), DEFLATE_BLOCK) if data else [0]
+    blocks = [_DEFLATE_POOL.submit(_deflate_block, view[start:start + DEFLATE_BLOCK], level,
+                                   start + DEFLATE_BLOCK >= len(data))
+              for start in starts]
+    return PendingPart(blocks, zlib.crc32(data), len(data))
+
+
+class ZipPartWriter:
+    """Minimal zip writer that can copy members raw (without recompressing).
+    zipfile.ZipFile always inflates and re-deflates on copy; for a reorder
+    that touches only workbook.xml that is nearly all of the save time."""
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.entries: List[tuple] = []
+
+    def _write_header(self, info: zipfile.ZipInfo, method: int, crc: int,
+                      compress_size: int, file_size: int):
+        """Write a local file header and remember the central directory entry."""
+        offset = self.fp.tell()
+        name = info.filename.encode("utf-8")
+        flags = 0x800 if not info.filename.isascii() else 0
+        dos_time, dos_date = _dos_datetime(info.date_time)
+        self.fp.write(struct.pack(
+            "<4sHHHHHIIIHH", b"PK\x03\x04", 20, flags, method, dos_time, dos_date,
+            crc, compress_size, file_size, len(name), 0))
+        self.fp.write(name)
+        self.entries.append((name, flags, method, dos_time, dos_date, crc,
+                             compress_size, file_size, info.external_attr, offset))
+
+    def copy_raw(self, src_fp, info: zipfile.ZipInfo):
+        """Copy one member's compressed bytes from an open source zip file."""
+        src_fp.seek(raw_member_offset(src_fp, info))
+        self.write_raw(info, info.compress_type, info.CRC, info.compress_size,
+                       info.file_size, src_fp)
+
+    def write_raw(self, info: zipfile.ZipInfo, method: int, crc: int,
+                  compress_size: int, file_size: int, src_fp):
+        """Write `compress_size` already-compressed bytes read from `src_fp`."""
+        self._write_header(info, method, crc, compress_size, file_size)
+        remaining = compress_size
+        while remaining:
+            chunk = src_fp.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"truncated member {info.filename}")
+            self.fp.write(chunk)
+            remaining -= len(chunk)
+
+    def write_compressed(self, info: zipfile.ZipInfo, compressed: bytes,
+                         crc: int, file_size: int):
+        """Write an already raw-deflated payload."""
+        self._write_header(info, zipfile.ZIP_DEFLATED, crc, len(compressed), file_size)
+        self.fp.write(compressed)
+
+    def write_pending(self, info: zipfile.ZipInfo, pending: PendingPart):
+        """Write a part started with deflate_parallel (waits for its blocks)."""
+        blocks = [future.result() for future in pending.blocks]
+        self._write_header(info, zipfile.ZIP_DEFLATED, pending.crc,
+                           sum(len(block) for block in blocks), pending.file_size)
+        for block in blocks:
+            self.fp.write(block)
+
+    def write_bytes(self, info: zipfile.ZipInfo, data: bytes, level: int = DEFAULT_LEVEL):
+        """Deflate (in parallel blocks) and write a new payload for `info`."""
+        self.write_pending(info, deflate_parallel(data, level))
+
+    def begin_streamed(self, info: zipfile.ZipInfo) -> int:
+        """Start a deflated member whose CRC and sizes are not known yet;
+        returns the header offset for end_streamed()."""
+        header_offset = self.fp.tell()
+        self._write_header(info, zipfile.ZIP_DEFLATED, 0, 0, 0)
+        return header_offset
+
+    def end_streamed(self, info: zipfile.ZipInfo, header_offset: int, crc: int,
+                     compress_size: int, file_size: int):
+        """Patch the CRC and sizes of a member started with begin_streamed()."""
+        if file_size >= ZIP32_LIMIT or compress_size >= ZIP32_LIMIT:
+            raise zipfile.LargeZipFile(f"{info.filename} needs zip64")
+        end = self.fp.tell()
+        self.fp.seek(header_offset + 14)
+        self.fp.write(struct.pack("<III", crc, compress_size, file_size))
+        self.fp.seek(end)
+        entry = self.entries[-1]
+        self.entries[-1] = entry[:5] + (crc, compress_size, file_size) + entry[8:]
+
+    def write_chunks(self, info: zipfile.ZipInfo, chunks: Iterable[bytes], level: int = 6):
+        """Deflate an iterable of chunks, streaming; the local header sizes and
+        CRC are patched in afterwards, so memory stays at one chunk."""
+        header_offset = self.begin_streamed(info)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            out = compressor.compress(chunk)
+            compress_size += len(out)
+            self.fp.write(out)
+        out = compressor.flush()
+        compress_size += len(out)
+        self.fp.write(out)
+        self.end_streamed(info, header_offset, crc, compress_size, file_size)
+
+    def close(self):
+        """Write the central directory."""
+        cd_offset = self.fp.tell()
+        for (name, flags, method, dos_time, dos_date, crc, compress_size,
+             file_size, external_attr, offset) in self.entries:
+            self.fp.write(struct.pack(
+                "<4sHHHHHHIIIHHHHHII", b"PK\x01\x02", 20, 20, flags, method,
+                dos_time, dos_date, crc, compress_size, file_size, len(name),
+                0, 0, 0, 0, external_attr, offset))
+            self.fp.write(name)
+        cd_size = self.fp.tell() - cd_offset
+        self.fp.write(struct.pack(
+            "<4sHHHHIIH", b"PK\x05\x06", 0, 0, len(self.entries),
+            len(self.entries), cd_size, cd_offset, 0))
+
+
+def _needs_zip64(zf: zipfile.ZipFile, src_path: str, replacements: Dict[str, bytes]) -> bool:
+    """True when the output could exceed what ZipPartWriter writes (no zip64)."""
+    infos = zf.infolist()
+    if len(infos) >= 0xFFFF:
+        return True
+    budget = os.path.getsize(src_path) + sum(len(data) for data in replacements.values())
+    return budget >= ZIP32_LIMIT or any(info.file_size >= ZIP32_LIMIT for info in infos)
+
+
+def _rewrite_with_zipfile(zf: zipfile.ZipFile, dst, replacements: Dict[str, bytes],
+                          transforms: Dict[str, Callable], level: int):
+    """Fallback path using zipfile (recompresses everything, supports zip64)."""
+    with zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED, compresslevel=level) as out:
+        for info in zf.infolist():
+            data = replacements.get(info.filename)
+            transform = transforms.get(info.filename)
+            if data is not None:
+                out.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+                continue
+            with zf.open(info) as src, out.open(info, "w", force_zip64=True) as target:
+                if transform is None:
+                    shutil.copyfileobj(src, target, CHUNK_SIZE)
+                else:
+                    for chunk in transform(src):
+                        target.write(chunk)
+
+
+def rewrite_parts(src_path: str, dst_path: str, replacements: Dict[str, bytes],
+                  level: int = DEFAULT_LEVEL, transforms: Optional[Dict[str, Callable]] = None
+                  ) -> Dict[str, Tuple[int, int, int]]:
+    """Write a copy of `src_path` to `dst_path` with some members replaced.
+    `replacements` maps member -> new bytes; `transforms` maps member ->
+    callable(stream) yielding the new content in chunks, for parts too large
+    to hold in memory. Every other member is copied raw, so the cost is one
+    sequential read and write of the file plus deflating the new parts, which
+    all start compressing in parallel before the first byte is written.
+    Returns {name: (CRC, compressed size, size)} of the raw-copied members,
+    for atomic_save.verify_zip (empty on the recompressing zip64 path)."""
+    transforms = transforms or {}
+    unchanged = {}
+    with zipfile.ZipFile(src_path) as zf, open(dst_path, "wb") as dst:
+        if _needs_zip64(zf, src_path, replacements):
+            _rewrite_with_zipfile(zf, dst, replacements, transforms, level)
+            return unchanged
+        writer = ZipPartWriter(dst)
+        pending = {name: deflate_parallel(data, level) for name, data in replacements.items()
+                   if name in zf.NameToInfo}
+        with open(src_path, "rb") as src_fp:
+            for info in zf.infolist():
+                part = pending.get(info.filename)
+                transform = transforms.get(info.filename)
+                if part is not None:
+                    writer.write_pending(info, part)
+                elif transform is not None:
+                    with zf.open(info) as stream:
+                        writer.write_chunks(info, transform(stream), level)
+                else:
+                    writer.copy_raw(src_fp, info)
+                    unchanged[info.filename] = (info.CRC, info.compress_size, info.file_size)
+        writer.close()
+    return unchanged
+
+
+def deflate_archive(src: BinaryIO, dst_path, level: int = DEFAULT_LEVEL) -> None:
+    """Write the zip in `src` (typically stored, i.e. uncompressed) to
+    `dst_path` (a path or an empty, seekable binary file) with every member
+    deflated at `level` on the parallel pool. Members are streamed in
+    DEFLATE_BLOCK pieces, submitted ahead up to DEFLATE_WINDOW bytes, and
+    written in their original order."""
+    if not isinstance(dst_path, (str, os.PathLike)):
+        _deflate_into(src, dst_path, level)
+        return
+    with open(dst_path, "wb") as dst:
+        _deflate_into(src, dst, level)
+
+
+def _deflate_into(src: BinaryIO, dst: BinaryIO, level: int) -> None:
+    """deflate_archive into an open file."""
+    with zipfile.ZipFile(src) as zf:
+        infos = zf.infolist()
+        if (len(infos) >= 0xFFFF or sum(info.file_size for info in infos) >= ZIP32_LIMIT):
+            with zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED, compresslevel=level,
+                                 allowZip64=True) as out:
+                for info in infos:
+                    with zf.open(info) as part, out.open(info, "w", force_zip64=True) as target:
+                        shutil.copyfileobj(part, target, CHUNK_SIZE)
+            return
+        writer = ZipPartWriter(dst)
+        # archive order: (info, None) starts a member, (None, block) is one of
+        # its deflated blocks, (info, crc) ends it
+        in_flight = deque()
+        window = 0
+
+        def _write_next():
+            nonlocal window, header_offset, compress_size
+            info, item = in_flight.popleft()
+            if info is None:
+                block = item.result()
+                writer.fp.write(block)
+                compress_size += len(block)
+                window -= DEFLATE_BLOCK
+            elif item is None:
+                header_offset = writer.begin_streamed(info)
+                compress_size = 0
+            else:
+                writer.end_streamed(info, header_offset, item, compress_size, info.file_size)
+
+        header_offset = compress_size = 0
+        for info in infos:
+            in_flight.append((info, None))
+            crc = 0
+            with zf.open(info) as part:
+                position = 0
+                while True:
+                    block = part.read(DEFLATE_BLOCK)
+                    if not block and position < info.file_size:
+                        raise zipfile.BadZipFile(f"truncated member {info.filename}")
+                    position += len(block)
+                    crc = zlib.crc32(block, crc)
+                    last = position >= info.file_size
+                    in_flight.append((None, _DEFLATE_POOL.submit(_deflate_block, block, level, last)))
+                    window += DEFLATE_BLOCK
+                    while window > DEFLATE_WINDOW:
+                        _write_next()
+                    if last:
+                        break
+            in_flight.append((info, crc))
+        while in_flight:
+            _write_next()
+        writer.close()
+
+
+_STATE_ATTR_RE = re.compile(rb"\s+state=([\"'])[^\"']*\1")
+
+
+def set_sheet_states_xml(data: bytes, states: Dict[str, str]) -> bytes:
+    """Return workbook.xml bytes with <sheet state> set per `states`
+    (name -> "visible" | "hidden" | "veryHidden")."""
+    block = SHEETS_BLOCK_RE.search(data)
+    if not block:
+        raise ValueError("workbook.xml has no <sheets> element")
+
+    def _set_state(match):
+        element = match.group(0)
+        name = NAME_ATTR_RE.search(element)
+        state = states.get(xml_attr_unescape(name.group(2))) if name else None
+        if state is None:
+            return element
+        element = _STATE_ATTR_RE.sub(b"", element)
+        if state == "visible":
+            return element
+        return element[:name.end()] + b' state="' + state.encode("ascii") + b'"' + element[name.end():]
+
+    body = SHEET_RE.sub(_set_state, block.group(2))
+    return data[:block.start(2)] + body + data[block.end(2):]
+
+
+def rewrite_workbook_xml(path: str, transform: Callable[[bytes], bytes],
+                         dst_path: str = "") -> bool:
+    """Apply `transform` to workbook.xml and copy every other part raw.
+    Writes to `dst_path`, or in place when no destination is given; either
+    way through a verified temp file (see atomic_save.commit_temp)."""
+    target = dst_path or path
+    tmp_path = temp_path_for(target)
+    try:
+        with zipfile.ZipFile(path) as zf:
+            part = workbook_part_name(zf)
+            data = transform(zf.read(part))
+        unchanged = rewrite_parts(path, tmp_path, {part: data})
+        commit_temp(tmp_path, target, unchanged, required=(part,))
+        return True
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as err:
+        print(f"[ERROR while rewriting workbook.xml] {path}: {err}")
+        discard_temp(tmp_path)
+        return False
+
+
+def reorder_sheets_in_file(path: str, new_order: Sequence[str], dst_path: str = "") -> bool:
+    """Reorder sheets of `path` by rewriting only workbook.xml."""
+    return rewrite_workbook_xml(path, lambda data: reorder_sheets_xml(data, new_order), dst_path)
+
+
+def set_sheet_states_in_file(path: str, states: Dict[str, str], dst_path: str = "") -> bool:
+    """Change sheet visibility of `path` by rewriting only workbook.xml."""
+    return rewrite_workbook_xml(path, lambda data: set_sheet_states_xml(data, states), dst_path)